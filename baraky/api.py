@@ -0,0 +1,335 @@
+import asyncio
+import hashlib
+import json
+import logging
+import uuid
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+import numpy as np
+from aiohttp import web
+
+from baraky.models import EstateOverview, EstateReaction
+
+logger = logging.getLogger("baraky.api")
+
+SORT_KEYS = ("id", "price", "commute")
+MAX_PAGE_SIZE = 500
+
+
+class EstateIndex:
+    """
+    Stored estates held in memory, with the filtered values as numpy
+    columns. `refresh` loads only the estates whose stored objects changed
+    since the last refresh, e.g. saved by a running watcher.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        self._estates: Dict[str, EstateOverview] = {}
+        self._modified: Dict[str, datetime] = {}
+        self._columns = None
+        # a restarted server must not reuse the versions of the last one
+        self._epoch = uuid.uuid4().hex[:8]
+        self._changes = 0
+
+    def __len__(self):
+        return len(self._estates)
+
+    @property
+    def version(self) -> str:
+        return f"{self._epoch}-{self._changes}"
+
+    def get(self, estate_id: str) -> EstateOverview | None:
+        return self._estates.get(estate_id)
+
+    async def refresh(self) -> int:
+        modified = await self.storage.list_modified()
+        changed = [
+            estate_id
+            for estate_id, modified_at in modified.items()
+            if self._modified.get(estate_id) != modified_at
+        ]
+        removed = [
+            estate_id for estate_id in self._estates if estate_id not in modified
+        ]
+        if changed:
+            self.upsert(await self.storage.get_many(changed))
+        if removed:
+            self.remove(removed)
+        self._modified = modified
+        if changed or removed:
+            logger.info(
+                "Index of %d estates refreshed: %d changed, %d removed",
+                len(self._estates),
+                len(changed),
+                len(removed),
+            )
+        return len(changed) + len(removed)
+
+    def upsert(self, estates: List[EstateOverview]):
+        for estate in estates:
+            self._estates[estate.id] = estate
+        self._columns = None
+        self._changes += 1
+
+    def remove(self, estate_ids):
+        for estate_id in estate_ids:
+            self._estates.pop(estate_id, None)
+        self._columns = None
+        self._changes += 1
+
+    def _build(self):
+        if self._columns is not None:
+            return self._columns
+        estates = list(self._estates.values())
+        gps = np.array([e.gps for e in estates], dtype=np.float64).reshape(-1, 2)
+        self._columns = {
+            "id": np.array([e.id for e in estates], dtype=str),
+            "price": np.array([e.price for e in estates], dtype=np.float64),
+            "commute": np.array([_commute(e) for e in estates], dtype=np.float64),
+            "lat": gps[:, 0],
+            "lon": gps[:, 1],
+        }
+        return self._columns
+
+    def query(
+        self,
+        min_price: float | None = None,
+        max_price: float | None = None,
+        min_commute: float | None = None,
+        max_commute: float | None = None,
+        bbox: Tuple[float, float, float, float] | None = None,
+        sort: str = "id",
+        offset: int = 0,
+        limit: int = 50,
+    ) -> Tuple[int, List[EstateOverview]]:
+        """
+        Estates matching all the given ranges, `bbox` is (min lat, min lon,
+        max lat, max lon). Sorted by a key of SORT_KEYS, descending with a
+        leading "-". Returns the number of matches and the requested page.
+        """
+        columns = self._build()
+        mask = np.ones(len(columns["id"]), dtype=bool)
+        ranges = [
+            ("price", min_price, max_price),
+            ("commute", min_commute, max_commute),
+        ]
+        if bbox is not None:
+            min_lat, min_lon, max_lat, max_lon = bbox
+            ranges += [("lat", min_lat, max_lat), ("lon", min_lon, max_lon)]
+        for name, low, high in ranges:
+            # estates without the value (NaN) never match a range
+            if low is not None:
+                mask &= columns[name] >= low
+            if high is not None:
+                mask &= columns[name] <= high
+
+        matching = np.flatnonzero(mask)
+        key = sort.removeprefix("-")
+        descending = sort.startswith("-")
+        values = columns[key][matching]
+        if key == "id":
+            order = np.argsort(values, kind="stable")
+            if descending:
+                order = order[::-1]
+        else:
+            # missing values stay last in both directions
+            order = np.argsort(-values if descending else values, kind="stable")
+        page = matching[order][offset : offset + limit]
+        return len(matching), [self._estates[columns["id"][i]] for i in page]
+
+
+def _commute(estate: EstateOverview) -> float:
+    commute = estate.features.get("pid_commute_time")
+    time_minutes = getattr(commute, "time_minutes", None)
+    return np.nan if time_minutes is None else time_minutes
+
+
+def summarize_reactions(reactions: List[EstateReaction]) -> Dict[str, Dict]:
+    by_estate = {}
+    for reaction in reactions:
+        by_estate.setdefault(reaction.estate_id, {})[reaction.username] = (
+            reaction.reaction
+        )
+    return {
+        estate_id: {"counts": dict(Counter(users.values())), "users": users}
+        for estate_id, users in sorted(by_estate.items())
+    }
+
+
+class ApiServer:
+    """
+    Read-only JSON API over an EstateIndex. Response bodies are cached
+    until the data changes and carry an ETag, so a repeated request with
+    If-None-Match costs a 304.
+    """
+
+    def __init__(
+        self,
+        index: EstateIndex,
+        reactions_storage=None,
+        host: str = "127.0.0.1",
+        port: int = 8080,
+        refresh_sec: float = 60,
+        max_cached: int = 1024,
+    ):
+        self.index = index
+        self.reactions_storage = reactions_storage
+        self.host = host
+        self.port = port
+        self.refresh_sec = refresh_sec
+        self.max_cached = max_cached
+        self._reactions: Dict[str, Dict] = {}
+        self._reactions_changes = 0
+        self._cache: Dict[str, Tuple[str, bytes]] = {}
+        self._cache_version = None
+        self._runner = None
+        self._refresh_task = None
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.add_routes(
+            [
+                web.get("/estates", self.estates),
+                web.get("/estates/{estate_id}", self.estate),
+                web.get("/reactions", self.reactions),
+            ]
+        )
+        return app
+
+    async def start(self):
+        await self.refresh()
+        self._runner = web.AppRunner(self.create_app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self._refresh_task = asyncio.create_task(self._refresh_loop())
+        logger.info(
+            "Serving %d estates on http://%s:%d/estates",
+            len(self.index),
+            self.host,
+            self.port,
+        )
+
+    async def stop(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def refresh(self):
+        await self.index.refresh()
+        if self.reactions_storage is None:
+            return
+        loop = asyncio.get_event_loop()
+        reactions = await loop.run_in_executor(None, self.reactions_storage.read_all)
+        summary = summarize_reactions(reactions)
+        if summary != self._reactions:
+            self._reactions = summary
+            self._reactions_changes += 1
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_sec)
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception("Failed to refresh the estate index")
+
+    async def estates(self, request):
+        return self._cached(request, lambda: self._query_estates(request.query))
+
+    async def estate(self, request):
+        estate_id = request.match_info["estate_id"]
+        if self.index.get(estate_id) is None:
+            raise web.HTTPNotFound(
+                text=json.dumps({"error": f"Estate {estate_id} not found"}),
+                content_type="application/json",
+            )
+
+        def body():
+            estate = self.index.get(estate_id).model_dump(mode="json")
+            return estate | {"reactions": self._reactions.get(estate_id)}
+
+        return self._cached(request, body)
+
+    async def reactions(self, request):
+        return self._cached(request, lambda: self._reactions)
+
+    def _query_estates(self, params):
+        try:
+            query = _parse_query(params)
+        except ValueError as e:
+            raise web.HTTPBadRequest(
+                text=json.dumps({"error": str(e)}), content_type="application/json"
+            )
+        total, estates = self.index.query(**query)
+        return {
+            "total": total,
+            "offset": query["offset"],
+            "limit": query["limit"],
+            "items": [estate.model_dump(mode="json") for estate in estates],
+        }
+
+    def _cached(self, request, make_body):
+        version = (self.index.version, self._reactions_changes)
+        if version != self._cache_version or len(self._cache) >= self.max_cached:
+            self._cache.clear()
+            self._cache_version = version
+        key = request.path_qs
+        cached = self._cache.get(key)
+        if cached is None:
+            body = json.dumps(make_body(), ensure_ascii=False).encode("utf-8")
+            etag = f'"{hashlib.sha1(body).hexdigest()[:16]}"'
+            cached = self._cache[key] = (etag, body)
+
+        etag, body = cached
+        if_none_match = request.headers.get("If-None-Match", "")
+        if etag in if_none_match or if_none_match.strip() == "*":
+            return web.Response(status=304, headers={"ETag": etag})
+        return web.Response(
+            body=body,
+            headers={"ETag": etag, "Content-Type": "application/json; charset=utf-8"},
+        )
+
+
+def _parse_query(params) -> Dict:
+    query = {}
+    for name in ("min_price", "max_price", "min_commute", "max_commute"):
+        if name in params:
+            query[name] = _number(params, name)
+    if "bbox" in params:
+        bbox = params["bbox"].split(",")
+        if len(bbox) != 4:
+            raise ValueError("bbox must be min_lat,min_lon,max_lat,max_lon")
+        query["bbox"] = tuple(_number({"bbox": value}, "bbox") for value in bbox)
+
+    query["sort"] = params.get("sort", "id")
+    if query["sort"].removeprefix("-") not in SORT_KEYS:
+        raise ValueError(f"sort must be one of {', '.join(SORT_KEYS)}")
+    query["offset"] = _integer(params, "offset", 0)
+    query["limit"] = _integer(params, "limit", 50)
+    if query["offset"] < 0 or not 0 < query["limit"] <= MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be 1-{MAX_PAGE_SIZE} and offset positive")
+    return query
+
+
+def _integer(params, name, default) -> int:
+    try:
+        return int(params.get(name, default))
+    except ValueError:
+        raise ValueError(f"{name} must be an integer") from None
+
+
+def _number(params, name, default=None) -> float:
+    value = params.get(name)
+    if value is None:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError(f"{name} must be a number") from None
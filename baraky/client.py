@@ -1,12 +1,19 @@
+import hashlib
+import json
 import logging
 import math
 import aiohttp
 import asyncio
+import numpy as np
 
 from typing import List, Dict
 from baraky import settings
+from baraky.metrics import HTTP_REQUESTS, PAGE_FETCH_SECONDS
+from baraky.profiling import TRACER
 
-from baraky.models import EstateOverview
+from baraky.models import EstateOverview, QueryFingerprint
+from baraky.http_cache import HttpCache
+from baraky.offload import CpuPool
 from pydantic import ValidationError
 
 logger = logging.getLogger("baraky.client")
@@ -19,6 +26,8 @@ class SrealityEstatesClient:
         headers: Dict = {},
         base_url: str | None = None,
         detail_url: str | None = None,
+        cpu_pool: CpuPool | None = None,
+        http_cache: HttpCache | None = None,
     ):
         defaults = settings.SrealityClientSettings(
             base_url=base_url,
@@ -27,7 +36,16 @@ class SrealityEstatesClient:
         self.base_url = defaults.base_url
         self.detail_url = defaults.detail_url
         self.per_page = defaults.per_page
+        self.probe_size = defaults.probe_size
+        self.probe_query = defaults.probe_query
+        self.max_result_size = defaults.max_result_size
+        self.price_param = defaults.price_param
+        self.max_price = defaults.max_price
+        self.shard_concurrency = defaults.shard_concurrency
         self.query_params = query_params
+        # pages are decoded and validated in worker processes when enabled
+        self.cpu_pool = cpu_pool
+        self.http_cache = http_cache
         if "User-Agent" not in headers:
             # Sreality returns random area and price if the user agent is not set
             headers["User-Agent"] = (
@@ -35,82 +53,219 @@ class SrealityEstatesClient:
             )
         self.headers = headers
 
-    async def read_all(self) -> List[EstateOverview]:
-        try:
+    async def read_all(
+        self, session: aiohttp.ClientSession | None = None
+    ) -> List[EstateOverview]:
+        if session is None:
             async with aiohttp.ClientSession() as session:
+                return await self._read_all_with_session(session)
+        return await self._read_all_with_session(session)
+
+    async def _read_all_with_session(self, session) -> List[EstateOverview]:
+        try:
+            page_1 = await self._read_page(
+                session,
+                self.query_params,
+                page=1,
+                per_page=self.per_page,
+                headers=self.headers,
+            )
+            if page_1 is None:
+                logger.warning("Failed to get first page of the query")
+                return []
+            if page_1["result_size"] > self.max_result_size:
+                return await self._read_sharded(session, page_1["result_size"])
+            return await self._read_pages(session, self.query_params, page_1)
+        except aiohttp.ClientConnectionError:
+            logger.exception("Failed to connect to the server")
+            return []
+
+    async def _read_pages(
+        self, session, query_params, page_1
+    ) -> List[EstateOverview]:
+        result_size = page_1["result_size"]
+        pages_total = math.ceil(result_size / self.per_page) + 1
+        offload = self.cpu_pool is not None and self.cpu_pool.enabled
+        tasks = []
+        for page in range(2, pages_total):
+            task = self._read_page(
+                session,
+                query_params,
+                page=page,
+                per_page=self.per_page,
+                raw=offload,
+            )
+            tasks.append(task)
+
+        pages = await asyncio.gather(*tasks, return_exceptions=True)
+        estates = self._map_to_model(parse_query_result_page(page_1))
+        if offload:
+            pages = [p for p in pages if isinstance(p, bytes)]
+            columns = await self.cpu_pool.map_chunks(
+                parse_pages, pages, str(self.detail_url)
+            )
+            for chunk_columns in columns:
+                estates.extend(estates_from_columns(chunk_columns))
+        else:
+            pages = [p for p in pages if isinstance(p, dict)]
+            records = [r for p in pages for r in parse_query_result_page(p)]
+            estates.extend(self._map_to_model(records))
+        return estates
+
+    async def _read_sharded(self, session, result_size) -> List[EstateOverview]:
+        """
+        Splits the query into disjoint price bands small enough to page
+        through, reads them concurrently and merges them by id.
+        """
+        low, high = self._price_bounds()
+        shards = await self._plan_shards(session, low, high, result_size)
+        logger.info(
+            "Reading %d estates in %d price shards", result_size, len(shards)
+        )
+        semaphore = asyncio.Semaphore(self.shard_concurrency)
+
+        async def read_shard(low, high):
+            async with semaphore:
+                query = self._shard_query(low, high)
                 page_1 = await self._read_page(
-                    session,
-                    self.query_params,
-                    page=1,
-                    per_page=self.per_page,
-                    headers=self.headers,
+                    session, query, page=1, per_page=self.per_page, headers=self.headers
                 )
                 if page_1 is None:
-                    logger.warning("Failed to get first page of the query")
+                    logger.warning("Failed to read price shard %d-%d", low, high)
                     return []
-                result_size = page_1["result_size"]
-                pages_total = math.ceil(result_size / self.per_page) + 1
-                tasks = []
-                for page in range(2, pages_total):
-                    if page is None:
-                        continue
-                    task = self._read_page(
-                        session,
-                        self.query_params,
-                        page=page,
-                        per_page=self.per_page,
-                    )
-                    tasks.append(task)
-
-                page_dicts = await asyncio.gather(*tasks, return_exceptions=True)
-        except aiohttp.ClientConnectionError:
-            logger.exception("Failed to connect to the server")
+                return await self._read_pages(session, query, page_1)
+
+        shard_estates = await asyncio.gather(*[read_shard(*s) for s in shards])
+        unique = {}
+        for estates in shard_estates:
+            for estate in estates:
+                unique.setdefault(estate.id, estate)
+        return list(unique.values())
+
+    async def _plan_shards(self, session, low, high, size):
+        if size == 0:
             return []
+        if size is None:
+            # the count failed, read the band as it is
+            return [(low, high)]
+        if size <= self.max_result_size or high <= low:
+            if size > self.max_result_size:
+                logger.warning("Price shard %d-%d stays too large: %d", low, high, size)
+            return [(low, high)]
+
+        middle = (low + high) // 2
+        halves = [(low, middle), (middle + 1, high)]
+        sizes = await asyncio.gather(
+            *[self._count(session, self._shard_query(*half)) for half in halves]
+        )
+        plans = await asyncio.gather(
+            *[
+                self._plan_shards(session, *half, half_size)
+                for half, half_size in zip(halves, sizes)
+            ]
+        )
+        return sum(plans, [])
+
+    async def _count(self, session, query_params) -> int | None:
+        page = await self._read_page(session, query_params, page=1, per_page=1)
+        return None if page is None else page["result_size"]
 
-        page_dicts.insert(0, page_1)
-        page_dicts = [p for p in page_dicts if p is not None]
-        dicts_list = [parse_query_result_page(p) for p in page_dicts]
-        records = sum(dicts_list, [])
-        return self._map_to_model(records)
+    def _price_bounds(self):
+        bounds = self.query_params.get(self.price_param)
+        if bounds is None:
+            return 0, self.max_price
+        low, _, high = str(bounds).partition("|")
+        return int(low or 0), int(high or self.max_price)
+
+    def _shard_query(self, low, high):
+        return self.query_params | {self.price_param: f"{low}|{high}"}
+
+    async def probe(
+        self, session: aiohttp.ClientSession | None = None
+    ) -> QueryFingerprint | None:
+        """
+        Reads the first page of the newest estates only and returns a
+        fingerprint of it. If the fingerprint did not change since the last
+        full read, there is nothing new to fetch.
+        """
+        if session is None:
+            async with aiohttp.ClientSession() as session:
+                return await self.probe(session)
+
+        query = self.query_params | self.probe_query
+        try:
+            page = await self._read_page(
+                session,
+                query,
+                page=1,
+                per_page=self.probe_size,
+                headers=self.headers,
+            )
+        except aiohttp.ClientConnectionError:
+            logger.exception("Failed to connect to the server")
+            return None
+        if page is None:
+            return None
+        estates = self._map_to_model(parse_query_result_page(page))
+        return fingerprint_page(page["result_size"], estates)
 
     def _map_to_model(self, records):
-        valid = []
-        for record in records:
-            try:
-                estate_overview = EstateOverview.from_record(
-                    record,
-                    self.detail_url,
+        return _map_to_model(records, self.detail_url)
+
+    async def details(
+        self,
+        ids: List[str],
+        session: aiohttp.ClientSession | None = None,
+        concurrency: int = 8,
+        retries: int = 2,
+        backoff_sec: float = 0.5,
+        headers: dict | None = None,
+    ) -> Dict[str, Dict | None]:
+        """
+        Details of the estates, at most `concurrency` requests at once.
+        Failed requests are retried with an exponential backoff, estates
+        that still fail map to None. Sent with the client headers by default.
+        """
+        if headers is None:
+            headers = self.headers
+        if session is None:
+            async with aiohttp.ClientSession() as session:
+                return await self.details(
+                    ids, session, concurrency, retries, backoff_sec, headers
                 )
-                valid.append(estate_overview)
-            except ValidationError:
-                logger.exception("Failed to validate estate %s", record)
-        return valid
-
-    # async def detail(self, id: int) -> dict:
-    #     """
-    #     Detail of the estate
-    #
-    #     :param id: id of the estate
-    #     :return: estate dict
-    #     """
-    #     async with aiohttp.ClientSession() as session:
-    #         return await self._detail_with_session(session, id)
-    #
-    # async def details(self, ids: List[int]) -> List[dict]:
-    #     """
-    #     Details of the estates. This is a batch version of the detail method.
-    #     It is faster then calling detail multiple times.
-    #
-    #     :param ids: list of ids
-    #     :return: list of estates
-    #     """
-    #     async with aiohttp.ClientSession() as session:
-    #         tasks = [self._detail_with_session(session, id) or id in ids]
-    #         return await asyncio.gather(*tasks, return_exceptions=True)
-
-    async def _detail_with_session(self, session, id: int) -> Dict:
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch(estate_id):
+            async with semaphore:
+                return await self._detail_with_retries(
+                    session, estate_id, retries, backoff_sec, headers
+                )
+
+        results = await asyncio.gather(*[fetch(estate_id) for estate_id in ids])
+        return dict(zip(ids, results))
+
+    async def _detail_with_retries(
+        self, session, id, retries, backoff_sec, headers: dict = {}
+    ):
+        for attempt in range(retries + 1):
+            if attempt > 0:
+                await asyncio.sleep(backoff_sec * 2 ** (attempt - 1))
+            try:
+                detail = await self._detail_with_session(session, id, headers)
+            except aiohttp.ClientError:
+                logger.warning("Failed to get detail of %s", id, exc_info=True)
+                detail = None
+            if detail is not None:
+                return detail
+        return None
+
+    async def _detail_with_session(self, session, id: int, headers: dict = {}) -> Dict:
         url = format_url(self.base_url, f"estates/{id}")
-        return await _request_json(session, url)
+        with TRACER.span("sreality.detail", estate_id=id):
+            return await _request_json(
+                session, url, headers=headers, cache=self.http_cache
+            )
 
     async def _read_page(
         self,
@@ -119,16 +274,28 @@ class SrealityEstatesClient:
         page: int,
         per_page: int,
         headers: dict = {},
-    ) -> Dict:
+        raw: bool = False,
+    ) -> Dict | bytes:
         paged_query = page_query(query_params, page, per_page)
         url = format_url(self.base_url, "estates", paged_query)
-        return await _request_json(session, url, headers=headers)
+        with PAGE_FETCH_SECONDS.time(), TRACER.span("sreality.page", page=page):
+            return await _request_json(
+                session, url, headers=headers, raw=raw, cache=self.http_cache
+            )
 
 
-async def _request_json(session, url, method="get", headers={}) -> Dict | None:
+async def _request_json(
+    session, url, method="get", headers={}, raw=False, cache: HttpCache | None = None
+) -> Dict | bytes | None:
+    if cache is not None and method == "get":
+        return await cache.request_json(session, url, headers=headers, raw=raw)
     async with session.request(method, url, headers=headers) as resp:
+        HTTP_REQUESTS.inc(host=resp.url.host, status=resp.status)
         try:
             resp.raise_for_status()
+            if raw:
+                # decoded later, e.g. in a worker process
+                return await resp.read()
             return await resp.json()
         except aiohttp.ClientResponseError:
             logger.exception("Failed to get %s with status %s error", url, resp.status)
@@ -150,3 +317,49 @@ def page_query(query_params, page, per_page):
 
 def parse_query_result_page(page_dict: dict) -> List[dict]:
     return page_dict.get("_embedded", {}).get("estates", [])
+
+
+def _map_to_model(records, detail_url) -> List[EstateOverview]:
+    valid = []
+    for record in records:
+        try:
+            estate_overview = EstateOverview.from_record(record, detail_url)
+            valid.append(estate_overview)
+        except ValidationError:
+            logger.exception("Failed to validate estate %s", record)
+    return valid
+
+
+def parse_pages(pages: List[bytes], detail_url: str):
+    """
+    Decodes and validates raw result pages, meant to run in a worker
+    process. Returns the valid estates as columns, which are much cheaper
+    to send back than the models or the decoded pages.
+    """
+    records = [r for page in pages for r in parse_query_result_page(json.loads(page))]
+    estates = _map_to_model(records, detail_url)
+    return (
+        [estate.id for estate in estates],
+        [estate.link for estate in estates],
+        np.array([estate.price for estate in estates], dtype=np.int64),
+        np.array([estate.gps for estate in estates], dtype=np.float64).reshape(-1, 2),
+    )
+
+
+def estates_from_columns(columns) -> List[EstateOverview]:
+    # validated by parse_pages already
+    ids, links, prices, gps = columns
+    return [
+        EstateOverview.model_construct(
+            id=estate_id, link=link, price=price, gps=(lat, lon)
+        )
+        for estate_id, link, price, (lat, lon) in zip(
+            ids, links, prices.tolist(), gps.tolist()
+        )
+    ]
+
+
+def fingerprint_page(result_size: int, estates: List[EstateOverview]):
+    top = ";".join(f"{e.id}:{e.price}" for e in estates)
+    digest = hashlib.sha1(f"{result_size}|{top}".encode()).hexdigest()
+    return QueryFingerprint(result_size=result_size, digest=digest)
@@ -0,0 +1,79 @@
+import logging
+from typing import Dict, List
+
+import numpy as np
+import scipy
+
+from baraky.models import EstateOverview
+from baraky.spatial import EstateSpatialIndex, project_km
+
+logger = logging.getLogger("baraky.dedup")
+
+
+def cluster_duplicates(
+    estates: List[EstateOverview],
+    distance_m: float = 30.0,
+    price_tolerance: float = 0.02,
+) -> List[List[EstateOverview]]:
+    """
+    Groups listings of the same house by different agencies: estates at
+    most `distance_m` apart whose prices differ by at most
+    `price_tolerance` (relative) end up in one cluster, transitively.
+    Clusters keep the input order, the first estate of a cluster is its
+    representative.
+    """
+    if len(estates) < 2:
+        return [[estate] for estate in estates]
+
+    points = project_km([estate.gps for estate in estates])
+    prices = np.array([estate.price for estate in estates], dtype=np.float64)
+
+    tree = scipy.spatial.KDTree(points)
+    pairs = tree.query_pairs(distance_m / 1000, output_type="ndarray")
+    if len(pairs):
+        left, right = prices[pairs[:, 0]], prices[pairs[:, 1]]
+        pairs = pairs[is_close_price(left, right, price_tolerance)]
+
+    graph = scipy.sparse.coo_matrix(
+        (np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])),
+        shape=(len(estates), len(estates)),
+    )
+    _, labels = scipy.sparse.csgraph.connected_components(graph, directed=False)
+
+    clusters = {}
+    for estate, label in zip(estates, labels):
+        clusters.setdefault(label, []).append(estate)
+    duplicates = len(estates) - len(clusters)
+    if duplicates:
+        logger.debug("Found %d near-duplicate listings", duplicates)
+    return list(clusters.values())
+
+
+def is_close_price(left, right, price_tolerance: float):
+    high = np.maximum(left, right)
+    return np.abs(left - right) <= price_tolerance * np.where(high > 0, high, 1)
+
+
+def match_stored(
+    estates: List[EstateOverview],
+    index: EstateSpatialIndex,
+    distance_m: float = 30.0,
+    price_tolerance: float = 0.02,
+    exclude_ids=(),
+) -> Dict[str, str]:
+    """
+    Stored near-duplicates of the listings the index does not hold yet,
+    i.e. of new ones. Maps the id of such a listing to the id of a stored
+    listing of the same house.
+    """
+    matched = {}
+    for estate in estates:
+        if estate.id in index:
+            continue
+        for stored_id in index.within(estate.gps, distance_m / 1000):
+            if stored_id in exclude_ids:
+                continue
+            if is_close_price(index.price(stored_id), estate.price, price_tolerance):
+                matched[estate.id] = stored_id
+                break
+    return matched
@@ -0,0 +1,114 @@
+import json
+import logging
+import os
+import re
+from pathlib import Path
+from typing import Dict
+
+from baraky.client import SrealityEstatesClient
+from baraky.metrics import CACHE_REQUESTS
+from baraky.models import EstateDetailFeature, EstateOverview
+from baraky.settings import EstateDetailSettings
+
+logger = logging.getLogger("baraky.details")
+
+# names of the detail items of a Sreality estate
+AREA_ITEMS = {
+    "Užitná plocha": "usable_area",
+    "Plocha pozemku": "plot_area",
+    "Plocha zastavěná": "built_up_area",
+}
+
+
+class DetailCache:
+    """
+    Detail payloads on the local disk, one json file per estate. An entry
+    is valid only for the price it was fetched at.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def get(self, estate_id: str, price: int) -> Dict | None:
+        path = self.root / f"{estate_id}.json"
+        try:
+            entry = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError):
+            return None
+        if entry.get("price") != price:
+            return None
+        return entry["detail"]
+
+    def put(self, estate_id: str, price: int, detail: Dict):
+        self.root.mkdir(parents=True, exist_ok=True)
+        path = self.root / f"{estate_id}.json"
+        tmp_path = path.with_suffix(".tmp")
+        entry = {"price": price, "detail": detail}
+        tmp_path.write_text(json.dumps(entry, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp_path, path)
+
+
+def parse_detail(detail: Dict) -> EstateDetailFeature:
+    areas = {}
+    for item in detail.get("items", []):
+        field = AREA_ITEMS.get(item.get("name"))
+        if field is not None:
+            areas[field] = _parse_number(item.get("value"))
+    return EstateDetailFeature(
+        title=detail.get("name", {}).get("value"),
+        description=detail.get("text", {}).get("value"),
+        **areas,
+    )
+
+
+def _parse_number(value) -> float | None:
+    if isinstance(value, (int, float)):
+        return float(value)
+    if not isinstance(value, str):
+        return None
+    match = re.search(r"\d[\d\s]*(?:[.,]\d+)?", value)
+    if match is None:
+        return None
+    return float(re.sub(r"\s", "", match.group()).replace(",", "."))
+
+
+class EstateDetailEnhancer:
+    """
+    Calculator of the `detail` feature. No filter needs it, so the watcher
+    fetches details only for estates that passed the filters. Cached
+    payloads are reused while the price of the estate stays the same.
+    """
+
+    cost = 5.0
+
+    def __init__(
+        self,
+        client: SrealityEstatesClient | None = None,
+        cache: DetailCache | None = None,
+        settings: EstateDetailSettings | None = None,
+    ):
+        if settings is None:
+            settings = EstateDetailSettings()
+        self.client = client or SrealityEstatesClient({})
+        self.cache = cache or DetailCache(settings.cache_path)
+        self.settings = settings
+
+    async def calculate(
+        self, estate_overview: EstateOverview
+    ) -> EstateDetailFeature | None:
+        estate_id, price = estate_overview.id, estate_overview.price
+        detail = self.cache.get(estate_id, price)
+        result = "miss" if detail is None else "hit"
+        CACHE_REQUESTS.inc(cache="estate_detail", result=result)
+        if detail is None:
+            fetched = await self.client.details(
+                [estate_id],
+                retries=self.settings.retries,
+                backoff_sec=self.settings.backoff_sec,
+            )
+            detail = fetched[estate_id]
+            if detail is None:
+                logger.debug("Failed to fetch detail of %s", estate_id)
+                return None
+            self.cache.put(estate_id, price, detail)
+        return parse_detail(detail)
@@ -1,32 +1,84 @@
 from baraky.models import (
     EstateOverview,
+    NearestStopFeature,
     PIDResponse,
     PIDCommuteFeature,
     Gps,
 )
+import asyncio
 import numpy as np
-from typing import Dict
+from typing import Dict, List
 from baraky.settings import (
     PIDClientSettings,
     PIDCommuteFeatureEnhancerSettings,
 )
-from pandas.tseries.offsets import BDay
 import datetime
 import scipy
 from urllib.parse import quote
 import aiohttp
 from baraky.client import _request_json
+from baraky.http_cache import HttpCache
+from baraky.metrics import CACHE_REQUESTS
+from baraky.profiling import TRACER
+from baraky.spatial import project_km
 import json
 
+# seconds to wait before each calculation, be polite to pid.cz
+CALCULATOR_DELAYS: Dict[str, float] = {"pid_commute_time": 0.1}
+
+
+class RouteCache:
+    """
+    In-memory cache of PID routes. Concurrent lookups of the same route
+    share a single request.
+    """
+
+    def __init__(self):
+        self._routes: Dict[tuple, asyncio.Future] = {}
+
+    async def get_or_fetch(self, stop_from, stop_to, fetch):
+        key = (stop_from, stop_to)
+        route = self._routes.get(key)
+        if route is not None:
+            CACHE_REQUESTS.inc(cache="pid_route", result="hit")
+            return await asyncio.shield(route)
+
+        CACHE_REQUESTS.inc(cache="pid_route", result="miss")
+        route = asyncio.ensure_future(fetch(stop_from, stop_to))
+        self._routes[key] = route
+        try:
+            result = await asyncio.shield(route)
+        except Exception:
+            # do not cache failures
+            self._routes.pop(key, None)
+            raise
+        if result is None:
+            self._routes.pop(key, None)
+        return result
+
 
 class PIDClient:
-    def __init__(self, settings: PIDClientSettings | None = None):
+    def __init__(
+        self,
+        settings: PIDClientSettings | None = None,
+        route_cache: RouteCache | None = None,
+        http_cache: HttpCache | None = None,
+    ):
         if settings is None:
             settings = PIDClientSettings()
 
         self.settings = settings
+        self.route_cache = route_cache
+        self.http_cache = http_cache
 
     async def get_route(self, stop_from, stop_to) -> PIDResponse | None:
+        if self.route_cache is None:
+            return await self._fetch_route(stop_from, stop_to)
+        return await self.route_cache.get_or_fetch(
+            stop_from, stop_to, self._fetch_route
+        )
+
+    async def _fetch_route(self, stop_from, stop_to) -> PIDResponse | None:
         query = list(self.settings.query)
         next_bday = next_business_day_str()
         query.extend(
@@ -39,8 +91,9 @@ class PIDClient:
         query_part = "&".join([f"{quote(k)}={quote(v)}" for k, v in query])
         url = f"{self.settings.url_base}?{query_part}"
 
-        async with aiohttp.ClientSession() as session:
-            resp = await _request_json(session, url)
+        with TRACER.span("pid.route", stop_from=stop_from, stop_to=stop_to):
+            async with aiohttp.ClientSession() as session:
+                resp = await _request_json(session, url, cache=self.http_cache)
 
         if resp is None or len(resp.get("data", [])) == 0:
             return None
@@ -67,7 +120,59 @@ class PIDClient:
         )
 
 
+def load_stops(path) -> Dict[str, Gps]:
+    with open(path) as f:
+        stops = json.load(f)
+    return {s["idosName"]: (s["avgLat"], s["avgLon"]) for s in stops["stopGroups"]}
+
+
+class NearestStopEnhancer:
+    """
+    Batch calculator of the `nearest_stop` feature. One vectorized query of
+    the stops tree, so filters on the stop distance run before the route
+    is looked up at pid.cz.
+    """
+
+    cost = 0.01
+    inputs = ("gps",)
+    version = 1
+
+    def __init__(
+        self,
+        stops_data: Dict[str, Gps] = None,
+        settings: PIDCommuteFeatureEnhancerSettings | None = None,
+    ):
+        if stops_data is None:
+            settings = settings or PIDCommuteFeatureEnhancerSettings()
+            stops_data = load_stops(settings.stops_path)
+        self.stops_names = list(stops_data.keys())
+        self.stops_tree = scipy.spatial.KDTree(project_km(list(stops_data.values())))
+
+    async def calculate(self, estate_overview: EstateOverview):
+        return (await self.calculate_many([estate_overview]))[0]
+
+    async def calculate_many(
+        self, estates: List[EstateOverview]
+    ) -> List[NearestStopFeature]:
+        if not estates:
+            return []
+        distances, idx = self.stops_tree.query(project_km([e.gps for e in estates]))
+        return [
+            NearestStopFeature(stop=self.stops_names[i], distance_km=float(distance))
+            for distance, i in zip(distances, idx)
+        ]
+
+
 class PIDCommuteFeatureEnhancer:
+    # a pid.cz request per estate
+    cost = 10.0
+    # the commute depends only on the position, bump the version when the
+    # calculation changes
+    inputs = ("gps",)
+    version = 1
+    # the stop is taken from the nearest_stop feature when it is calculated
+    requires = ("nearest_stop",)
+
     def __init__(
         self,
         stops_data: Dict[str, Gps] = None,
@@ -80,22 +185,34 @@ class PIDCommuteFeatureEnhancer:
             settings = PIDCommuteFeatureEnhancerSettings()
 
         if stops_data is None:
-            with open(settings.stops_path) as f:
-                stops = json.load(f)
-            stops_data = {
-                s["idosName"]: (s["avgLat"], s["avgLon"]) for s in stops["stopGroups"]
-            }
+            stops_data = load_stops(settings.stops_path)
 
-        self.pid_client = PIDClient()
+        self.pid_client = pid_client
+        self.stops_data = stops_data
         self.stops_names = list(stops_data.keys())
         kddata = np.array(list(stops_data.values()))
         self.stops_tree = scipy.spatial.KDTree(kddata)
         self.desired_stop = settings.desired_stop
 
+    @property
+    def parameters(self):
+        # a commute to another stop is a different feature
+        return {"desired_stop": self.desired_stop}
+
+    def is_complete(self, feature: PIDCommuteFeature | None) -> bool:
+        # a failed lookup is retried, like RouteCache does not keep failures
+        return feature is not None and feature.time_minutes is not None
+
     async def calculate(self, estate_overview: EstateOverview):
-        distance, idx = self.stops_tree.query(estate_overview.gps)
+        nearest = estate_overview.features.get("nearest_stop")
+        if nearest is not None and nearest.stop in self.stops_data:
+            found_stop = nearest.stop
+            offset = np.subtract(estate_overview.gps, self.stops_data[found_stop])
+            distance = float(np.hypot(*offset))
+        else:
+            distance, idx = self.stops_tree.query(estate_overview.gps)
+            found_stop = self.stops_names[idx]
 
-        found_stop = self.stops_names[idx]
         resp = await self.pid_client.get_route(found_stop, self.desired_stop)
 
         if resp is None:
@@ -125,9 +242,12 @@ def find_closest(distances):
     return k[idx], kms_to_station[idx]
 
 
-def next_business_day_str():
-    today = datetime.datetime.today()
-    next_bday = today + BDay(1)
+def next_business_day_str(today: datetime.date | None = None):
+    if today is None:
+        today = datetime.date.today()
+    next_bday = today + datetime.timedelta(days=1)
+    while next_bday.weekday() >= 5:  # skip weekend
+        next_bday += datetime.timedelta(days=1)
     return next_bday.strftime("%d.%m.%Y")
 
 
@@ -1,13 +1,38 @@
 from datetime import timedelta, datetime
 import asyncio
 import logging
+import time
+import aiohttp
+import numpy as np
 from tqdm.auto import tqdm
-from typing import Callable
-from baraky.models import EstateOverview, EstateQueueMessage
+from typing import Callable, Dict, List
+from baraky import feature_cache, metrics
+from baraky.dedup import cluster_duplicates, match_stored
+from baraky.estate_features import CALCULATOR_DELAYS
+from baraky.filters import order_calculators
+from baraky.journal import CycleJournal
+from baraky.profiling import TRACER, CycleProfiler
+from baraky.models import EstateOverview, EstateQueueMessage, SearchState, Tombstone
+from baraky.scheduler import PollingScheduler, ScheduledJob
+from baraky.settings import DedupSettings, PollingSchedulerSettings
 
 logger = logging.getLogger("baraky.estate_watcher")
 
 
+class WatchedSearch:
+    def __init__(
+        self,
+        name: str,
+        client,
+        output_queue,
+        filter_fn: Callable[[EstateOverview], bool] | None = None,
+    ):
+        self.name = name
+        self.client = client
+        self.output_queue = output_queue
+        self.filter_fn = filter_fn or (lambda _: True)
+
+
 class EstateWatcher:
     def __init__(
         self,
@@ -18,63 +43,511 @@ class EstateWatcher:
         filter_fn: Callable[[EstateOverview], bool] | None = None,
         interval_sec=600,
         progress=True,
+        searches: List[WatchedSearch] | None = None,
+        max_connections=10,
+        state_storage=None,
+        force_refresh_sec=6 * 3600,
+        scheduler_settings: PollingSchedulerSettings | None = None,
+        enhance_workers=1,
+        queue_size=16,
+        save_batch_size=20,
+        journal: CycleJournal | None = None,
+        calculator_delays: Dict[str, float] | None = None,
+        profiler: CycleProfiler | None = None,
+        price_history=None,
+        tombstone_storage=None,
+        spatial_index=None,
+        dedup_settings: DedupSettings | None = None,
+        remote_enhancer=None,
     ):
+        if searches is None:
+            searches = [WatchedSearch("default", client, output_queue, filter_fn)]
+        self.searches = searches
         self.client = client
         self.storage = storage
 
-        interval = timedelta(seconds=interval_sec)
-        self.timer = CycleTimer(interval)
+        self.interval_sec = interval_sec
+        self.scheduler = PollingScheduler()
+        self.scheduler_settings = scheduler_settings or PollingSchedulerSettings()
         self.output_queue = output_queue
         self.feature_calculators = feature_calculators
         self.filter_fn = filter_fn or (lambda _: True)
+        self.max_connections = max_connections
         self.tqdm_disabled = not progress
+        self.enhance_workers = enhance_workers
+        self.queue_size = queue_size
+        self.save_batch_size = save_batch_size
+        self.journal = journal
+        if calculator_delays is None:
+            calculator_delays = CALCULATOR_DELAYS
+        self.calculator_delays = calculator_delays
+        self.profiler = profiler
+        self.price_history = price_history
+        self.tombstone_storage = tombstone_storage
+        self.spatial_index = spatial_index
+        self.dedup_settings = dedup_settings or DedupSettings()
+        # per-estate features are calculated by remote workers when set
+        self.remote_enhancer = remote_enhancer
+        # sorted ids of the last complete read of each search
+        self._seen_ids: Dict[str, np.ndarray] = {}
+        self._has_full_read = False
+        self._tombstoned: set | None = None
+
+        self.state_storage = state_storage
+        self.force_refresh = timedelta(seconds=force_refresh_sec)
+        self.search_states: Dict[str, SearchState] | None = None
+        self._pending_states: Dict[str, SearchState] = {}
 
     async def watch(self):
+        searches_by_name = {search.name: search for search in self.searches}
+        for search in self.searches:
+            job = ScheduledJob(search.name, self.interval_sec, self.scheduler_settings)
+            self.scheduler.add(job)
+
         while True:
             try:
-                if self.timer.elapsed():
-                    await self.update()
-                    self.timer.reset()
-                await self.timer.wait()
+                jobs = await self.scheduler.next_due()
+                searches = [searches_by_name[job.name] for job in jobs]
+                changes = await self.update(searches)
+                for job in jobs:
+                    self.scheduler.reschedule(job, changes.get(job.name, 0))
             except asyncio.CancelledError:
                 logger.info("Watcher stopping gracefully")
                 break
 
-    async def update(self):
+    async def update(self, searches: List[WatchedSearch] | None = None):
+        """
+        Runs one update cycle over the given searches (all by default) and
+        returns the number of new or updated estates found by each search.
+        """
+        if searches is None:
+            searches = self.searches
+        if self.profiler is not None:
+            return await self.profiler.run(self._update(searches))
+        return await self._update(searches)
+
+    async def _update(self, searches: List[WatchedSearch]):
         logger.info("Running update cycle")
-        new_estates = await self._read_new()
-        self._notify(new_estates)
-        await self.storage.save_many(new_estates)
+        with metrics.CYCLE_SECONDS.time(), TRACER.span("cycle"):
+            await self._resume_interrupted()
+            new_estates, matches = await self._read_new(searches)
+            if self.journal is not None:
+                self.journal.start(new_estates, matches)
+            await self._process(searches, new_estates, matches)
+            await self._remove_delisted()
+            if self.price_history is not None:
+                await self.price_history.compact()
+            self._commit_search_states()
+            if self.journal is not None:
+                self.journal.finish()
+        metrics.LAST_SUCCESS.set(time.time())
+
+        changes = {search.name: 0 for search in searches}
+        for estate in new_estates:
+            for name in matches[estate.id]:
+                changes[name] += 1
+        return changes
+
+    async def _read_new(self, searches: List[WatchedSearch]):
+        overviews, matches = await self._read_searches(searches)
+
+        with metrics.STORAGE_DIFF_SECONDS.time():
+            stored_estates_list = await self.storage.get_all()
+            stored_estates = {e.id: e for e in stored_estates_list}
+            if self.spatial_index is not None:
+                self.spatial_index.sync(stored_estates_list)
 
-    async def _read_new(self):
-        stored_estates_list = await self.storage.get_all()
-        overviews = await self.client.read_all()
+            new_or_updated = []
 
-        stored_estates = {e.id: e for e in stored_estates_list}
+            for received_estate in overviews:
+                stored = stored_estates.get(received_estate.id)
+                if stored is None:
+                    new_or_updated.append(received_estate)
+                elif stored.price != received_estate.price:
+                    # e.g. the commute does not change with the price
+                    feature_cache.carry_over(
+                        stored, received_estate, self._keyed_calculators()
+                    )
+                    new_or_updated.append(received_estate)
 
-        new_or_updated = []
+        relisted = [e.id for e in overviews if e.id not in stored_estates]
+        self._clear_tombstones(relisted)
 
-        for received_estate in overviews:
-            stored = stored_estates.get(received_estate.id)
-            if stored is None or stored.price != received_estate.price:
-                new_or_updated.append(received_estate)
+        metrics.ESTATES_PROCESSED.inc(len(overviews), stage="read")
+        metrics.ESTATES_PROCESSED.inc(len(new_or_updated), stage="new")
 
         logger.debug(
             "Found existing: %d new: %d", len(stored_estates), len(new_or_updated)
         )
+        return new_or_updated, matches
+
+    def _keyed_calculators(self) -> Dict:
+        """
+        Calculators of all features of an estate, including those of the
+        remote workers, for the feature keys.
+        """
+        remote = getattr(self.remote_enhancer, "feature_calculators", None) or {}
+        return {**remote, **self.feature_calculators}
+
+    async def _read_searches(self, searches: List[WatchedSearch]):
+        """
+        Reads all searches concurrently over one connection pool and
+        deduplicates the listings by id. Returns the unique estates and
+        the names of the searches each estate id was found by.
+        """
+        if self.search_states is None:
+            self.search_states = self._load_search_states()
+
+        connector = aiohttp.TCPConnector(limit=self.max_connections)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            tasks = [self._read_search(search, session) for search in searches]
+            results = await asyncio.gather(*tasks)
+
+        unique: Dict[str, EstateOverview] = {}
+        matches: Dict[str, List[str]] = {}
+        for search, overviews in zip(searches, results):
+            for estate in overviews:
+                unique.setdefault(estate.id, estate)
+                matches.setdefault(estate.id, []).append(search.name)
+
+        received = sum(len(r) for r in results)
+        logger.debug(
+            "Read %d estates (%d unique) from %d searches",
+            received,
+            len(unique),
+            len(searches),
+        )
+        return list(unique.values()), matches
+
+    async def _read_search(self, search: WatchedSearch, session):
+        now = datetime.now()
+        state = self.search_states.get(search.name)
+        fingerprint = await search.client.probe(session=session)
+
+        is_unchanged = (
+            state is not None
+            and fingerprint is not None
+            and state.fingerprint == fingerprint
+            and now - state.last_full_fetch < self.force_refresh
+        )
+        if is_unchanged:
+            logger.debug("Search %s did not change, skipping", search.name)
+            if state.estate_ids is not None:
+                self._seen_ids.setdefault(
+                    search.name, np.unique(np.array(state.estate_ids, dtype=str))
+                )
+            metrics.CACHE_REQUESTS.inc(cache="search_probe", result="hit")
+            return []
+        metrics.CACHE_REQUESTS.inc(cache="search_probe", result="miss")
+
+        with metrics.READ_ALL_SECONDS.time(search=search.name):
+            overviews = await search.client.read_all(session=session)
+        ids = np.unique(np.array([e.id for e in overviews], dtype=str))
+        # a page that failed to load must neither look like delisted estates
+        # nor let the next probes skip the estates it held
+        if fingerprint is not None and len(ids) >= fingerprint.result_size:
+            self._seen_ids[search.name] = ids
+            self._has_full_read = True
+            # committed only once the cycle is saved so that a failed cycle
+            # does not hide the changes from the next one
+            self._pending_states[search.name] = SearchState(
+                fingerprint=fingerprint,
+                last_full_fetch=now,
+                estate_ids=ids.tolist(),
+            )
+        return overviews
+
+    def _load_search_states(self) -> Dict[str, SearchState]:
+        if self.state_storage is None:
+            return {}
+        return self.state_storage.get_all()
+
+    def _commit_search_states(self):
+        for name, state in self._pending_states.items():
+            self.search_states[name] = state
+            if self.state_storage is not None:
+                self.state_storage.save(name, state)
+        self._pending_states = {}
+
+    def _clear_tombstones(self, estate_ids: List[str]):
+        if self.tombstone_storage is None or not estate_ids:
+            return
+        if self._tombstoned is None:
+            self._tombstoned = set(self.tombstone_storage.list_ids())
+        relisted = [i for i in estate_ids if i in self._tombstoned]
+        if relisted:
+            self.tombstone_storage.remove_many(relisted)
+            self._tombstoned.difference_update(relisted)
+            logger.info("Removed tombstones of %d relisted estates", len(relisted))
+
+    async def _remove_delisted(self):
+        """
+        Tombstones stored estates that none of the searches returns any
+        more. Runs only after a complete read, once the last complete read
+        of every search is known, from this process or the search states.
+        """
+        has_full_read, self._has_full_read = self._has_full_read, False
+        if self.tombstone_storage is None or not has_full_read:
+            return
+        if any(search.name not in self._seen_ids for search in self.searches):
+            return
+
+        seen = self._seen_ids[self.searches[0].name]
+        for search in self.searches[1:]:
+            seen = np.union1d(seen, self._seen_ids[search.name])
+        stored = np.unique(np.array(await self.storage.list_ids(), dtype=str))
+        delisted = np.setdiff1d(stored, seen, assume_unique=True).tolist()
+        if not delisted:
+            return
+
+        now = datetime.now()
+        self.tombstone_storage.save_many(
+            [Tombstone(id=estate_id, delisted_at=now) for estate_id in delisted]
+        )
+        if self._tombstoned is not None:
+            self._tombstoned.update(delisted)
+        await self.storage.remove_many(delisted)
+        purged = 0
+        queues = {id(s.output_queue): s.output_queue for s in self.searches}
+        for queue in queues.values():
+            purged += queue.purge(delisted)
+        metrics.ESTATES_PROCESSED.inc(len(delisted), stage="delisted")
+        logger.info(
+            "Tombstoned %d delisted estates, purged %d pending hits",
+            len(delisted),
+            purged,
+        )
 
-        await self.enhance_estates(new_or_updated)
-        return new_or_updated
+    async def _resume_interrupted(self):
+        if self.journal is None:
+            return
+        interrupted = self.journal.load()
+        if interrupted is None:
+            return
+        estates, matches = interrupted
+        logger.info("Resuming interrupted cycle with %d unsaved estates", len(estates))
+        await self._process(self.searches, estates, matches)
+        self.journal.finish()
 
-    def _notify(self, estates):
-        filtered = [e for e in estates if self.filter_fn(e)]
-        logger.debug(f"Found {len(filtered)} new (filtered) estates")
-        for estate in filtered:
-            model = EstateQueueMessage.map_from_estate_overview(estate)
-            self.output_queue.put(model)
+    async def _process(self, searches, estates, matches: Dict[str, List[str]]):
+        """
+        Streams the estates through enhance -> notify -> save stages.
+        The stages are connected by bounded queues, so an estate is notified
+        and saved as soon as its own features are ready and a slow stage
+        holds back the ones before it.
+        """
+        logger.info(f"Processing {len(estates)} new estates")
+        representatives, duplicates = self._cluster(estates)
+        if duplicates:
+            matches = _cluster_matches(matches, duplicates)
+        enhance_queue = asyncio.Queue(self.queue_size)
+        notify_queue = asyncio.Queue(self.queue_size)
+        save_queue = asyncio.Queue(self.queue_size)
+        progress = tqdm(
+            total=len(estates),
+            desc="Processing estates",
+            disable=self.tqdm_disabled or len(estates) == 0,
+        )
+        with progress:
+            representatives = await self._save_stored_duplicates(
+                representatives, duplicates, progress
+            )
+            await self._enhance_batch(representatives, searches, matches)
+            async with asyncio.TaskGroup() as tg:
+                if self.remote_enhancer is not None:
+                    tg.create_task(
+                        self._remote_enhance_stage(
+                            searches, matches, representatives, notify_queue
+                        )
+                    )
+                else:
+                    tg.create_task(self._feed_stage(representatives, enhance_queue))
+                    enhancers = [
+                        tg.create_task(
+                            self._enhance_stage(
+                                searches, matches, enhance_queue, notify_queue
+                            )
+                        )
+                        for _ in range(self.enhance_workers)
+                    ]
+                    tg.create_task(_close_after(enhancers, notify_queue))
+                tg.create_task(
+                    self._notify_stage(
+                        searches, matches, duplicates, notify_queue, save_queue
+                    )
+                )
+                tg.create_task(self._save_stage(save_queue, progress))
+
+    def _cluster(self, estates):
+        """
+        Splits the estates into cluster representatives, which are enhanced
+        and notified, and their near-duplicates by representative id.
+        """
+        if self.dedup_settings.distance_m <= 0:
+            return estates, {}
+        clusters = cluster_duplicates(
+            estates, self.dedup_settings.distance_m, self.dedup_settings.price_tolerance
+        )
+        duplicates = {c[0].id: c[1:] for c in clusters if len(c) > 1}
+        metrics.ESTATES_PROCESSED.inc(
+            len(estates) - len(clusters), stage="duplicate"
+        )
+        return [c[0] for c in clusters], duplicates
+
+    async def _save_stored_duplicates(self, estates, duplicates, progress):
+        """
+        New listings of a house stored under another id, typically listed
+        by another agency cycles later, get the features of the stored
+        listing and are saved without being enhanced or notified. Returns
+        the remaining estates.
+        """
+        if self.spatial_index is None or self.dedup_settings.distance_m <= 0:
+            return estates
+        cycle_ids = {e.id for e in estates}
+        cycle_ids.update(d.id for others in duplicates.values() for d in others)
+        matched = match_stored(
+            estates,
+            self.spatial_index,
+            self.dedup_settings.distance_m,
+            self.dedup_settings.price_tolerance,
+            exclude_ids=cycle_ids,
+        )
+        if not matched:
+            return estates
+
+        stored = await self.storage.get_many(sorted(set(matched.values())))
+        stored = {e.id: e for e in stored}
+        remaining, copies = [], []
+        for estate in estates:
+            original = stored.get(matched.get(estate.id))
+            if original is None:
+                remaining.append(estate)
+                continue
+            for copy in [estate, *duplicates.pop(estate.id, [])]:
+                # the inputs differ slightly, so the feature keys are not copied
+                copy.features = dict(original.features)
+                copies.append(copy)
+        if copies:
+            metrics.ESTATES_PROCESSED.inc(len(copies), stage="duplicate")
+            logger.info("Saving %d listings of stored houses as is", len(copies))
+            await self._save_batch(copies)
+            progress.update(len(copies))
+        return remaining
+
+    async def _feed_stage(self, estates, enhance_queue):
+        for estate in estates:
+            await enhance_queue.put(estate)
+        for _ in range(self.enhance_workers):
+            await enhance_queue.put(_DONE)
+
+    async def _enhance_stage(self, searches, matches, enhance_queue, notify_queue):
+        while (estate := await enhance_queue.get()) is not _DONE:
+            metrics.QUEUE_DEPTH.set(enhance_queue.qsize(), stage="enhance")
+            filters = _prefilters(searches, matches, estate)
+            if self.journal is None:
+                await self.enhance_estate(estate, filters)
+            elif self.journal.restore_features(estate):
+                metrics.CACHE_REQUESTS.inc(cache="journal", result="hit")
+            else:
+                metrics.CACHE_REQUESTS.inc(cache="journal", result="miss")
+                await self.enhance_estate(estate, filters)
+                self.journal.record_enhanced(estate)
+            metrics.ESTATES_PROCESSED.inc(stage="enhanced")
+            await notify_queue.put(estate)
+
+    async def _remote_enhance_stage(self, searches, matches, estates, notify_queue):
+        """
+        Publishes the estates to the remote workers and passes them on in
+        the order they come back. Estates restored from the journal or
+        rejected by the prefilters are passed on right away.
+        """
+        remote = []
+        for estate in estates:
+            if self.journal is not None and self.journal.restore_features(estate):
+                metrics.CACHE_REQUESTS.inc(cache="journal", result="hit")
+                await notify_queue.put(estate)
+            elif not _passes_prefilters(searches, matches, estate):
+                metrics.ESTATES_PROCESSED.inc(stage="prefiltered")
+                await notify_queue.put(estate)
+            else:
+                remote.append(estate)
+
+        async for estate in self.remote_enhancer.enhance_many(remote):
+            # e.g. details, fetched only for estates the filters let through
+            await self.enhance_estate(estate, _prefilters(searches, matches, estate))
+            if self.journal is not None:
+                self.journal.record_enhanced(estate)
+            metrics.ESTATES_PROCESSED.inc(stage="enhanced")
+            await notify_queue.put(estate)
+        await notify_queue.put(_DONE)
+
+    async def _notify_stage(
+        self, searches, matches, duplicates, notify_queue, save_queue
+    ):
+        notified = {search.name: 0 for search in searches}
+        while (estate := await notify_queue.get()) is not _DONE:
+            metrics.QUEUE_DEPTH.set(notify_queue.qsize(), stage="notify")
+            others = duplicates.get(estate.id, [])
+            with metrics.NOTIFY_SECONDS.time():
+                for search in searches:
+                    if search.name in matches[estate.id] and search.filter_fn(estate):
+                        self._notify_search(search, estate, others)
+                        notified[search.name] += 1
+            await save_queue.put(estate)
+            for duplicate in others:
+                # the inputs differ slightly, so the feature keys are not copied
+                duplicate.features = dict(estate.features)
+                await save_queue.put(duplicate)
+        await save_queue.put(_DONE)
+
+        for name, count in notified.items():
+            logger.debug(f"Found {count} new (filtered) estates for {name}")
+
+    def _notify_search(
+        self,
+        search: WatchedSearch,
+        estate: EstateOverview,
+        duplicates: List[EstateOverview] = (),
+    ):
+        if self.journal is not None and self.journal.was_notified(search.name, estate):
+            logger.debug("Estate %s was already sent to %s", estate.id, search.name)
+            return
+        model = EstateQueueMessage.map_from_estate_overview(estate, duplicates)
+        with TRACER.span("queue.put", estate_id=estate.id, search=search.name):
+            search.output_queue.put(model)
+        metrics.ESTATES_PROCESSED.inc(stage="notified")
+        if self.journal is not None:
+            self.journal.record_notified(search.name, estate)
+
+    async def _save_stage(self, save_queue, progress):
+        is_done = False
+        while not is_done:
+            batch = [await save_queue.get()]
+            while len(batch) < self.save_batch_size and not save_queue.empty():
+                batch.append(save_queue.get_nowait())
+            if batch[-1] is _DONE:
+                batch.pop()
+                is_done = True
+            metrics.QUEUE_DEPTH.set(save_queue.qsize(), stage="save")
+            if batch:
+                await self._save_batch(batch)
+                progress.update(len(batch))
+
+    async def _save_batch(self, batch):
+        with metrics.SAVE_SECONDS.time():
+            await self.storage.save_many(batch)
+            if self.price_history is not None:
+                await self.price_history.append_many(batch)
+        if self.spatial_index is not None:
+            self.spatial_index.add_many(batch)
+        metrics.ESTATES_PROCESSED.inc(len(batch), stage="saved")
+        if self.journal is not None:
+            self.journal.record_saved(batch)
+            await self.journal.sync()
 
     async def enhance_estates(self, estates):
         logger.info(f"Enhancing {len(estates)} estates with features")
+        await self._enhance_batch(estates)
 
         estates_it = tqdm(
             estates,
@@ -82,26 +555,101 @@ class EstateWatcher:
             disable=self.tqdm_disabled or len(estates) == 0,
         )
         for estate in estates_it:
-            for name, calculator in self.feature_calculators.items():
-                if name == "pid_commute_time":
-                    await asyncio.sleep(0.1)
-                feature_data = await calculator.calculate(estate)
+            await self.enhance_estate(estate)
+
+    async def _enhance_batch(self, estates, searches=None, matches=None):
+        """
+        Runs the calculators that work on whole batches (`calculate_many`)
+        once over the estates of the cycle, cheapest first. Estates already
+        rejected by the prefilters are left out.
+        """
+        for name in order_calculators(self.feature_calculators):
+            calculator = self.feature_calculators[name]
+            if not hasattr(calculator, "calculate_many"):
+                continue
+            pending = [
+                estate
+                for estate in estates
+                if _passes_prefilters(searches, matches, estate)
+                and not feature_cache.is_cached(name, calculator, estate)
+            ]
+            if not pending:
+                continue
+            with (
+                metrics.FEATURE_SECONDS.time(feature=name),
+                TRACER.span("feature.batch", feature=name, count=len(pending)),
+            ):
+                features = await calculator.calculate_many(pending)
+            for estate, feature_data in zip(pending, features):
+                if feature_data is None:
+                    continue
                 estate.features[name] = feature_data
+                feature_cache.remember(name, calculator, estate)
+
+    async def enhance_estate(self, estate, filters=None):
+        """
+        Runs the calculators cheapest first. With `filters` (see
+        `FilterChain.prefilter`) the features the filters need go first and
+        it stops as soon as every filter rejects the estate, the remaining
+        features are left for `reenhance`.
+        """
+        needed = set()
+        for f in filters or ():
+            needed |= getattr(f, "requires", set())
+        for name in order_calculators(self.feature_calculators, needed):
+            calculator = self.feature_calculators[name]
+            if hasattr(calculator, "calculate_many"):
+                # computed for the whole cycle by _enhance_batch
+                continue
+            if filters and not any(f.prefilter(estate) for f in filters):
+                logger.debug("Estate %s rejected before %s", estate.id, name)
+                metrics.ESTATES_PROCESSED.inc(stage="prefiltered")
+                return
+            if feature_cache.is_cached(name, calculator, estate):
+                continue
+            if name in self.calculator_delays:
+                await asyncio.sleep(self.calculator_delays[name])
+            with (
+                metrics.FEATURE_SECONDS.time(feature=name),
+                TRACER.span("feature", feature=name, estate_id=estate.id),
+            ):
+                feature_data = await calculator.calculate(estate)
+            if feature_data is None:
+                # a failed calculation leaves the feature out
+                continue
+            estate.features[name] = feature_data
+            feature_cache.remember(name, calculator, estate)
+
+
+_DONE = object()
+
+
+def _prefilters(searches, matches, estate):
+    if searches is None:
+        return None
+    filters = [s.filter_fn for s in searches if s.name in matches.get(estate.id, ())]
+    # a plain function may need any feature
+    if not filters or not all(hasattr(f, "prefilter") for f in filters):
+        return None
+    return filters
+
 
+def _cluster_matches(matches, duplicates):
+    # a cluster is a hit of every search any of its listings matched
+    matches = dict(matches)
+    for estate_id, others in duplicates.items():
+        names = matches.get(estate_id, []) + [
+            name for other in others for name in matches.get(other.id, [])
+        ]
+        matches[estate_id] = list(dict.fromkeys(names))
+    return matches
 
-class CycleTimer:
-    def __init__(self, interval):
-        self.interval = interval
-        self.last = None
 
-    def reset(self):
-        self.last = datetime.now()
+def _passes_prefilters(searches, matches, estate) -> bool:
+    filters = _prefilters(searches, matches, estate)
+    return filters is None or any(f.prefilter(estate) for f in filters)
 
-    def elapsed(self):
-        if self.last is None:
-            return True
-        return (datetime.now() - self.last) > self.interval
 
-    async def wait(self):
-        while not self.elapsed():
-            await asyncio.sleep(1)
+async def _close_after(tasks, queue):
+    await asyncio.gather(*tasks)
+    await queue.put(_DONE)
@@ -0,0 +1,219 @@
+import json
+import logging
+import types
+import typing
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+from tqdm.auto import tqdm
+
+from baraky.models import FEATURE_MODELS, EstateOverview
+
+logger = logging.getLogger("baraky.export")
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+
+class Column:
+    def __init__(self, name: str, kind: type, nullable: bool = False):
+        self.name = name
+        self.kind = kind
+        self.nullable = nullable
+
+
+def estate_columns() -> List[Column]:
+    """
+    Columns of the flattened estate. Fields of the known feature models
+    become typed `<feature>.<field>` columns, unknown features are kept
+    together as a json object in the `extra_features` column, so the
+    columns are known before any estate is read.
+    """
+    columns = [
+        Column("id", str),
+        Column("price", int),
+        Column("link", str),
+        Column("gps.lat", float),
+        Column("gps.lon", float),
+    ]
+    # an estate may lack any of the features, so their columns are nullable
+    for feature_name, model in FEATURE_MODELS.items():
+        for field_name, field in model.model_fields.items():
+            kind = _column_type(field.annotation)
+            columns.append(Column(f"{feature_name}.{field_name}", kind, True))
+    columns.append(Column("extra_features", str, nullable=True))
+    return columns
+
+
+def _column_type(annotation):
+    is_union = typing.get_origin(annotation) in (typing.Union, types.UnionType)
+    kinds = [annotation]
+    if is_union:
+        kinds = [a for a in typing.get_args(annotation) if a is not type(None)]
+    if len(kinds) == 1 and kinds[0] in (int, float, str, bool):
+        return kinds[0]
+    return str
+
+
+def flatten_estate(estate: EstateOverview) -> Dict:
+    row = {
+        "id": estate.id,
+        "price": estate.price,
+        "link": estate.link,
+        "gps.lat": estate.gps[0],
+        "gps.lon": estate.gps[1],
+    }
+    extra = {}
+    for name, value in estate.features.items():
+        if name in FEATURE_MODELS and hasattr(value, "model_dump"):
+            for field_name, field_value in value.model_dump().items():
+                row[f"{name}.{field_name}"] = field_value
+        else:
+            extra[name] = _jsonable(value)
+    if extra:
+        row["extra_features"] = json.dumps(extra, ensure_ascii=False)
+    return row
+
+
+def _jsonable(value):
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json")
+    return value
+
+
+class ParquetWriter:
+    def __init__(self, path, columns: List[Column]):
+        self.schema = _arrow_schema(columns)
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    def write(self, rows: List[Dict]):
+        self.writer.write_table(_arrow_table(rows, self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+class ArrowWriter(ParquetWriter):
+    def __init__(self, path, columns: List[Column]):
+        self.schema = _arrow_schema(columns)
+        self.sink = pa.OSFile(str(path), "wb")
+        self.writer = pa.ipc.new_file(self.sink, self.schema)
+
+    def close(self):
+        self.writer.close()
+        self.sink.close()
+
+
+def _arrow_schema(columns: List[Column]):
+    arrow_types = {
+        int: pa.int64(),
+        float: pa.float64(),
+        str: pa.string(),
+        bool: pa.bool_(),
+    }
+    return pa.schema([pa.field(c.name, arrow_types[c.kind]) for c in columns])
+
+
+def _arrow_table(rows, schema):
+    data = {name: [row.get(name) for row in rows] for name in schema.names}
+    return pa.Table.from_pydict(data, schema=schema)
+
+
+class NpzWriter:
+    """
+    Fallback without pyarrow. Nullable integers are stored as floats with
+    NaN, missing strings as empty strings.
+    """
+
+    def __init__(self, path, columns: List[Column]):
+        self.path = path
+        self.columns = columns
+        self.data = {c.name: [] for c in columns}
+
+    def write(self, rows: List[Dict]):
+        for column in self.columns:
+            self.data[column.name].extend(row.get(column.name) for row in rows)
+
+    def close(self):
+        arrays = {c.name: _to_numpy(c, self.data[c.name]) for c in self.columns}
+        with open(self.path, "wb") as fp:
+            np.savez_compressed(fp, **arrays)
+
+
+def _to_numpy(column: Column, values):
+    if column.kind is str:
+        return np.array(["" if v is None else v for v in values], dtype=str)
+    if column.kind is bool:
+        return np.array([bool(v) for v in values], dtype=bool)
+    if column.kind is int and not column.nullable:
+        return np.array(values, dtype=np.int64)
+    return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+
+
+def create_writer(path, columns: List[Column], format="auto"):
+    if format == "auto":
+        format = "parquet" if pa is not None else "npz"
+    if format in ("parquet", "arrow") and pa is None:
+        raise ValueError(f"Format {format} requires pyarrow")
+    writers = {"parquet": ParquetWriter, "arrow": ArrowWriter, "npz": NpzWriter}
+    return writers[format](path, columns)
+
+
+class EstatesExporter:
+    """
+    Streams the stored estates into one columnar file. With `incremental`
+    only estates modified since the previous export are written.
+    """
+
+    def __init__(
+        self,
+        storage,
+        state_path,
+        batch_size=500,
+        progress=True,
+    ):
+        self.storage = storage
+        self.state_path = Path(state_path)
+        self.batch_size = batch_size
+        self.tqdm_disabled = not progress
+
+    async def export(self, path, format="auto", incremental=False) -> int:
+        started_at = datetime.now(timezone.utc)
+        modified = await self.storage.list_modified()
+        last_export = self._read_last_export() if incremental else None
+        ids = [
+            estate_id
+            for estate_id, modified_at in modified.items()
+            if last_export is None or modified_at > last_export
+        ]
+        logger.info("Exporting %d of %d estates to %s", len(ids), len(modified), path)
+
+        writer = create_writer(path, estate_columns(), format)
+        with tqdm(total=len(ids), desc="Exporting", disable=self.tqdm_disabled) as bar:
+            for batch_ids in self._batches(ids):
+                estates = await self.storage.get_many(batch_ids)
+                writer.write([flatten_estate(e) for e in estates])
+                bar.update(len(estates))
+        writer.close()
+        self._write_last_export(started_at)
+        return len(ids)
+
+    def _batches(self, ids: List[str]):
+        for start in range(0, len(ids), self.batch_size):
+            yield ids[start : start + self.batch_size]
+
+    def _read_last_export(self) -> datetime | None:
+        if not self.state_path.exists():
+            return None
+        state = json.loads(self.state_path.read_text())
+        return datetime.fromisoformat(state["last_export"])
+
+    def _write_last_export(self, exported_at: datetime):
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        state = {"last_export": exported_at.isoformat()}
+        self.state_path.write_text(json.dumps(state))
@@ -0,0 +1,64 @@
+import hashlib
+import json
+from typing import Dict
+
+from baraky.metrics import CACHE_REQUESTS
+from baraky.models import EstateOverview
+
+
+def feature_key(calculator, estate: EstateOverview) -> str | None:
+    """
+    Hash of the estate fields listed in the calculator's `inputs`, of its
+    `version` and of its `parameters`, if any. None for calculators that do
+    not declare their inputs.
+    """
+    inputs = getattr(calculator, "inputs", None)
+    if inputs is None:
+        return None
+    values = [getattr(estate, field) for field in inputs]
+    key_data = [getattr(calculator, "version", 0), values]
+    parameters = getattr(calculator, "parameters", None)
+    if parameters:
+        key_data.append(parameters)
+    payload = json.dumps(key_data, default=str, sort_keys=True)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def is_cached(name: str, calculator, estate: EstateOverview) -> bool:
+    key = feature_key(calculator, estate)
+    is_hit = (
+        key is not None
+        and estate.feature_keys.get(name) == key
+        and estate.features.get(name) is not None
+    )
+    CACHE_REQUESTS.inc(cache="feature", result="hit" if is_hit else "miss")
+    return is_hit
+
+
+def remember(name: str, calculator, estate: EstateOverview):
+    """
+    Stores the key of the calculated feature. Features the calculator's
+    `is_complete` rejects, e.g. failed lookups, get no key and are
+    calculated again next time.
+    """
+    key = feature_key(calculator, estate)
+    is_complete = getattr(calculator, "is_complete", None)
+    if is_complete is not None and not is_complete(estate.features.get(name)):
+        estate.feature_keys.pop(name, None)
+    elif key is not None:
+        estate.feature_keys[name] = key
+
+
+def carry_over(stored: EstateOverview, received: EstateOverview, calculators: Dict):
+    """
+    Copies the features of the stored estate whose inputs did not change
+    to the freshly received one.
+    """
+    for name, calculator in calculators.items():
+        key = feature_key(calculator, received)
+        if key is None or stored.feature_keys.get(name) != key:
+            continue
+        if stored.features.get(name) is None:
+            continue
+        received.features[name] = stored.features[name]
+        received.feature_keys[name] = key
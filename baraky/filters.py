@@ -0,0 +1,84 @@
+import heapq
+import logging
+from typing import Callable, Dict, Iterable, List, Set
+
+from baraky.models import EstateOverview
+
+logger = logging.getLogger("baraky.filters")
+
+DEFAULT_COST = 1.0
+
+
+class Predicate:
+    def __init__(
+        self,
+        fn: Callable[[EstateOverview], bool],
+        requires: Iterable[str] = (),
+        cost: float = 0.0,
+    ):
+        self.fn = fn
+        self.name = getattr(fn, "__name__", repr(fn))
+        self.requires = tuple(requires)
+        self.cost = cost
+
+    def can_evaluate(self, estate: EstateOverview) -> bool:
+        return all(estate.features.get(name) is not None for name in self.requires)
+
+
+class FilterChain:
+    """
+    Filter made of predicates that declare the features they need. The
+    watcher uses `prefilter` to reject estates with the predicates that can
+    already be evaluated, before it pays for the remaining features.
+    """
+
+    def __init__(self, predicates: List[Predicate]):
+        self.predicates = sorted(predicates, key=lambda p: p.cost)
+
+    @property
+    def requires(self):
+        return {name for p in self.predicates for name in p.requires}
+
+    def __call__(self, estate: EstateOverview) -> bool:
+        return all(p.can_evaluate(estate) and p.fn(estate) for p in self.predicates)
+
+    def prefilter(self, estate: EstateOverview) -> bool:
+        """
+        False when a predicate rejects the estate with the features it has,
+        True when it may still pass.
+        """
+        return all(p.fn(estate) for p in self.predicates if p.can_evaluate(estate))
+
+
+def calculator_cost(calculator) -> float:
+    return getattr(calculator, "cost", DEFAULT_COST)
+
+
+def order_calculators(calculators: Dict, first: Set[str] = frozenset()) -> List[str]:
+    """
+    Names of the calculators, cheapest first, but never before the
+    features listed in their `requires`. Calculators named in `first`, e.g.
+    the features the filters need, go before all the others.
+    """
+    requires = {
+        name: set(getattr(calculator, "requires", ())) & calculators.keys()
+        for name, calculator in calculators.items()
+    }
+    def rank(i, name):
+        return (name not in first, calculator_cost(calculators[name]), i, name)
+
+    ready = [rank(i, name) for i, name in enumerate(calculators) if not requires[name]]
+    heapq.heapify(ready)
+    ordered = []
+    while ready:
+        name = heapq.heappop(ready)[-1]
+        ordered.append(name)
+        for i, other in enumerate(calculators):
+            if name in requires[other]:
+                requires[other].discard(name)
+                if not requires[other]:
+                    heapq.heappush(ready, rank(i, other))
+    if len(ordered) != len(calculators):
+        cyclic = sorted(calculators.keys() - set(ordered))
+        raise ValueError(f"Calculators with cyclic requirements: {cyclic}")
+    return ordered
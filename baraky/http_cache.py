@@ -0,0 +1,201 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import Counter, OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List
+
+import aiohttp
+
+from baraky.metrics import CACHE_REQUESTS, HTTP_REQUESTS
+from baraky.settings import HttpCacheSettings
+
+logger = logging.getLogger("baraky.http_cache")
+
+
+class HttpCache:
+    """
+    GET responses on the local disk with their ETag and Last-Modified.
+    Entries younger than the freshness window of their endpoint are served
+    without a request, older ones are revalidated with a conditional
+    request and a 304 reuses the stored body. Recently used bodies are kept
+    decoded in memory, so a hit does not parse them again. Entries not used
+    for `max_age_sec` are pruned from the disk once in a while.
+    """
+
+    def __init__(
+        self,
+        root=None,
+        freshness: Dict[str, float] | None = None,
+        memory_entries: int | None = None,
+        max_age_sec: float | None = None,
+        settings: HttpCacheSettings | None = None,
+    ):
+        if settings is None:
+            settings = HttpCacheSettings()
+        self.root = Path(root or settings.path)
+        # url prefix (without the scheme) -> seconds, the longest prefix wins
+        self.freshness = settings.freshness if freshness is None else freshness
+        self.memory_entries = memory_entries or settings.memory_entries
+        self.max_age_sec = settings.max_age_sec if max_age_sec is None else max_age_sec
+        self.prune_interval_sec = settings.prune_interval_sec
+        self.stats = Counter()
+        self._decoded: OrderedDict[str, tuple] = OrderedDict()
+        self._pruned_at = None
+
+    def fresh_sec(self, url: str) -> float:
+        address = url.partition("://")[2] or url
+        matches = [prefix for prefix in self.freshness if address.startswith(prefix)]
+        if not matches:
+            return 0
+        return self.freshness[max(matches, key=len)]
+
+    async def request_json(
+        self, session, url, headers={}, raw=False
+    ) -> Dict | bytes | None:
+        loop = asyncio.get_event_loop()
+        now = time.time()
+        if self._pruned_at is None or now - self._pruned_at >= self.prune_interval_sec:
+            self._pruned_at = now
+            await self.prune()
+        key = hashlib.sha1(url.encode()).hexdigest()
+        meta = await loop.run_in_executor(None, self._read_meta, key)
+        fresh_sec = self.fresh_sec(url)
+        if meta is not None and now - meta["stored_at"] < fresh_sec:
+            self._count("hit")
+            return await self._body(key, meta, raw)
+
+        conditional = dict(headers)
+        if meta is not None and meta.get("etag"):
+            conditional["If-None-Match"] = meta["etag"]
+        if meta is not None and meta.get("last_modified"):
+            conditional["If-Modified-Since"] = meta["last_modified"]
+
+        async with session.get(url, headers=conditional) as resp:
+            HTTP_REQUESTS.inc(host=resp.url.host, status=resp.status)
+            if resp.status == 304 and meta is not None:
+                meta["stored_at"] = time.time()
+                await loop.run_in_executor(None, self._write_meta, key, meta)
+                self._count("revalidated")
+                return await self._body(key, meta, raw)
+            try:
+                resp.raise_for_status()
+            except aiohttp.ClientResponseError:
+                logger.exception(
+                    "Failed to get %s with status %s error", url, resp.status
+                )
+                return None
+            body = await resp.read()
+            etag = resp.headers.get("ETag")
+            last_modified = resp.headers.get("Last-Modified")
+
+        self._count("miss")
+        if etag or last_modified or fresh_sec > 0:
+            meta = {
+                "url": url,
+                "etag": etag,
+                "last_modified": last_modified,
+                "stored_at": time.time(),
+            }
+            await loop.run_in_executor(None, self._write, key, meta, body)
+        else:
+            # nothing to revalidate with, the old entry is outdated anyway
+            meta = None
+        self._decoded.pop(key, None)
+        if raw:
+            return body
+        value = json.loads(body)
+        self._remember(key, meta, value)
+        return value
+
+    def _count(self, result: str):
+        self.stats[result] += 1
+        CACHE_REQUESTS.inc(cache="http", result=result)
+
+    async def prune(self) -> List[str]:
+        loop = asyncio.get_event_loop()
+        removed = await loop.run_in_executor(None, self.prune_sync)
+        for key in removed:
+            self._decoded.pop(key, None)
+        if removed:
+            logger.info("Pruned %d HTTP cache entries", len(removed))
+        return removed
+
+    def prune_sync(self, now: float | None = None) -> List[str]:
+        """
+        Removes the entries not stored or revalidated within `max_age_sec`,
+        e.g. routes of past days, and bodies left without their metadata.
+        Returns the removed keys.
+        """
+        now = time.time() if now is None else now
+        if not self.root.exists():
+            return []
+        removed = []
+        for meta_path in self.root.glob("*.json"):
+            try:
+                meta = json.loads(meta_path.read_text(encoding="utf-8"))
+                stored_at = meta["stored_at"]
+            except (OSError, json.JSONDecodeError, KeyError):
+                stored_at = 0
+            if now - stored_at < self.max_age_sec:
+                continue
+            meta_path.unlink(missing_ok=True)
+            (self.root / f"{meta_path.stem}.body").unlink(missing_ok=True)
+            removed.append(meta_path.stem)
+        for body_path in self.root.glob("*.body"):
+            if not body_path.with_suffix(".json").exists():
+                body_path.unlink(missing_ok=True)
+                removed.append(body_path.stem)
+        return removed
+
+    async def _body(self, key: str, meta: Dict, raw: bool):
+        if not raw:
+            validator = (meta.get("etag"), meta.get("last_modified"))
+            decoded = self._decoded.get(key)
+            if decoded is not None and decoded[0] == validator:
+                self._decoded.move_to_end(key)
+                return decoded[1]
+        loop = asyncio.get_event_loop()
+        body = await loop.run_in_executor(None, self._read_body, key)
+        if raw:
+            return body
+        value = json.loads(body)
+        self._remember(key, meta, value)
+        return value
+
+    def _remember(self, key: str, meta: Dict | None, value: Any):
+        if meta is None:
+            return
+        self._decoded[key] = ((meta.get("etag"), meta.get("last_modified")), value)
+        self._decoded.move_to_end(key)
+        while len(self._decoded) > self.memory_entries:
+            self._decoded.popitem(last=False)
+
+    def _read_meta(self, key: str) -> Dict | None:
+        try:
+            meta = json.loads((self.root / f"{key}.json").read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError):
+            return None
+        if not (self.root / f"{key}.body").exists():
+            return None
+        return meta
+
+    def _read_body(self, key: str) -> bytes:
+        return (self.root / f"{key}.body").read_bytes()
+
+    def _write(self, key: str, meta: Dict, body: bytes):
+        self.root.mkdir(parents=True, exist_ok=True)
+        body_path = self.root / f"{key}.body"
+        tmp_path = body_path.with_suffix(".tmp")
+        tmp_path.write_bytes(body)
+        os.replace(tmp_path, body_path)
+        self._write_meta(key, meta)
+
+    def _write_meta(self, key: str, meta: Dict):
+        meta_path = self.root / f"{key}.json"
+        tmp_path = meta_path.with_suffix(".meta.tmp")
+        tmp_path.write_text(json.dumps(meta), encoding="utf-8")
+        os.replace(tmp_path, meta_path)
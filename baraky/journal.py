@@ -0,0 +1,153 @@
+import asyncio
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from baraky.models import EstateOverview, parse_features
+
+logger = logging.getLogger("baraky.journal")
+
+
+class CycleJournal:
+    """
+    Append-only log of a running update cycle. It records the diff, the
+    features of every enhanced estate, sent notifications and saves, so an
+    interrupted cycle can be resumed without enhancing or notifying twice.
+    The journal is removed once the cycle finishes. A notification is
+    flushed to the OS as soon as it is recorded, so killing the process
+    does not send it twice. The other records are buffered and all of them
+    are fsynced by `sync`, called once per save batch, so a crash of the
+    machine may repeat the work of the last batch.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._fp = None
+        self._reset()
+
+    def _reset(self):
+        self._enhanced: Dict[Tuple[str, int], dict] = {}
+        self._notified = set()
+        self._saved = set()
+
+    def start(self, estates: List[EstateOverview], matches: Dict[str, List[str]]):
+        self.close()
+        self._reset()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._fp = open(self.path, "w", encoding="utf-8")
+        self._write(
+            {
+                "type": "diff",
+                "estates": [e.model_dump(mode="json") for e in estates],
+                "matches": {e.id: matches.get(e.id, []) for e in estates},
+            }
+        )
+        self._fp.flush()
+        os.fsync(self._fp.fileno())
+
+    def load(self) -> Tuple[List[EstateOverview], Dict[str, List[str]]] | None:
+        """
+        Loads an interrupted cycle. Returns its estates that were not saved
+        yet together with the search matches, or None if there is nothing
+        to resume.
+        """
+        if not self.path.exists():
+            return None
+
+        self._reset()
+        diff = None
+        with open(self.path, encoding="utf-8") as fp:
+            for line in fp:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # the last line may be cut off by the crash
+                    logger.warning("Skipping corrupted journal line")
+                    continue
+                diff = self._apply(record, diff)
+
+        if diff is None:
+            return None
+
+        estates = [EstateOverview.model_validate(e) for e in diff["estates"]]
+        unsaved = [e for e in estates if (e.id, e.price) not in self._saved]
+        self._fp = open(self.path, "a", encoding="utf-8")
+        return unsaved, diff["matches"]
+
+    def _apply(self, record, diff):
+        key = (record.get("id"), record.get("price"))
+        match record["type"]:
+            case "diff":
+                return record
+            case "enhanced":
+                self._enhanced[key] = record
+            case "notified":
+                self._notified.add((record["search"], *key))
+            case "saved":
+                self._saved.update((i, p) for i, p in record["estates"])
+        return diff
+
+    def restore_features(self, estate: EstateOverview) -> bool:
+        record = self._enhanced.get((estate.id, estate.price))
+        if record is None:
+            return False
+        estate.features = parse_features(record["features"])
+        estate.feature_keys = dict(record.get("feature_keys", {}))
+        return True
+
+    def record_enhanced(self, estate: EstateOverview):
+        dumped = estate.model_dump(mode="json", include={"features", "feature_keys"})
+        record = {
+            "type": "enhanced",
+            "id": estate.id,
+            "price": estate.price,
+            "features": dumped["features"],
+            "feature_keys": dumped["feature_keys"],
+        }
+        self._enhanced[(estate.id, estate.price)] = record
+        self._write(record)
+
+    def was_notified(self, search_name: str, estate: EstateOverview) -> bool:
+        return (search_name, estate.id, estate.price) in self._notified
+
+    def record_notified(self, search_name: str, estate: EstateOverview):
+        self._notified.add((search_name, estate.id, estate.price))
+        self._write(
+            {
+                "type": "notified",
+                "search": search_name,
+                "id": estate.id,
+                "price": estate.price,
+            }
+        )
+        # the hit is already in the queue, a resumed cycle must not repeat it
+        self._fp.flush()
+
+    def record_saved(self, estates: List[EstateOverview]):
+        saved = [(e.id, e.price) for e in estates]
+        self._saved.update(saved)
+        self._write({"type": "saved", "estates": saved})
+
+    async def sync(self):
+        if self._fp is None:
+            return
+        self._fp.flush()
+        # the records written meanwhile stay in the buffer of the file
+        await asyncio.get_running_loop().run_in_executor(
+            None, os.fsync, self._fp.fileno()
+        )
+
+    def finish(self):
+        self.close()
+        self.path.unlink(missing_ok=True)
+        self._reset()
+
+    def close(self):
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+
+    def _write(self, record):
+        self._fp.write(json.dumps(record, ensure_ascii=False) + "\n")
@@ -0,0 +1,232 @@
+import logging
+import math
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Tuple
+
+from aiohttp import web
+
+logger = logging.getLogger("baraky.metrics")
+
+Labels = Tuple[Tuple[str, str], ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+
+class Counter:
+    type_name = "counter"
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _labels_key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self.values.get(_labels_key(labels), 0)
+
+    def samples(self):
+        for labels, value in self.values.items():
+            yield self.name, labels, value
+
+
+class Gauge(Counter):
+    type_name = "gauge"
+
+    def set(self, value: float, **labels):
+        self.values[_labels_key(labels)] = value
+
+
+class Histogram:
+    type_name = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self.counts: Dict[Labels, list] = {}
+        self.sums: Dict[Labels, float] = {}
+
+    def observe(self, value: float, **labels):
+        key = _labels_key(labels)
+        counts = self.counts.setdefault(key, [0] * len(self.buckets))
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+        self.sums[key] = self.sums.get(key, 0) + value
+
+    def count(self, **labels) -> int:
+        counts = self.counts.get(_labels_key(labels))
+        return counts[-1] if counts else 0
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        for labels, counts in self.counts.items():
+            for bound, count in zip(self.buckets, counts):
+                le = "+Inf" if bound == math.inf else _format_value(bound)
+                yield f"{self.name}_bucket", labels + (("le", le),), count
+            yield f"{self.name}_sum", labels, self.sums[labels]
+            yield f"{self.name}_count", labels, counts[-1]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        return self._register(Counter(name, help_text))
+
+    def gauge(self, name: str, help_text: str) -> Gauge:
+        return self._register(Gauge(name, help_text))
+
+    def histogram(self, name: str, help_text: str, buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help_text, buckets))
+
+    def _register(self, metric):
+        return self.metrics.setdefault(metric.name, metric)
+
+    def render(self) -> str:
+        """
+        Renders all metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels_key(labels: dict) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in labels
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+REGISTRY = MetricsRegistry()
+
+HTTP_REQUESTS = REGISTRY.counter(
+    "baraky_http_requests_total", "HTTP requests by host and status"
+)
+PAGE_FETCH_SECONDS = REGISTRY.histogram(
+    "baraky_page_fetch_seconds", "Duration of a single result page fetch"
+)
+READ_ALL_SECONDS = REGISTRY.histogram(
+    "baraky_read_all_seconds", "Duration of reading all pages of a search"
+)
+STORAGE_DIFF_SECONDS = REGISTRY.histogram(
+    "baraky_storage_diff_seconds", "Duration of loading and diffing stored estates"
+)
+FEATURE_SECONDS = REGISTRY.histogram(
+    "baraky_feature_seconds", "Duration of a feature calculation"
+)
+NOTIFY_SECONDS = REGISTRY.histogram(
+    "baraky_notify_seconds", "Duration of routing an estate to the hit queues"
+)
+SAVE_SECONDS = REGISTRY.histogram(
+    "baraky_save_seconds", "Duration of saving a batch of estates"
+)
+CYCLE_SECONDS = REGISTRY.histogram(
+    "baraky_cycle_seconds", "Duration of a whole update cycle"
+)
+CACHE_REQUESTS = REGISTRY.counter(
+    "baraky_cache_requests_total", "Cache lookups by cache and result"
+)
+QUEUE_DEPTH = REGISTRY.gauge("baraky_queue_depth", "Estates waiting in a stage queue")
+ESTATES_PROCESSED = REGISTRY.counter(
+    "baraky_estates_total", "Estates that went through a cycle stage"
+)
+LAST_SUCCESS = REGISTRY.gauge(
+    "baraky_last_success_timestamp_seconds", "Unix time of the last finished cycle"
+)
+
+
+class MetricsServer:
+    """
+    Serves /metrics in Prometheus text format and /healthz with the time
+    of the last successful cycle.
+    """
+
+    def __init__(
+        self,
+        registry: MetricsRegistry = REGISTRY,
+        host: str = "127.0.0.1",
+        port: int = 9100,
+        max_cycle_age_sec: float | None = None,
+    ):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.max_cycle_age_sec = max_cycle_age_sec
+        self._runner = None
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.add_routes(
+            [
+                web.get("/metrics", self.metrics),
+                web.get("/healthz", self.healthz),
+            ]
+        )
+        return app
+
+    async def start(self):
+        self._runner = web.AppRunner(self.create_app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        logger.info("Serving metrics on http://%s:%d/metrics", self.host, self.port)
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def metrics(self, request):
+        return web.Response(
+            body=self.registry.render().encode("utf-8"),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )
+
+    async def healthz(self, request):
+        gauge = self.registry.gauge(LAST_SUCCESS.name, LAST_SUCCESS.help_text)
+        last_success = gauge.value()
+        if not last_success:
+            return web.json_response({"status": "starting", "last_success": None})
+
+        age = time.time() - last_success
+        is_stale = self.max_cycle_age_sec is not None and age > self.max_cycle_age_sec
+        body = {
+            "status": "stale" if is_stale else "ok",
+            "last_success": datetime.fromtimestamp(last_success).isoformat(),
+            "age_sec": round(age, 1),
+        }
+        return web.json_response(body, status=503 if is_stale else 200)
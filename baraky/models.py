@@ -1,5 +1,6 @@
-from pydantic import ConfigDict, BaseModel
-from typing import Any, Dict
+from pydantic import ConfigDict, BaseModel, field_validator
+from datetime import datetime
+from typing import Any, Dict, List
 
 from typing import Tuple
 
@@ -15,6 +16,25 @@ class PIDCommuteFeature(BaseModel):
     path_info: str | None
 
 
+class NearestStopFeature(BaseModel):
+    stop: str
+    distance_km: float
+
+
+class NeighbourhoodPriceFeature(BaseModel):
+    median_price: int | None
+    comparables: int
+    price_ratio: float | None
+
+
+class EstateDetailFeature(BaseModel):
+    title: str | None = None
+    description: str | None = None
+    usable_area: float | None = None
+    plot_area: float | None = None
+    built_up_area: float | None = None
+
+
 class PIDResponse(BaseModel):
     time_minutes: int
     transfers_count: int
@@ -28,6 +48,14 @@ class EstateOverview(BaseModel, extra="allow"):
     id: str
     gps: Tuple[float, float]
     features: Dict[str, Any] = {}  # This is supposed to be mutable ATM
+    # hashes of the inputs each feature was calculated from
+    feature_keys: Dict[str, str] = {}
+
+    @field_validator("features")
+    @classmethod
+    def _parse_known_features(cls, features: Dict[str, Any]):
+        # features are stored as plain json, turn the known ones back to models
+        return parse_features(features)
 
     @classmethod
     def from_record(cls, record: dict, detail_url: str):
@@ -46,12 +74,16 @@ class EstateQueueMessage(BaseModel):
     pid_commute_time_min: int
     transfers_count: int
     station_nearby: str
+    price_ratio: float | None = None
+    # links of near-duplicate listings of the same estate
+    other_links: List[str] = []
 
     @classmethod
-    def map_from_estate_overview(cls, model: EstateOverview):
+    def map_from_estate_overview(cls, model: EstateOverview, duplicates=()):
         pid_commute_time: PIDCommuteFeature = model.features.get("pid_commute_time")
         if pid_commute_time is None:
             raise ValueError("PID commute time not found")
+        neighbourhood_price = model.features.get("neighbourhood_price")
         return cls(
             link=model.link,
             price=model.price,
@@ -60,6 +92,8 @@ class EstateQueueMessage(BaseModel):
             transfers_count=pid_commute_time.transfers_count,
             # station_nearby=pid_commute_time.from_station,
             station_nearby=pid_commute_time.path_info or "",
+            price_ratio=getattr(neighbourhood_price, "price_ratio", None),
+            other_links=[duplicate.link for duplicate in duplicates],
         )
 
 
@@ -69,11 +103,61 @@ class EstateReaction(BaseModel):
     reaction: str
 
 
+class QueryFingerprint(BaseModel):
+    result_size: int
+    digest: str
+
+
+class SearchState(BaseModel):
+    fingerprint: QueryFingerprint | None
+    last_full_fetch: datetime
+    # ids of the last complete read, an unchanged search still returns them
+    estate_ids: List[str] | None = None
+
+
+class PricePoint(BaseModel):
+    id: str
+    timestamp: datetime
+    price: int
+    commute_minutes: int | None = None
+
+
+class PriceDrop(BaseModel):
+    id: str
+    timestamp: datetime
+    previous_price: int
+    price: int
+
+
+class Tombstone(BaseModel):
+    id: str
+    delisted_at: datetime
+
+
 class MinioObject(BaseModel):
-    data: str
+    data: str | bytes
     full_name: str
 
 
+FEATURE_MODELS: Dict[str, type[BaseModel]] = {
+    "pid_commute_time": PIDCommuteFeature,
+    "nearest_stop": NearestStopFeature,
+    "neighbourhood_price": NeighbourhoodPriceFeature,
+    "detail": EstateDetailFeature,
+}
+
+
+def parse_features(features: Dict[str, Any]) -> Dict[str, Any]:
+    return {name: _parse_feature(name, value) for name, value in features.items()}
+
+
+def _parse_feature(name: str, value: Any):
+    model = FEATURE_MODELS.get(name)
+    if model is None or not isinstance(value, dict):
+        return value
+    return model.model_validate(value)
+
+
 def _extract_id(json_dict: dict) -> str:
     path_part = json_dict.get("_links", {}).get("self", {}).get("href")
     return path_part.split("/")[-1]
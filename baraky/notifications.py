@@ -55,6 +55,13 @@ class TelegramNotificationsBot:
             base_message_text = (
                 f"{link}\n{commute_min=:.0f}.\n*Path*:{path}\n{transfers=}"
             )
+            if estate.price_ratio is not None:
+                price_ratio = estate.price_ratio
+                base_message_text += f"\n{price_ratio=:.2f}"
+            if estate.other_links:
+                base_message_text += "\n*Also listed*:\n" + "\n".join(
+                    estate.other_links
+                )
             await context.bot.send_message(
                 chat_id=chat_id, text=base_message_text, reply_markup=buttons
             )
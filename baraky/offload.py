@@ -0,0 +1,58 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, List, Sequence
+
+logger = logging.getLogger("baraky.offload")
+
+
+class CpuPool:
+    """
+    Runs CPU-bound batches in worker processes, so the event loop keeps
+    serving fetches and bot handlers meanwhile. Work is split into chunks
+    sent as one task each. Without workers the chunks run inline.
+
+    Workers are started by a fork server, forking the running event loop
+    with its threads and sockets is not safe.
+    """
+
+    def __init__(self, workers: int | None = None, chunk_size: int = 20):
+        self.workers = os.cpu_count() if workers is None else workers
+        self.chunk_size = chunk_size
+        self._executor = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 0
+
+    async def run(self, fn: Callable, *args):
+        if not self.enabled:
+            return fn(*args)
+        if self._executor is None:
+            logger.debug("Starting %d CPU worker processes", self.workers)
+            self._executor = ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context("forkserver")
+            )
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    async def map_chunks(
+        self, fn: Callable, items: Sequence, *args, chunk_size: int | None = None
+    ) -> List:
+        """
+        Calls `fn(chunk, *args)` for consecutive chunks of the items, in
+        parallel, and returns the results in the order of the chunks.
+        """
+        chunk_size = chunk_size or self.chunk_size
+        chunks = [
+            items[start : start + chunk_size]
+            for start in range(0, len(items), chunk_size)
+        ]
+        return await asyncio.gather(*[self.run(fn, chunk, *args) for chunk in chunks])
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,146 @@
+import asyncio
+import cProfile
+import json
+import logging
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+logger = logging.getLogger("baraky.profiling")
+
+try:
+    from pyinstrument import Profiler as SamplingProfiler
+    from pyinstrument.renderers import SpeedscopeRenderer
+    from pyinstrument.session import Session
+except ImportError:
+    SamplingProfiler = None
+
+
+class CycleProfiler:
+    """
+    Profiles update cycles. The stats of all cycles so far are written to
+    `path` after every cycle: a speedscope json when pyinstrument is
+    installed (sampling), cProfile stats otherwise.
+    """
+
+    def __init__(self, path, sampling: bool | None = None):
+        self.path = Path(path)
+        if sampling is None:
+            sampling = SamplingProfiler is not None
+        if sampling and SamplingProfiler is None:
+            raise ValueError("Sampling profiler requires pyinstrument")
+        self.sampling = sampling
+        self._profile = cProfile.Profile()
+        self._session = None
+
+    async def run(self, coro):
+        if self.sampling:
+            return await self._run_sampling(coro)
+        self._profile.enable()
+        try:
+            return await coro
+        finally:
+            self._profile.disable()
+            self._profile.dump_stats(self.path)
+            logger.info("Profile written to %s", self.path)
+
+    async def _run_sampling(self, coro):
+        profiler = SamplingProfiler(async_mode="enabled")
+        profiler.start()
+        try:
+            return await coro
+        finally:
+            session = profiler.stop()
+            if self._session is not None:
+                session = Session.combine(self._session, session)
+            self._session = session
+            self.path.write_text(SpeedscopeRenderer().render(session))
+            logger.info("Profile written to %s", self.path)
+
+
+class SpanTracer:
+    """
+    Writes start and end of traced operations as json lines. Does nothing
+    until a file is opened.
+    """
+
+    def __init__(self):
+        self._fp = None
+
+    @property
+    def enabled(self):
+        return self._fp is not None
+
+    def open(self, path):
+        self.close()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._fp = open(path, "a", encoding="utf-8")
+
+    def close(self):
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        if self._fp is None:
+            yield
+            return
+
+        start = time.time()
+        start_perf = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start_perf
+            self.write(name, start, duration, **attrs)
+
+    def write(self, name: str, start: float, duration: float, **attrs):
+        if self._fp is None:
+            return
+        record = {
+            "name": name,
+            "start": start,
+            "end": start + duration,
+            "duration_ms": round(duration * 1000, 3),
+            "task": _current_task_name(),
+        } | attrs
+        self._fp.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+
+def _current_task_name():
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        return None
+    return task.get_name() if task is not None else None
+
+
+TRACER = SpanTracer()
+
+
+async def watch_loop_stalls(interval_sec=0.05, threshold_sec=0.1, tracer=TRACER):
+    """
+    Records a `loop.stall` span whenever the event loop wakes up more than
+    `threshold_sec` late, e.g. because of blocking Minio calls.
+    """
+    while True:
+        expected = time.perf_counter() + interval_sec
+        await asyncio.sleep(interval_sec)
+        lag = time.perf_counter() - expected
+        if lag > threshold_sec:
+            tracer.write("loop.stall", time.time() - lag, lag)
+
+
+async def traced(coro, trace_out=None):
+    if trace_out is None:
+        return await coro
+
+    TRACER.open(trace_out)
+    monitor = asyncio.create_task(watch_loop_stalls())
+    try:
+        return await coro
+    finally:
+        monitor.cancel()
+        TRACER.close()
+        logger.info("Trace written to %s", trace_out)
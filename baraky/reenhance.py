@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import time
+from pathlib import Path
+from typing import Dict, List
+
+from tqdm.auto import tqdm
+
+from baraky import feature_cache
+from baraky.estate_features import CALCULATOR_DELAYS
+from baraky.filters import order_calculators
+from baraky.models import EstateOverview
+
+logger = logging.getLogger("baraky.reenhance")
+
+
+class Reenhancer:
+    """
+    Recomputes features of the whole stored archive. Progress is
+    checkpointed after every saved batch, so an interrupted run with the
+    same features continues where it stopped. Only the recomputed features
+    are merged into the estate as stored at the time of the save, so the
+    changes of a watcher running meanwhile are kept.
+    """
+
+    def __init__(
+        self,
+        storage,
+        feature_calculators: Dict,
+        checkpoint_path,
+        concurrency=4,
+        batch_size=100,
+        progress=True,
+        calculator_delays: Dict[str, float] | None = None,
+        tombstone_storage=None,
+    ):
+        self.storage = storage
+        self.feature_calculators = feature_calculators
+        self.checkpoint_path = Path(checkpoint_path)
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.batch_size = batch_size
+        self.tqdm_disabled = not progress
+        if calculator_delays is None:
+            calculator_delays = CALCULATOR_DELAYS
+        self.calculator_delays = calculator_delays
+        self.tombstone_storage = tombstone_storage
+
+    async def run(self) -> int:
+        ids = await self.storage.list_ids()
+        done = self._read_checkpoint()
+        pending = [estate_id for estate_id in ids if estate_id not in done]
+        logger.info(
+            "Re-enhancing %d estates with %s (%d already done)",
+            len(pending),
+            ", ".join(self.feature_calculators),
+            len(ids) - len(pending),
+        )
+
+        batches = [
+            pending[i : i + self.batch_size]
+            for i in range(0, len(pending), self.batch_size)
+        ]
+        start = time.perf_counter()
+        processed = 0
+        progress = tqdm(
+            total=len(pending),
+            desc="Re-enhancing estates",
+            disable=self.tqdm_disabled or len(pending) == 0,
+        )
+        with progress:
+            next_load = None
+            if batches:
+                next_load = asyncio.create_task(self.storage.get_many(batches[0]))
+            for i in range(len(batches)):
+                estates = await next_load
+                # prefetch the next batch while this one is being enhanced
+                if i + 1 < len(batches):
+                    next_load = asyncio.create_task(
+                        self.storage.get_many(batches[i + 1])
+                    )
+                await self._enhance_batch(estates)
+                await self._save_batch(estates)
+                self._write_checkpoint(batches[i])
+
+                processed += len(estates)
+                progress.update(len(batches[i]))
+                elapsed = time.perf_counter() - start
+                logger.debug(
+                    "Re-enhanced %d/%d estates, %.1f estates/s",
+                    processed,
+                    len(pending),
+                    processed / elapsed if elapsed else 0,
+                )
+
+        self.checkpoint_path.unlink(missing_ok=True)
+        return processed
+
+    async def _enhance_batch(self, estates: List[EstateOverview]):
+        await asyncio.gather(*[self._enhance(estate) for estate in estates])
+
+    async def _enhance(self, estate: EstateOverview):
+        # a calculator may need the feature of another one, e.g. the stop
+        for name in order_calculators(self.feature_calculators):
+            calculator = self.feature_calculators[name]
+            async with self.semaphore:
+                # each slot waits like an enhance worker of the watcher
+                if name in self.calculator_delays:
+                    await asyncio.sleep(self.calculator_delays[name])
+                feature_data = await calculator.calculate(estate)
+            if feature_data is None:
+                continue
+            estate.features[name] = feature_data
+            feature_cache.remember(name, calculator, estate)
+
+    async def _save_batch(self, estates: List[EstateOverview]):
+        current = await self.storage.get_many([e.id for e in estates])
+        tombstoned = set()
+        if self.tombstone_storage is not None:
+            loop = asyncio.get_event_loop()
+            tombstoned = set(
+                await loop.run_in_executor(None, self.tombstone_storage.list_ids)
+            )
+        enhanced = {e.id: e for e in estates}
+        merged = []
+        # estates removed or delisted by the watcher meanwhile are skipped
+        for stored in current:
+            if stored.id in tombstoned:
+                continue
+            estate = enhanced[stored.id]
+            for name in self.feature_calculators:
+                if name in estate.features:
+                    stored.features[name] = estate.features[name]
+                if name in estate.feature_keys:
+                    stored.feature_keys[name] = estate.feature_keys[name]
+                else:
+                    stored.feature_keys.pop(name, None)
+            merged.append(stored)
+        await self.storage.save_many(merged)
+
+    def _checkpoint_header(self):
+        return "features " + " ".join(sorted(self.feature_calculators))
+
+    def _read_checkpoint(self):
+        if not self.checkpoint_path.exists():
+            return set()
+        header, _, ids = self.checkpoint_path.read_text().partition("\n")
+        if header != self._checkpoint_header():
+            logger.info("Checkpoint is of other features, starting over")
+            self.checkpoint_path.unlink()
+            return set()
+        return set(ids.split())
+
+    def _write_checkpoint(self, estate_ids: List[str]):
+        self.checkpoint_path.parent.mkdir(parents=True, exist_ok=True)
+        is_new = not self.checkpoint_path.exists()
+        with open(self.checkpoint_path, "a") as fp:
+            if is_new:
+                fp.write(self._checkpoint_header() + "\n")
+            fp.write("\n".join(estate_ids) + "\n")
@@ -0,0 +1,86 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+from typing import List
+
+from baraky.settings import PollingSchedulerSettings
+
+logger = logging.getLogger("baraky.scheduler")
+
+
+class ScheduledJob:
+    def __init__(
+        self,
+        name: str,
+        interval_sec: float,
+        settings: PollingSchedulerSettings | None = None,
+    ):
+        if settings is None:
+            settings = PollingSchedulerSettings()
+        self.name = name
+        self.settings = settings
+        self.interval_sec = self._clamp(interval_sec)
+        self.next_run = 0.0
+
+    def adapt(self, changes: int):
+        factor = self.settings.speedup if changes > 0 else self.settings.slowdown
+        self.interval_sec = self._clamp(self.interval_sec * factor)
+
+    def _clamp(self, interval_sec):
+        return min(
+            max(interval_sec, self.settings.min_interval_sec),
+            self.settings.max_interval_sec,
+        )
+
+
+class PollingScheduler:
+    """
+    Deadline based scheduler of independent polling jobs. Each job's
+    interval adapts to how often its runs find changes.
+    """
+
+    def __init__(self, clock=time.monotonic, sleep=asyncio.sleep, rng=None):
+        self._clock = clock
+        self._sleep = sleep
+        self._rng = rng or random.Random()
+        self._heap = []
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def add(self, job: ScheduledJob, delay_sec: float = 0.0):
+        job.next_run = self._clock() + delay_sec
+        heapq.heappush(self._heap, (job.next_run, next(self._counter), job))
+
+    def reschedule(self, job: ScheduledJob, changes: int):
+        job.adapt(changes)
+        jitter = self._rng.uniform(0, job.settings.jitter_sec)
+        logger.debug(
+            "Job %s found %d changes, next run in %.0f sec",
+            job.name,
+            changes,
+            job.interval_sec + jitter,
+        )
+        self.add(job, job.interval_sec + jitter)
+
+    async def next_due(self) -> List[ScheduledJob]:
+        """
+        Sleeps until the earliest deadline and pops all jobs due by then.
+        """
+        if not self._heap:
+            raise ValueError("No jobs scheduled")
+
+        delay = self._heap[0][0] - self._clock()
+        if delay > 0:
+            await self._sleep(delay)
+
+        now = self._clock()
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            _, _, job = heapq.heappop(self._heap)
+            due.append(job)
+        return due
@@ -26,6 +26,15 @@ class SrealityClientSettings(BaseSettings):
     base_url: AnyUrl = "https://www.sreality.cz/api/cs/v2/"
     detail_url: AnyUrl = "https://www.sreality.cz/detail/prodej/dum/rodinny/"
     per_page: int = 100
+    # cheap change detection reads this many newest estates
+    probe_size: int = 20
+    probe_query: Dict = {"sort": 0}
+    # larger searches are split by price into shards of at most this size,
+    # the API does not page through more
+    max_result_size: int = 5000
+    price_param: str = "czk_price_summary_order2"
+    max_price: int = 1_000_000_000
+    shard_concurrency: int = 4
 
     @classmethod
     def settings_customise_sources(
@@ -39,6 +48,22 @@ class SrealityClientSettings(BaseSettings):
         return (MyInitSettingsSource(settings_cls, init_settings.init_kwargs),)
 
 
+class EstateDetailSettings(BaseSettings):
+    cache_path: str = ".baraky/details"
+    retries: int = 2
+    backoff_sec: float = 0.5
+
+
+class DedupSettings(BaseSettings):
+    model_config = SettingsConfigDict(
+        env_file=".env", env_prefix="DEDUP_", extra="ignore"
+    )
+    # listings at most this far apart whose prices differ by at most the
+    # relative tolerance are one house, 0 turns the dedup off
+    distance_m: float = 30.0
+    price_tolerance: float = 0.02
+
+
 class MinioClientSettings(BaseSettings):
     model_config = SettingsConfigDict(
         env_file=".env", env_prefix="MINIO_", extra="ignore"
@@ -48,6 +73,54 @@ class MinioClientSettings(BaseSettings):
     secret_key: str  # loaded from env
 
 
+class HttpCacheSettings(BaseSettings):
+    model_config = SettingsConfigDict(
+        env_file=".env", env_prefix="HTTP_CACHE_", extra="ignore"
+    )
+    path: str = ".baraky/http"
+    # seconds a response is used without asking the server, by url prefix
+    # without the scheme; the longest matching prefix wins
+    freshness: Dict[str, float] = {
+        "www.sreality.cz/api/cs/v2/estates?": 0,
+        # revalidated only, unchanged listings are served by the detail cache
+        "www.sreality.cz/api/cs/v2/estates/": 0,
+        # the route query contains the date
+        "pid.cz/": 24 * 3600,
+    }
+    # decoded bodies kept in memory
+    memory_entries: int = 256
+    # entries neither stored nor revalidated for this long are removed
+    max_age_sec: float = 7 * 24 * 3600
+    prune_interval_sec: float = 3600
+
+
+class StorageSettings(BaseSettings):
+    model_config = SettingsConfigDict(
+        env_file=".env", env_prefix="STORAGE_", extra="ignore"
+    )
+    # format of newly written estates and hits, "json" or "msgpack"
+    codec: str = "json"
+
+
+class RedisSettings(BaseSettings):
+    model_config = SettingsConfigDict(
+        env_file=".env", env_prefix="REDIS_", extra="ignore"
+    )
+    url: str = "redis://localhost:6379/0"
+    stream: str = "baraky:enhance"
+    group: str = "enhancers"
+    # each watcher cycle gets its own reply stream with this prefix
+    reply_prefix: str = "baraky:enhanced:"
+    route_prefix: str = "baraky:route:"
+    route_ttl_sec: int = 7 * 24 * 3600
+    # entries of a worker that is silent this long are taken over
+    claim_idle_ms: int = 60_000
+    block_ms: int = 5_000
+    batch_size: int = 10
+    # a cycle fails when no result arrives for this long
+    reply_timeout_sec: float = 600
+
+
 class RabbitMQSettings(BaseSettings):
     model_config = SettingsConfigDict(
         env_file=".env", env_prefix="RABBITMQ_", extra="ignore"
@@ -96,3 +169,12 @@ class PIDClientSettings(BaseSettings):
         ["speed", "high"],
         ["ajax", "true"],
     ]
+
+
+class PollingSchedulerSettings(BaseSettings):
+    min_interval_sec: float = 120
+    max_interval_sec: float = 3600
+    jitter_sec: float = 30
+    # interval multipliers applied after a run with / without changes
+    speedup: float = 0.5
+    slowdown: float = 1.25
@@ -0,0 +1,260 @@
+import asyncio
+import logging
+import math
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+import numpy as np
+import scipy
+
+from baraky.models import EstateOverview, Gps, NeighbourhoodPriceFeature
+from baraky.offload import CpuPool
+
+logger = logging.getLogger("baraky.spatial")
+
+KM_PER_DEGREE_LAT = 110.574
+KM_PER_DEGREE_LON = 111.320
+# Czechia is small enough for a single equirectangular projection
+REFERENCE_LAT = 49.8
+
+
+def project_km(gps) -> np.ndarray:
+    gps = np.asarray(gps, dtype=np.float64).reshape(-1, 2)
+    lon_scale = KM_PER_DEGREE_LON * math.cos(math.radians(REFERENCE_LAT))
+    return np.column_stack((gps[:, 0] * KM_PER_DEGREE_LAT, gps[:, 1] * lon_scale))
+
+
+class EstateSpatialIndex:
+    """
+    KDTree over stored estates projected to kilometres. Estates are added
+    and removed by id, the tree is rebuilt at most once per batch, on the
+    first query after a change.
+    """
+
+    def __init__(self):
+        self._rows: Dict[str, Tuple[Gps, int]] = {}
+        self._tree = None
+        self._ids = np.array([], dtype=str)
+        self._points = np.empty((0, 2))
+        self._prices = np.array([], dtype=np.float64)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, estate_id: str):
+        return estate_id in self._rows
+
+    def price(self, estate_id: str) -> int:
+        return self._rows[estate_id][1]
+
+    def add_many(self, estates: List[EstateOverview]):
+        for estate in estates:
+            self._rows[estate.id] = (estate.gps, estate.price)
+        self._tree = None
+
+    def remove_many(self, estate_ids):
+        for estate_id in estate_ids:
+            self._rows.pop(estate_id, None)
+        self._tree = None
+
+    def sync(self, estates: List[EstateOverview]):
+        """
+        Makes the index hold exactly the given estates, e.g. the stored ones.
+        """
+        ids = {estate.id for estate in estates}
+        removed = [estate_id for estate_id in self._rows if estate_id not in ids]
+        self.remove_many(removed)
+        changed = [
+            estate
+            for estate in estates
+            if self._rows.get(estate.id) != (estate.gps, estate.price)
+        ]
+        if changed:
+            self.add_many(changed)
+
+    def _build(self):
+        if self._tree is not None:
+            return
+        rows = list(self._rows.items())
+        self._ids = np.array([estate_id for estate_id, _ in rows], dtype=str)
+        gps = np.array([row[0] for _, row in rows], dtype=np.float64)
+        self._prices = np.array([row[1] for _, row in rows], dtype=np.float64)
+        self._points = project_km(gps) if rows else np.empty((0, 2))
+        self._tree = scipy.spatial.KDTree(self._points)
+        logger.debug("Rebuilt spatial index of %d estates", len(rows))
+
+    def within(self, gps: Gps, radius_km: float) -> List[str]:
+        self._build()
+        if len(self._ids) == 0:
+            return []
+        idx = self._tree.query_ball_point(project_km(gps)[0], radius_km)
+        return self._ids[sorted(idx)].tolist()
+
+    def median_nearest_prices(
+        self, gps_list, k: int, exclude_ids=None, max_km: float = np.inf
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Median price of the `k` nearest estates for every position in one
+        vectorized query. Returns the medians (NaN without comparables) and
+        the number of comparables used.
+        """
+        self._build()
+        return median_nearest_prices(
+            self._tree,
+            self._ids,
+            self._prices,
+            project_km(gps_list),
+            k,
+            exclude_ids,
+            max_km,
+        )
+
+    async def median_nearest_prices_offloaded(
+        self,
+        pool: CpuPool,
+        gps_list,
+        k: int,
+        exclude_ids=None,
+        max_km: float = np.inf,
+        chunk_size: int = 5000,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Same as `median_nearest_prices`, queried in the worker processes of
+        the pool. Only the arrays are sent and every chunk rebuilds the tree,
+        so the positions are split into at most one chunk per worker of at
+        least `chunk_size` positions. A single chunk is queried inline.
+        """
+        self._build()
+        points = project_km(gps_list)
+        if len(points) <= chunk_size:
+            return median_nearest_prices(
+                self._tree, self._ids, self._prices, points, k, exclude_ids, max_km
+            )
+        if exclude_ids is None:
+            exclude_ids = np.full(len(points), "", dtype=str)
+        exclude_ids = np.asarray(exclude_ids, dtype=str)
+        chunk_size = max(chunk_size, math.ceil(len(points) / pool.workers))
+        results = await asyncio.gather(
+            *[
+                pool.run(
+                    _median_nearest_chunk,
+                    self._points,
+                    self._ids,
+                    self._prices,
+                    points[start : start + chunk_size],
+                    exclude_ids[start : start + chunk_size],
+                    k,
+                    max_km,
+                )
+                for start in range(0, len(points), chunk_size)
+            ]
+        )
+        medians, counts = zip(*results)
+        return np.concatenate(medians), np.concatenate(counts)
+
+    def count_added_per_cell(
+        self, first_seen: Dict[str, datetime], since: datetime, cell_km: float = 1.0
+    ):
+        """
+        Number of indexed estates first seen after `since` per square grid
+        cell, keyed by the cell indices. The times come from a persisted
+        record, e.g. `PriceHistoryStorage.first_seen`, so that a restart
+        does not count the whole archive as new.
+        """
+        self._build()
+        added_at = np.array(
+            [first_seen.get(estate_id, datetime.min) for estate_id in self._ids],
+            dtype="datetime64[us]",
+        )
+        is_new = added_at > np.datetime64(since, "us")
+        if not is_new.any():
+            return {}
+        cells = np.floor(self._points[is_new] / cell_km).astype(np.int64)
+        unique, counts = np.unique(cells, axis=0, return_counts=True)
+        return {tuple(cell.tolist()): int(c) for cell, c in zip(unique, counts)}
+
+
+def median_nearest_prices(
+    tree, ids, prices, points, k: int, exclude_ids=None, max_km: float = np.inf
+) -> Tuple[np.ndarray, np.ndarray]:
+    if len(ids) == 0 or len(points) == 0:
+        return np.full(len(points), np.nan), np.zeros(len(points), dtype=int)
+
+    # one more neighbour, the estate itself may be indexed already
+    query_k = min(k + 1, len(ids))
+    distances, idx = tree.query(points, k=query_k, distance_upper_bound=max_km)
+    distances = distances.reshape(len(points), query_k)
+    idx = idx.reshape(len(points), query_k)
+
+    valid = np.isfinite(distances)
+    safe_idx = np.where(valid, idx, 0)
+    if exclude_ids is not None:
+        exclude = np.asarray(exclude_ids, dtype=str).reshape(-1, 1)
+        valid &= ids[safe_idx] != exclude
+    # keep only the k nearest of the remaining ones
+    valid &= np.cumsum(valid, axis=1) <= k
+
+    neighbour_prices = np.where(valid, prices[safe_idx], np.nan)
+    counts = valid.sum(axis=1)
+    medians = np.full(len(points), np.nan)
+    has_any = counts > 0
+    medians[has_any] = np.nanmedian(neighbour_prices[has_any], axis=1)
+    return medians, counts
+
+
+def _median_nearest_chunk(points, ids, prices, query_points, exclude_ids, k, max_km):
+    tree = scipy.spatial.KDTree(points)
+    return median_nearest_prices(
+        tree, ids, prices, query_points, k, exclude_ids, max_km
+    )
+
+
+class NeighbourhoodPriceEnhancer:
+    """
+    Compares the price of an estate with the median of the `k` nearest
+    stored estates. Works on whole batches through `calculate_many`.
+    """
+
+    cost = 0.1
+
+    def __init__(
+        self,
+        index: EstateSpatialIndex,
+        k: int = 10,
+        max_km: float = 5.0,
+        cpu_pool: CpuPool | None = None,
+    ):
+        self.index = index
+        self.k = k
+        self.max_km = max_km
+        self.cpu_pool = cpu_pool
+
+    async def calculate(self, estate_overview: EstateOverview):
+        return (await self.calculate_many([estate_overview]))[0]
+
+    async def calculate_many(
+        self, estates: List[EstateOverview]
+    ) -> List[NeighbourhoodPriceFeature]:
+        if not estates:
+            return []
+        gps_list = [estate.gps for estate in estates]
+        exclude_ids = [estate.id for estate in estates]
+        if self.cpu_pool is not None and self.cpu_pool.enabled:
+            medians, counts = await self.index.median_nearest_prices_offloaded(
+                self.cpu_pool, gps_list, self.k, exclude_ids, self.max_km
+            )
+        else:
+            medians, counts = self.index.median_nearest_prices(
+                gps_list, self.k, exclude_ids, self.max_km
+            )
+        features = []
+        for estate, median, count in zip(estates, medians, counts):
+            has_median = not np.isnan(median) and median > 0
+            features.append(
+                NeighbourhoodPriceFeature(
+                    median_price=int(median) if has_median else None,
+                    comparables=int(count),
+                    price_ratio=estate.price / median if has_median else None,
+                )
+            )
+        return features
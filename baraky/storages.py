@@ -1,18 +1,27 @@
 import asyncio
+import uuid
 
+from bisect import bisect_right
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from baraky.models import (
     EstateOverview,
     EstateQueueMessage,
     EstateReaction,
     MinioObject,
+    PriceDrop,
+    PricePoint,
+    SearchState,
+    Tombstone,
 )
-from typing import List, Tuple
+from typing import Dict, List, Tuple
 import logging
 from minio import Minio
 from minio.datatypes import Object
-from baraky.settings import MinioClientSettings
+from baraky.serialization import decode, get_codec
+from baraky.settings import MinioClientSettings, StorageSettings
+from baraky.io import glob_files, write_model_json
+from baraky.profiling import TRACER
 import io
 
 logger = logging.getLogger("baraky.storage.minio")
@@ -31,17 +40,21 @@ class MinioStorage:
         self.bucket_name = bucket_name
         self._bucket_ensured = False
 
-    def _list_objects(self, prefix: str) -> List[Object]:
+    def _list_objects(self, prefix: str, recursive=False) -> List[Object]:
         self._ensure_bucket()
         return self.client.list_objects(
             self.bucket_name,
             prefix=prefix,
+            recursive=recursive,
         )
 
-    def get_objects(self, prefix: str) -> List[MinioObject]:
-        objects = self._list_objects(prefix)
+    def get_objects(
+        self, prefix: str, recursive=False, binary=False
+    ) -> List[MinioObject]:
+        objects = self._list_objects(prefix, recursive)
         names = [o.object_name for o in objects]
-        data_list = [self.get_sync(object_name) for object_name in names]
+        get = self.get_bytes_sync if binary else self.get_sync
+        data_list = [get(object_name) for object_name in names]
 
         return [
             MinioObject(
@@ -56,9 +69,21 @@ class MinioStorage:
         objects = self._list_objects(prefix)
         return [Path(obj.object_name).stem for obj in objects]
 
-    def save_sync(self, object_name, object_body: str, content_type="application/json"):
+    def list_modified_sync(self, prefix: str) -> Dict[str, datetime]:
+        objects = self._list_objects(prefix)
+        return {
+            Path(obj.object_name).stem: obj.last_modified
+            for obj in objects
+            if not obj.is_dir
+        }
+
+    def save_sync(
+        self, object_name, object_body: str | bytes, content_type="application/json"
+    ):
         self._ensure_bucket()
-        values_as_bytes = object_body.encode("utf-8")
+        values_as_bytes = (
+            object_body.encode("utf-8") if isinstance(object_body, str) else object_body
+        )
         data_stream = io.BytesIO(values_as_bytes)
         length = len(values_as_bytes)
 
@@ -67,6 +92,10 @@ class MinioStorage:
         )
 
     def get_sync(self, object_name: str) -> str | None:
+        data = self.get_bytes_sync(object_name)
+        return None if data is None else data.decode()
+
+    def get_bytes_sync(self, object_name: str) -> bytes | None:
         self._ensure_bucket()
         # logger.debug(
         #     "Getting object %s from bucket %s",
@@ -75,7 +104,7 @@ class MinioStorage:
         # )
         response = self.client.get_object(self.bucket_name, object_name)
         try:
-            return response.data.decode()
+            return response.data
         except Exception:
             logger.exception(
                 "Error while getting object %s from bucket %s",
@@ -103,21 +132,107 @@ class MinioStorage:
             logger.info(f"Created bucket {self.bucket_name}")
 
 
+class FileSystemStorage:
+    """
+    Local filesystem counterpart of MinioStorage. Object names are paths
+    relative to `root`.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    async def get_ids(self):
+        paths = glob_files(self.root, "*.json")
+        return [Path(p).stem for p in paths]
+
+    async def save(self, estates: List[EstateOverview]):
+        self.root.mkdir(parents=True, exist_ok=True)
+        for estate in estates:
+            await write_model_json(self.root / f"{estate.id}.json", estate)
+
+    def _list_objects(self, prefix: str, recursive=False) -> List[str]:
+        path = self.root / prefix
+        if prefix.endswith("/"):
+            directory, name_prefix = path, ""
+        else:
+            directory, name_prefix = path.parent, path.name
+        if not directory.is_dir():
+            return []
+        paths = directory.rglob("*") if recursive else directory.iterdir()
+        return sorted(
+            str(p.relative_to(self.root))
+            for p in paths
+            if p.is_file() and p.relative_to(directory).parts[0].startswith(name_prefix)
+        )
+
+    def get_objects(
+        self, prefix: str, recursive=False, binary=False
+    ) -> List[MinioObject]:
+        names = self._list_objects(prefix, recursive)
+        get = self.get_bytes_sync if binary else self.get_sync
+        data_list = [get(object_name) for object_name in names]
+        return [
+            MinioObject(
+                data=data,
+                full_name=name,
+            )
+            for data, name in zip(data_list, names)
+            if data is not None
+        ]
+
+    def list_ids_sync(self, prefix: str):
+        return [Path(name).stem for name in self._list_objects(prefix)]
+
+    def list_modified_sync(self, prefix: str) -> Dict[str, datetime]:
+        return {
+            Path(name).stem: datetime.fromtimestamp(
+                (self.root / name).stat().st_mtime, tz=timezone.utc
+            )
+            for name in self._list_objects(prefix)
+        }
+
+    def save_sync(
+        self, object_name, object_body: str | bytes, content_type="application/json"
+    ):
+        path = self.root / object_name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if isinstance(object_body, str):
+            object_body = object_body.encode("utf-8")
+        path.write_bytes(object_body)
+
+    def get_sync(self, object_name: str) -> str | None:
+        data = self.get_bytes_sync(object_name)
+        return None if data is None else data.decode("utf-8")
+
+    def get_bytes_sync(self, object_name: str) -> bytes | None:
+        path = self.root / object_name
+        try:
+            return path.read_bytes()
+        except OSError:
+            logger.exception("Error while reading %s", path)
+            return None
+
+    def remove_sync(self, object_name: str):
+        logger.debug("Removing object %s from %s", object_name, self.root)
+        (self.root / object_name).unlink(missing_ok=True)
+
+
 class EstatesHitQueue:
-    def __init__(self, object_prefix, storage):
+    def __init__(self, object_prefix, storage, codec=None):
         self.storage = storage
         self.object_prefix = object_prefix
+        self.codec = codec or get_codec(StorageSettings().codec)
 
     def total(self):
         ids = self.storage.list_ids_sync(self.object_prefix)
         return len(ids)
 
     def put(self, estate: EstateQueueMessage):
-        json_text = estate.model_dump_json()
+        body = self.codec.encode(estate)
         timestamp = get_timestamp()
         prefix = self.object_prefix.rstrip("/")
         object_name = f"{prefix}/{timestamp}_{estate.id}.json"
-        self.storage.save_sync(object_name, json_text)
+        self.storage.save_sync(object_name, body, content_type=self.codec.content_type)
 
     def peek(self) -> Tuple[str, EstateQueueMessage] | None:
         ids = self.storage.list_ids_sync(self.object_prefix)
@@ -127,14 +242,27 @@ class EstatesHitQueue:
         min_id = min(ids)
         prefix = self.object_prefix.rstrip("/")
         object_name = f"{prefix}/{min_id}.json"
-        data = self.storage.get_sync(object_name)
-        return min_id, EstateQueueMessage.model_validate_json(data)
+        data = self.storage.get_bytes_sync(object_name)
+        return min_id, decode(data, EstateQueueMessage)
 
     def delete(self, object_id):
         prefix = self.object_prefix.rstrip("/")
         object_name = f"{prefix}/{object_id}.json"
         self.storage.remove_sync(object_name)
 
+    def purge(self, estate_ids) -> int:
+        """
+        Deletes pending hits of the given estates, returns how many.
+        """
+        estate_ids = set(estate_ids)
+        purged = 0
+        for object_id in self.storage.list_ids_sync(self.object_prefix):
+            _, _, estate_id = object_id.partition("_")
+            if estate_id in estate_ids:
+                self.delete(object_id)
+                purged += 1
+        return purged
+
 
 class ReactionsStorage:
     def __init__(self, object_prefix, storage):
@@ -161,12 +289,70 @@ class ReactionsStorage:
             for d in data
         ]
 
+    def read_all(self) -> List[EstateReaction]:
+        data = self.storage.get_objects(self.object_prefix, recursive=True)
+        return [
+            EstateReaction(
+                estate_id=Path(d.full_name).parent.name,
+                username=Path(d.full_name).stem,
+                reaction=d.data,
+            )
+            for d in data
+        ]
+
+
+class SearchStateStorage:
+    def __init__(self, object_prefix, storage):
+        self.storage = storage
+        self.object_prefix = object_prefix
+
+    def get_all(self) -> Dict[str, SearchState]:
+        objects = self.storage.get_objects(self.object_prefix)
+        return {
+            Path(o.full_name).stem: SearchState.model_validate_json(o.data)
+            for o in objects
+        }
+
+    def save(self, name: str, state: SearchState):
+        prefix = self.object_prefix.rstrip("/")
+        object_name = f"{prefix}/{name}.json"
+        self.storage.save_sync(object_name, state.model_dump_json())
+
+
+class TombstoneStorage:
+    def __init__(self, object_prefix, storage):
+        self.storage = storage
+        self.object_prefix = object_prefix
+
+    def get_all(self) -> Dict[str, Tombstone]:
+        objects = self.storage.get_objects(self.object_prefix)
+        return {
+            Path(o.full_name).stem: Tombstone.model_validate_json(o.data)
+            for o in objects
+        }
+
+    def list_ids(self) -> List[str]:
+        return self.storage.list_ids_sync(self.object_prefix)
+
+    def save_many(self, tombstones: List[Tombstone]):
+        prefix = self.object_prefix.rstrip("/")
+        for tombstone in tombstones:
+            object_name = f"{prefix}/{tombstone.id}.json"
+            self.storage.save_sync(object_name, tombstone.model_dump_json())
+
+    def remove_many(self, estate_ids: List[str]):
+        prefix = self.object_prefix.rstrip("/")
+        for estate_id in estate_ids:
+            self.storage.remove_sync(f"{prefix}/{estate_id}.json")
+
 
 # Is using async over sync here a good idea?
 class EstatesStorage:
-    def __init__(self, object_prefix, storage):
+    def __init__(self, object_prefix, storage, codec=None):
         self.storage = storage
         self.object_prefix = object_prefix
+        # new objects are written with the codec, any stored format is read
+        self.codec = codec or get_codec(StorageSettings().codec)
 
     def list_ids_sync(self):
         return self.storage.list_ids_sync(self.object_prefix)
@@ -175,24 +361,216 @@ class EstatesStorage:
         loop = asyncio.get_event_loop()
         return await loop.run_in_executor(None, self.list_ids_sync)
 
+    async def list_modified(self) -> Dict[str, datetime]:
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            None, self.storage.list_modified_sync, self.object_prefix
+        )
+
     async def get_all(self):
-        all_estates = self.storage.get_objects(self.object_prefix)
+        with TRACER.span("storage.get_all", prefix=self.object_prefix):
+            all_estates = self.storage.get_objects(self.object_prefix, binary=True)
 
-        return [
-            EstateOverview.model_validate_json(estate.data) for estate in all_estates
-        ]
+        return [decode(estate.data, EstateOverview) for estate in all_estates]
+
+    def get_many_sync(self, estate_ids: List[str]) -> List[EstateOverview]:
+        prefix = self.object_prefix.rstrip("/")
+        estates = []
+        for estate_id in estate_ids:
+            data = self.storage.get_bytes_sync(f"{prefix}/{estate_id}.json")
+            if data is not None:
+                estates.append(decode(data, EstateOverview))
+        return estates
+
+    async def get_many(self, estate_ids: List[str]) -> List[EstateOverview]:
+        loop = asyncio.get_event_loop()
+        with TRACER.span("storage.get_many", estate_ids=estate_ids):
+            return await loop.run_in_executor(None, self.get_many_sync, estate_ids)
 
     def save_many_sync(self, estates: List[EstateOverview]):
         logger.debug("Saving %d estates", len(estates))
         prefix = self.object_prefix.rstrip("/")
         for estate in estates:
-            json_text = estate.model_dump_json()
+            body = self.codec.encode(estate)
             object_name = f"{prefix}/{estate.id}.json"
-            self.storage.save_sync(object_name, json_text)
+            self.storage.save_sync(
+                object_name, body, content_type=self.codec.content_type
+            )
 
     async def save_many(self, estates: List[EstateOverview]):
         loop = asyncio.get_event_loop()
-        await loop.run_in_executor(None, self.save_many_sync, estates)
+        estate_ids = [e.id for e in estates]
+        with TRACER.span("storage.save_many", estate_ids=estate_ids):
+            await loop.run_in_executor(None, self.save_many_sync, estates)
+
+    def remove_many_sync(self, estate_ids: List[str]):
+        prefix = self.object_prefix.rstrip("/")
+        for estate_id in estate_ids:
+            self.storage.remove_sync(f"{prefix}/{estate_id}.json")
+
+    async def remove_many(self, estate_ids: List[str]):
+        loop = asyncio.get_event_loop()
+        with TRACER.span("storage.remove_many", estate_ids=estate_ids):
+            await loop.run_in_executor(None, self.remove_many_sync, estate_ids)
+
+
+class PriceHistoryStorage:
+    """
+    Append-only log of estate prices. Every append writes one immutable
+    json lines segment named by its time, so a save batch costs a single
+    object. `compact` merges the segments of past days into one per day.
+    Queries go through an in-memory index by estate id that reads only the
+    segments it has not seen yet.
+    """
+
+    def __init__(self, object_prefix, storage):
+        self.storage = storage
+        self.object_prefix = object_prefix
+        self._index: Dict[str, List[PricePoint]] = {}
+        self._indexed_segments = set()
+
+    def append_many_sync(
+        self, estates: List[EstateOverview], timestamp: datetime | None = None
+    ):
+        if not estates:
+            return
+        timestamp = timestamp or datetime.now()
+        points = [_price_point(estate, timestamp) for estate in estates]
+        body = "".join(point.model_dump_json() + "\n" for point in points)
+        prefix = self.object_prefix.rstrip("/")
+        segment = f"{timestamp:%Y%m%d%H%M%S%f}_{uuid.uuid4().hex[:8]}"
+        self.storage.save_sync(
+            f"{prefix}/{segment}.jsonl", body, content_type="application/x-ndjson"
+        )
+
+    async def append_many(
+        self, estates: List[EstateOverview], timestamp: datetime | None = None
+    ):
+        loop = asyncio.get_event_loop()
+        with TRACER.span("storage.price_history", count=len(estates)):
+            await loop.run_in_executor(None, self.append_many_sync, estates, timestamp)
+
+    def refresh(self):
+        prefix = self.object_prefix.rstrip("/")
+        segments = sorted(
+            set(self.storage.list_ids_sync(self.object_prefix))
+            - self._indexed_segments
+        )
+        touched = set()
+        for segment in segments:
+            data = self.storage.get_sync(f"{prefix}/{segment}.jsonl")
+            if data is None:
+                continue
+            for line in data.splitlines():
+                point = PricePoint.model_validate_json(line)
+                self._index.setdefault(point.id, []).append(point)
+                touched.add(point.id)
+            self._indexed_segments.add(segment)
+        for estate_id in touched:
+            points = sorted(self._index[estate_id], key=lambda p: p.timestamp)
+            # a compacted segment repeats the points of the segments it replaced
+            self._index[estate_id] = list({p.timestamp: p for p in points}.values())
+        if segments:
+            logger.debug("Indexed %d price history segments", len(segments))
+
+    def compact_sync(self, now: datetime | None = None) -> int:
+        """
+        Merges the segments of each day before the current one into a
+        single `<day>_day` segment. Returns the number of removed segments.
+        """
+        today = f"{now or datetime.now():%Y%m%d}"
+        prefix = self.object_prefix.rstrip("/")
+        days: Dict[str, List[str]] = {}
+        for segment in self.storage.list_ids_sync(self.object_prefix):
+            if segment[:8] < today:
+                days.setdefault(segment[:8], []).append(segment)
+
+        removed = 0
+        for day, segments in sorted(days.items()):
+            compacted = f"{day}_day"
+            if segments == [compacted]:
+                continue
+            points = {}
+            for segment in segments:
+                data = self.storage.get_sync(f"{prefix}/{segment}.jsonl") or ""
+                for line in data.splitlines():
+                    point = PricePoint.model_validate_json(line)
+                    points[(point.id, point.timestamp)] = point
+            body = "".join(
+                point.model_dump_json() + "\n"
+                for point in sorted(points.values(), key=lambda p: p.timestamp)
+            )
+            # written before the sources are removed, a crash only leaves
+            # duplicates for the next compaction
+            self.storage.save_sync(
+                f"{prefix}/{compacted}.jsonl",
+                body,
+                content_type="application/x-ndjson",
+            )
+            for segment in segments:
+                if segment != compacted:
+                    self.storage.remove_sync(f"{prefix}/{segment}.jsonl")
+                    self._indexed_segments.discard(segment)
+                    removed += 1
+            self._indexed_segments.discard(compacted)
+        if removed:
+            logger.info("Compacted %d price history segments", removed)
+        return removed
+
+    async def compact(self, now: datetime | None = None) -> int:
+        loop = asyncio.get_event_loop()
+        with TRACER.span("storage.price_history.compact"):
+            return await loop.run_in_executor(None, self.compact_sync, now)
+
+    def history(self, estate_id: str) -> List[PricePoint]:
+        self.refresh()
+        return list(self._index.get(estate_id, []))
+
+    def first_seen(self) -> Dict[str, datetime]:
+        """
+        Time of the first recorded price of every estate, i.e. when it was
+        first saved.
+        """
+        self.refresh()
+        return {
+            estate_id: points[0].timestamp for estate_id, points in self._index.items()
+        }
+
+    def drops(self, days: float, now: datetime | None = None) -> List[PriceDrop]:
+        since = (now or datetime.now()) - timedelta(days=days)
+        self.refresh()
+        drops = []
+        for points in self._index.values():
+            for previous, point in zip(points, points[1:]):
+                if point.timestamp >= since and point.price < previous.price:
+                    drops.append(
+                        PriceDrop(
+                            id=point.id,
+                            timestamp=point.timestamp,
+                            previous_price=previous.price,
+                            price=point.price,
+                        )
+                    )
+        return sorted(drops, key=lambda d: d.timestamp)
+
+    def as_of(self, when: datetime) -> Dict[str, PricePoint]:
+        self.refresh()
+        state = {}
+        for estate_id, points in self._index.items():
+            i = bisect_right(points, when, key=lambda p: p.timestamp)
+            if i > 0:
+                state[estate_id] = points[i - 1]
+        return state
+
+
+def _price_point(estate: EstateOverview, timestamp: datetime) -> PricePoint:
+    commute = estate.features.get("pid_commute_time")
+    return PricePoint(
+        id=estate.id,
+        timestamp=timestamp,
+        price=estate.price,
+        commute_minutes=getattr(commute, "time_minutes", None),
+    )
 
 
 def get_timestamp():
@@ -0,0 +1,229 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import AsyncIterator, Dict, List
+
+import redis.asyncio as redis
+from redis.exceptions import ResponseError
+
+from baraky import feature_cache, metrics
+from baraky.estate_features import CALCULATOR_DELAYS, RouteCache
+from baraky.filters import order_calculators
+from baraky.models import EstateOverview, PIDResponse
+from baraky.profiling import TRACER
+from baraky.settings import RedisSettings
+
+logger = logging.getLogger("baraky.workers")
+
+
+def connect(settings: RedisSettings) -> redis.Redis:
+    return redis.from_url(settings.url, decode_responses=True)
+
+
+async def ensure_group(client: redis.Redis, settings: RedisSettings):
+    try:
+        await client.xgroup_create(
+            settings.stream, settings.group, id="0", mkstream=True
+        )
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+def default_consumer_name():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class RemoteEnhancer:
+    """
+    Watcher side of the Redis mode. Publishes estates to the shared stream
+    and yields them back enhanced from a reply stream of its own. The
+    `feature_calculators` the workers run are only used for the feature
+    keys, so the watcher can carry their features over to a price change.
+    """
+
+    def __init__(
+        self,
+        client: redis.Redis,
+        settings: RedisSettings | None = None,
+        feature_calculators: Dict | None = None,
+    ):
+        self.client = client
+        self.settings = settings or RedisSettings()
+        self.feature_calculators = feature_calculators or {}
+
+    async def enhance_many(
+        self, estates: List[EstateOverview]
+    ) -> AsyncIterator[EstateOverview]:
+        if not estates:
+            return
+        await ensure_group(self.client, self.settings)
+        reply_to = f"{self.settings.reply_prefix}{uuid.uuid4().hex}"
+        for estate in estates:
+            await self.client.xadd(
+                self.settings.stream,
+                {"estate": estate.model_dump_json(), "reply_to": reply_to},
+            )
+        logger.debug("Published %d estates to %s", len(estates), self.settings.stream)
+
+        pending = {estate.id for estate in estates}
+        last_id = "0"
+        last_reply = time.monotonic()
+        try:
+            while pending:
+                response = await self.client.xread(
+                    {reply_to: last_id}, block=self.settings.block_ms
+                )
+                if not response:
+                    if time.monotonic() - last_reply > self.settings.reply_timeout_sec:
+                        raise TimeoutError(
+                            f"No enhanced estates for {len(pending)} published ones"
+                        )
+                    continue
+                last_reply = time.monotonic()
+                for entry_id, fields in response[0][1]:
+                    last_id = entry_id
+                    estate = EstateOverview.model_validate_json(fields["estate"])
+                    # a reclaimed entry may come back twice
+                    if estate.id in pending:
+                        pending.discard(estate.id)
+                        yield estate
+        finally:
+            await self.client.delete(reply_to)
+
+
+class EnhanceWorker:
+    """
+    Consumes estates from the stream through the consumer group, runs the
+    feature calculators and replies with the enhanced estate. Entries are
+    acknowledged and deleted only after the reply, entries left pending by
+    a dead worker are claimed after `claim_idle_ms`.
+    """
+
+    def __init__(
+        self,
+        client: redis.Redis,
+        feature_calculators: Dict,
+        settings: RedisSettings | None = None,
+        consumer_name: str | None = None,
+        calculator_delays: Dict[str, float] | None = None,
+    ):
+        self.client = client
+        self.feature_calculators = feature_calculators
+        self.settings = settings or RedisSettings()
+        self.consumer_name = consumer_name or default_consumer_name()
+        if calculator_delays is None:
+            calculator_delays = CALCULATOR_DELAYS
+        self.calculator_delays = calculator_delays
+
+    async def run(self, max_entries: int | None = None):
+        await ensure_group(self.client, self.settings)
+        logger.info("Worker %s consuming %s", self.consumer_name, self.settings.stream)
+        processed = 0
+        while max_entries is None or processed < max_entries:
+            entries = await self._claim_stale()
+            if not entries:
+                entries = await self._read_new()
+            for entry_id, fields in entries:
+                if fields:
+                    await self._process(entry_id, fields)
+                else:
+                    # deleted from the stream before it was claimed
+                    await self._ack(entry_id)
+                processed += 1
+        return processed
+
+    async def _claim_stale(self):
+        _, entries, *_ = await self.client.xautoclaim(
+            self.settings.stream,
+            self.settings.group,
+            self.consumer_name,
+            min_idle_time=self.settings.claim_idle_ms,
+            count=self.settings.batch_size,
+        )
+        if entries:
+            logger.info("Claimed %d stale entries", len(entries))
+        return entries
+
+    async def _read_new(self):
+        response = await self.client.xreadgroup(
+            self.settings.group,
+            self.consumer_name,
+            {self.settings.stream: ">"},
+            count=self.settings.batch_size,
+            block=self.settings.block_ms,
+        )
+        if not response:
+            return []
+        return response[0][1]
+
+    async def _process(self, entry_id, fields):
+        estate = EstateOverview.model_validate_json(fields["estate"])
+        try:
+            await self.enhance_estate(estate)
+        except Exception:
+            # replying without the features beats redelivering it forever
+            logger.exception("Failed to enhance estate %s", estate.id)
+        await self.client.xadd(fields["reply_to"], {"estate": estate.model_dump_json()})
+        await self._ack(entry_id)
+        metrics.ESTATES_PROCESSED.inc(stage="worker_enhanced")
+
+    async def _ack(self, entry_id):
+        # the stream has a single group, nobody reads an acknowledged entry
+        await self.client.xack(self.settings.stream, self.settings.group, entry_id)
+        await self.client.xdel(self.settings.stream, entry_id)
+
+    async def enhance_estate(self, estate: EstateOverview):
+        for name in order_calculators(self.feature_calculators):
+            calculator = self.feature_calculators[name]
+            if feature_cache.is_cached(name, calculator, estate):
+                continue
+            # the workers share the politeness of a single watcher worker
+            if name in self.calculator_delays:
+                await asyncio.sleep(self.calculator_delays[name])
+            with (
+                metrics.FEATURE_SECONDS.time(feature=name),
+                TRACER.span("feature", feature=name, estate_id=estate.id),
+            ):
+                feature_data = await calculator.calculate(estate)
+            if feature_data is None:
+                continue
+            estate.features[name] = feature_data
+            feature_cache.remember(name, calculator, estate)
+
+
+class RedisRouteCache(RouteCache):
+    """
+    PID routes shared by all workers through Redis. Lookups of the same
+    route within one process still share a single request.
+    """
+
+    def __init__(self, client: redis.Redis, settings: RedisSettings | None = None):
+        super().__init__()
+        self.client = client
+        self.settings = settings or RedisSettings()
+
+    async def get_or_fetch(self, stop_from, stop_to, fetch):
+        async def fetch_shared(stop_from, stop_to):
+            key = self._key(stop_from, stop_to)
+            cached = await self.client.get(key)
+            if cached is not None:
+                metrics.CACHE_REQUESTS.inc(cache="redis_route", result="hit")
+                return PIDResponse.model_validate_json(cached)
+            metrics.CACHE_REQUESTS.inc(cache="redis_route", result="miss")
+            route = await fetch(stop_from, stop_to)
+            if route is not None:
+                await self.client.set(
+                    key, route.model_dump_json(), ex=self.settings.route_ttl_sec
+                )
+            return route
+
+        return await super().get_or_fetch(stop_from, stop_to, fetch_shared)
+
+    def _key(self, stop_from, stop_to):
+        return self.settings.route_prefix + json.dumps([stop_from, stop_to])
+
@@ -1,17 +1,11 @@
+# Commands import their own dependencies, so that e.g. `sync` does not
+# pay for telegram and `notifier` does not pay for scipy.
 import asyncio
-from baraky.notifications import TelegramNotificationsBot
-from baraky.estate_features import PIDCommuteFeatureEnhancer
 import logging
-from baraky.storages import (
-    EstatesStorage,
-    MinioStorage,
-    EstatesHitQueue,
-    ReactionsStorage,
-)
-from baraky.estate_watcher import EstateWatcher
-from baraky.models import EstateOverview, PIDCommuteFeature
-from baraky.client import SrealityEstatesClient
 import argparse
+from pathlib import Path
+from baraky.filters import FilterChain, Predicate
+from baraky.models import EstateOverview, PIDCommuteFeature
 import baraky.io as io
 
 logging.basicConfig(
@@ -39,41 +33,391 @@ def setup_args():
     parser_watcher.add_argument(
         "--query-path",
         type=str,
-        help="Path to query json file",
+        nargs="+",
+        help="Paths to query json files or directories containing them",
         required=True,
     )
+    parser_watcher.add_argument(
+        "--force-refresh-sec",
+        type=int,
+        help="Read all pages at least this often even if a query looks unchanged",
+        default=6 * 3600,
+    )
+    parser_watcher.add_argument(
+        "--journal-path",
+        type=str,
+        help="Journal of the running cycle used to resume it after a crash",
+        default=".baraky/cycle_journal.jsonl",
+    )
+    parser_watcher.add_argument(
+        "--metrics-port",
+        type=int,
+        help="Serve /metrics and /healthz on this local port",
+        default=None,
+    )
+    parser_watcher.add_argument(
+        "--max-cycle-age-sec",
+        type=int,
+        help="/healthz fails when the last successful cycle is older than this",
+        default=2 * 3600,
+    )
+    parser_watcher.add_argument(
+        "--profile",
+        type=str,
+        help="Profile update cycles into this file (speedscope json or cProfile stats)",
+        default=None,
+    )
+    parser_watcher.add_argument(
+        "--trace-out",
+        type=str,
+        help="Write json lines spans of fetches, lookups and storage calls here",
+        default=None,
+    )
+    parser_watcher.add_argument(
+        "--redis-url",
+        type=str,
+        help="Calculate features on `worker` processes connected to this Redis",
+        default=None,
+    )
+    parser_watcher.add_argument(
+        "--cpu-workers",
+        type=int,
+        help="Parse pages and query the spatial index in this many processes",
+        default=0,
+    )
     parser_watcher.set_defaults(func=watcher_command)
 
     parser_sync = subparsers.add_parser("sync", help="Watch for new estates ONCE")
     parser_sync.add_argument(
         "--query-path",
         type=str,
-        help="Path to query json file",
+        nargs="+",
+        help="Paths to query json files or directories containing them",
         required=True,
     )
+    parser_sync.add_argument(
+        "--force-refresh-sec",
+        type=int,
+        help="Read all pages at least this often even if a query looks unchanged",
+        default=6 * 3600,
+    )
+    parser_sync.add_argument(
+        "--journal-path",
+        type=str,
+        help="Journal of the running cycle used to resume it after a crash",
+        default=".baraky/cycle_journal.jsonl",
+    )
+    parser_sync.add_argument(
+        "--profile",
+        type=str,
+        help="Profile update cycles into this file (speedscope json or cProfile stats)",
+        default=None,
+    )
+    parser_sync.add_argument(
+        "--trace-out",
+        type=str,
+        help="Write json lines spans of fetches, lookups and storage calls here",
+        default=None,
+    )
+    parser_sync.add_argument(
+        "--redis-url",
+        type=str,
+        help="Calculate features on `worker` processes connected to this Redis",
+        default=None,
+    )
+    parser_sync.add_argument(
+        "--cpu-workers",
+        type=int,
+        help="Parse pages and query the spatial index in this many processes",
+        default=0,
+    )
     parser_sync.set_defaults(func=sync_command)
 
+    parser_reenhance = subparsers.add_parser(
+        "reenhance", help="Recompute features of all stored estates"
+    )
+    parser_reenhance.add_argument(
+        "--features",
+        type=str,
+        nargs="+",
+        help="Feature calculators to run, all by default",
+        default=None,
+    )
+    parser_reenhance.add_argument(
+        "--concurrency",
+        type=int,
+        help="Maximum of feature calculations running at once",
+        default=4,
+    )
+    parser_reenhance.add_argument(
+        "--batch-size",
+        type=int,
+        help="Number of estates loaded and saved at once",
+        default=100,
+    )
+    parser_reenhance.add_argument(
+        "--checkpoint-path",
+        type=str,
+        help="Ids of already processed estates, used to resume the run",
+        default=".baraky/reenhance_checkpoint.txt",
+    )
+    parser_reenhance.set_defaults(func=reenhance_command)
+
+    parser_export = subparsers.add_parser(
+        "export", help="Export stored estates to a columnar file"
+    )
+    parser_export.add_argument(
+        "--output",
+        type=str,
+        help="Path of the exported file",
+        required=True,
+    )
+    parser_export.add_argument(
+        "--format",
+        type=str,
+        choices=["auto", "parquet", "arrow", "npz"],
+        help="Parquet when pyarrow is installed and format is auto, npz otherwise",
+        default="auto",
+    )
+    parser_export.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Export only estates changed since the last export",
+    )
+    parser_export.add_argument(
+        "--state-path",
+        type=str,
+        help="Time of the last export, used by --incremental",
+        default=".baraky/export_state.json",
+    )
+    parser_export.set_defaults(func=export_command)
+
+    parser_serve = subparsers.add_parser(
+        "serve", help="Serve stored estates from memory over a JSON API"
+    )
+    parser_serve.add_argument(
+        "--host",
+        type=str,
+        help="Interface to listen on",
+        default="127.0.0.1",
+    )
+    parser_serve.add_argument(
+        "--port",
+        type=int,
+        help="Port to listen on",
+        default=8080,
+    )
+    parser_serve.add_argument(
+        "--refresh-sec",
+        type=float,
+        help="Load estates saved by the watcher and new reactions this often",
+        default=60,
+    )
+    parser_serve.set_defaults(func=serve_command)
+
+    parser_worker = subparsers.add_parser(
+        "worker", help="Calculate features of estates published by watchers"
+    )
+    parser_worker.add_argument(
+        "--redis-url",
+        type=str,
+        help="Redis the watchers publish to, REDIS_URL by default",
+        default=None,
+    )
+    parser_worker.add_argument(
+        "--consumer-name",
+        type=str,
+        help="Unique name of this worker in the consumer group, host-pid by default",
+        default=None,
+    )
+    parser_worker.set_defaults(func=worker_command)
+
+    parser_convert = subparsers.add_parser(
+        "convert", help="Rewrite stored estates and hits with another codec"
+    )
+    parser_convert.add_argument(
+        "--codec",
+        type=str,
+        choices=["json", "msgpack"],
+        help="Codec to rewrite the objects with, set STORAGE_CODEC to keep it",
+        required=True,
+    )
+    parser_convert.add_argument(
+        "--queue-prefix",
+        type=str,
+        nargs="*",
+        help="Hit queues to convert as well",
+        default=["filtered/"],
+    )
+    parser_convert.set_defaults(func=convert_command)
+
     parser_notifier = subparsers.add_parser("notifier", help="Notify about new estates")
+    parser_notifier.add_argument(
+        "--queue-prefix",
+        type=str,
+        help="Hit queue to notify from, e.g. filtered/<query name>/",
+        default="filtered/",
+    )
     parser_notifier.set_defaults(func=notifier_command)
 
     return parser.parse_args()
 
 
 def watcher_command(args):
-    watcher = setup_watcher(args)
-    asyncio.run(watcher.watch())
+    from baraky.offload import CpuPool
+    from baraky.profiling import traced
+
+    cpu_pool = CpuPool(args.cpu_workers)
+    watcher = setup_watcher(args, cpu_pool)
+    try:
+        asyncio.run(traced(run_watcher(watcher, args), args.trace_out))
+    finally:
+        cpu_pool.close()
+
+
+async def run_watcher(watcher, args):
+    if args.metrics_port is None:
+        await watcher.watch()
+        return
+
+    from baraky.metrics import MetricsServer
+
+    metrics_server = MetricsServer(
+        port=args.metrics_port,
+        max_cycle_age_sec=args.max_cycle_age_sec,
+    )
+    await metrics_server.start()
+    try:
+        await watcher.watch()
+    finally:
+        await metrics_server.stop()
 
 
 def sync_command(args):
-    watcher = setup_watcher(args)
-    asyncio.run(watcher.update())
+    from baraky.offload import CpuPool
+    from baraky.profiling import traced
+
+    cpu_pool = CpuPool(args.cpu_workers)
+    watcher = setup_watcher(args, cpu_pool)
+    try:
+        asyncio.run(traced(watcher.update(), args.trace_out))
+    finally:
+        cpu_pool.close()
+
+
+def reenhance_command(args):
+    from baraky.estate_features import RouteCache
+    from baraky.reenhance import Reenhancer
+    from baraky.storages import EstatesStorage, MinioStorage, TombstoneStorage
+
+    feature_calculators = setup_feature_calculators(route_cache=RouteCache())
+    if args.features is not None:
+        unknown = set(args.features) - feature_calculators.keys()
+        if unknown:
+            raise ValueError(f"Unknown features: {', '.join(sorted(unknown))}")
+        feature_calculators = {
+            name: feature_calculators[name] for name in args.features
+        }
+
+    estates_minio_storage = MinioStorage("estates")
+    storage = EstatesStorage("estate/house/", estates_minio_storage)
+    reenhancer = Reenhancer(
+        storage,
+        feature_calculators,
+        checkpoint_path=args.checkpoint_path,
+        concurrency=args.concurrency,
+        batch_size=args.batch_size,
+        tombstone_storage=TombstoneStorage("estate/tombstone/", estates_minio_storage),
+    )
+    asyncio.run(reenhancer.run())
+
+
+def export_command(args):
+    from baraky.export import EstatesExporter
+    from baraky.storages import EstatesStorage, MinioStorage
+
+    storage = EstatesStorage("estate/house/", MinioStorage("estates"))
+    exporter = EstatesExporter(storage, state_path=args.state_path)
+    exported = asyncio.run(
+        exporter.export(args.output, format=args.format, incremental=args.incremental)
+    )
+    logger.info("Exported %d estates to %s", exported, args.output)
+
+
+def serve_command(args):
+    asyncio.run(run_server(args))
+
+
+async def run_server(args):
+    from baraky.api import ApiServer, EstateIndex
+    from baraky.storages import EstatesStorage, MinioStorage, ReactionsStorage
+
+    storage = EstatesStorage("estate/house/", MinioStorage("estates"))
+    reactions_storage = ReactionsStorage("estate/", MinioStorage("reactions"))
+    server = ApiServer(
+        EstateIndex(storage),
+        reactions_storage,
+        host=args.host,
+        port=args.port,
+        refresh_sec=args.refresh_sec,
+    )
+    await server.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+def worker_command(args):
+    asyncio.run(run_worker(args))
+
+
+async def run_worker(args):
+    from baraky.http_cache import HttpCache
+    from baraky.workers import EnhanceWorker, RedisRouteCache, connect
+
+    settings = _redis_settings(args.redis_url)
+    client = connect(settings)
+    try:
+        feature_calculators = setup_feature_calculators(
+            route_cache=RedisRouteCache(client, settings), http_cache=HttpCache()
+        )
+        worker = EnhanceWorker(
+            client, feature_calculators, settings, consumer_name=args.consumer_name
+        )
+        await worker.run()
+    finally:
+        await client.aclose()
+
+
+def _redis_settings(redis_url):
+    from baraky.settings import RedisSettings
+
+    if redis_url is None:
+        return RedisSettings()
+    return RedisSettings(url=redis_url)
+
+
+def convert_command(args):
+    from baraky.models import EstateOverview, EstateQueueMessage
+    from baraky.serialization import convert_objects, get_codec
+    from baraky.storages import MinioStorage
+
+    codec = get_codec(args.codec)
+    convert_objects(MinioStorage("estates"), "estate/house/", EstateOverview, codec)
+    hits_minio_storage = MinioStorage("hitqueue")
+    for queue_prefix in args.queue_prefix:
+        convert_objects(hits_minio_storage, queue_prefix, EstateQueueMessage, codec)
 
 
 def notifier_command(args):
+    from baraky.notifications import TelegramNotificationsBot
+    from baraky.storages import EstatesHitQueue, MinioStorage, ReactionsStorage
+
     reactions_minio_storage = MinioStorage("reactions")
     reactions_storage = ReactionsStorage("estate/", reactions_minio_storage)
     hits_minio_storage = MinioStorage("hitqueue")
-    queue = EstatesHitQueue("filtered/", hits_minio_storage)
+    queue = EstatesHitQueue(args.queue_prefix, hits_minio_storage)
     bot = TelegramNotificationsBot(
         queue,
         reactions_storage,
@@ -81,40 +425,142 @@ def notifier_command(args):
     bot.start()
 
 
-def _filter_close_to_prague(
-    estate_overview: EstateOverview, commute_time: PIDCommuteFeature
-) -> bool:
+def _is_affordable(estate_overview: EstateOverview) -> bool:
+    return estate_overview.price <= 8_000_000
+
+
+def _is_near_stop(estate_overview: EstateOverview) -> bool:
+    # the walk to a farther stop is not part of the commute time
+    return estate_overview.features["nearest_stop"].distance_km <= 5.0
+
+
+def _is_close_to_prague(estate_overview: EstateOverview) -> bool:
+    commute_time: PIDCommuteFeature = estate_overview.features["pid_commute_time"]
     if commute_time.time_minutes is None or commute_time.transfers_count is None:
         return False
     is_close = commute_time.time_minutes <= 75
     max_1_transfer = commute_time.transfers_count <= 4
-    return max_1_transfer and is_close and estate_overview.price <= 8_000_000
+    return max_1_transfer and is_close
 
 
-def filter_fn(estate_overview: EstateOverview) -> bool:
-    commute_time = estate_overview.features.get("pid_commute_time")
-    if commute_time is None:
-        return False
-    return _filter_close_to_prague(estate_overview, commute_time)
+# the price and the stop distance are checked before the commute time is
+# looked up at pid.cz
+filter_fn = FilterChain(
+    [
+        Predicate(_is_affordable),
+        Predicate(_is_near_stop, requires=["nearest_stop"], cost=0.01),
+        Predicate(_is_close_to_prague, requires=["pid_commute_time"], cost=10.0),
+    ]
+)
+
+
+def read_queries(query_paths):
+    queries = {}
+    for query_path in query_paths:
+        path = Path(query_path)
+        files = sorted(io.glob_files(path, "*.json")) if path.is_dir() else [path]
+        for file in files:
+            queries[file.stem] = io.read_json_sync(file)
+    return queries
 
 
-def setup_watcher(args):
-    query_params = io.read_json_sync(args.query_path)
-    client = SrealityEstatesClient(query_params)
+def setup_feature_calculators(route_cache=None, http_cache=None):
+    from baraky.estate_features import (
+        NearestStopEnhancer,
+        PIDClient,
+        PIDCommuteFeatureEnhancer,
+        load_stops,
+    )
+    from baraky.settings import PIDCommuteFeatureEnhancerSettings
+
+    stops = load_stops(PIDCommuteFeatureEnhancerSettings.stops_path)
+    pid_client = PIDClient(route_cache=route_cache, http_cache=http_cache)
+    return {
+        "nearest_stop": NearestStopEnhancer(stops),
+        "pid_commute_time": PIDCommuteFeatureEnhancer(stops, pid_client=pid_client),
+    }
+
+
+def setup_watcher(args, cpu_pool):
+    from baraky.client import SrealityEstatesClient
+    from baraky.details import EstateDetailEnhancer
+    from baraky.estate_features import NearestStopEnhancer
+    from baraky.estate_watcher import EstateWatcher, WatchedSearch
+    from baraky.http_cache import HttpCache
+    from baraky.journal import CycleJournal
+    from baraky.profiling import CycleProfiler
+    from baraky.spatial import EstateSpatialIndex, NeighbourhoodPriceEnhancer
+    from baraky.storages import (
+        EstatesHitQueue,
+        EstatesStorage,
+        MinioStorage,
+        PriceHistoryStorage,
+        SearchStateStorage,
+        TombstoneStorage,
+    )
+
+    queries = read_queries(args.query_path)
     estates_minio_storage = MinioStorage("estates")
     storage = EstatesStorage("estate/house/", estates_minio_storage)
+    state_storage = SearchStateStorage("search_state/", estates_minio_storage)
+    price_history = PriceHistoryStorage("price_history/", estates_minio_storage)
+    tombstones = TombstoneStorage("estate/tombstone/", estates_minio_storage)
     hits_minio_storage = MinioStorage("hitqueue")
-    queue = EstatesHitQueue("filtered/", hits_minio_storage)
+    http_cache = HttpCache()
 
-    feature_calculators = {
-        "pid_commute_time": PIDCommuteFeatureEnhancer(),
-    }
+    searches = []
+    for name, query_params in queries.items():
+        # a single search keeps the original queue so the notifier works as before
+        queue_prefix = "filtered/" if len(queries) == 1 else f"filtered/{name}/"
+        searches.append(
+            WatchedSearch(
+                name=name,
+                client=SrealityEstatesClient(
+                    query_params, cpu_pool=cpu_pool, http_cache=http_cache
+                ),
+                output_queue=EstatesHitQueue(queue_prefix, hits_minio_storage),
+                filter_fn=filter_fn,
+            )
+        )
+
+    spatial_index = EstateSpatialIndex()
+    remote_enhancer = None
+    if args.redis_url is None:
+        feature_calculators = setup_feature_calculators(http_cache=http_cache)
+    else:
+        from baraky.workers import RemoteEnhancer, connect
+
+        # per-estate features are left to the workers
+        redis_settings = _redis_settings(args.redis_url)
+        remote_enhancer = RemoteEnhancer(
+            connect(redis_settings),
+            redis_settings,
+            # the same calculators as the workers, for the feature keys
+            feature_calculators=setup_feature_calculators(),
+        )
+        # a batch calculator, so it runs here and the stop filter applies
+        # before the estates are published
+        feature_calculators = {"nearest_stop": NearestStopEnhancer()}
+    feature_calculators["neighbourhood_price"] = NeighbourhoodPriceEnhancer(
+        spatial_index, cpu_pool=cpu_pool
+    )
+    feature_calculators["detail"] = EstateDetailEnhancer(
+        SrealityEstatesClient({}, http_cache=http_cache)
+    )
     return EstateWatcher(
-        client=client,
+        client=None,
         storage=storage,
-        output_queue=queue,
+        output_queue=None,
         feature_calculators=feature_calculators,
-        filter_fn=filter_fn,
+        searches=searches,
+        state_storage=state_storage,
+        force_refresh_sec=args.force_refresh_sec,
+        journal=CycleJournal(args.journal_path),
+        profiler=CycleProfiler(args.profile) if args.profile else None,
+        price_history=price_history,
+        tombstone_storage=tombstones,
+        spatial_index=spatial_index,
+        remote_enhancer=remote_enhancer,
     )
 
 
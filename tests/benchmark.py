@@ -0,0 +1,230 @@
+"""
+Benchmarks of the client, watcher and storage hot paths. Sreality and PID
+are replaced by the dummy server, storage by the local filesystem.
+
+    python -m tests.benchmark --sizes 1000 10000 --output bench.json
+
+Results are printed (or written) as JSON so they can be compared across
+commits.
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from aiohttp.test_utils import TestServer
+
+from baraky.client import SrealityEstatesClient
+from baraky.estate_features import PIDClient, PIDCommuteFeatureEnhancer
+from baraky.estate_watcher import EstateWatcher
+from baraky.models import EstateOverview, EstateQueueMessage
+from baraky.serialization import JsonCodec, MsgpackCodec, decode
+from baraky.settings import PIDClientSettings
+from baraky.storages import EstatesHitQueue, EstatesStorage, FileSystemStorage
+from .dummy_server import create_dummy_server, make_estate_records
+from .models import make_commute
+
+BENCHMARKS = {}
+
+
+def benchmark(fn):
+    BENCHMARKS[fn.__name__] = fn
+    return fn
+
+
+async def start_server(app):
+    server = TestServer(app)
+    await server.start_server()
+    return server
+
+
+class Timer:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.perf_counter() - self.start
+
+
+@benchmark
+async def client_read_all(server, size, tmp_path):
+    client = SrealityEstatesClient({}, base_url=str(server.make_url("/")))
+    with Timer() as timer:
+        estates = await client.read_all()
+    assert len(estates) == size, f"Expected {size} estates, got {len(estates)}"
+    return timer.seconds, size
+
+
+@benchmark
+async def watcher_update(server, size, tmp_path):
+    fs_storage = FileSystemStorage(tmp_path)
+    stops = {f"stop_{i}": (14.0 + i / 10, 50.0) for i in range(100)}
+    pid_settings = PIDClientSettings(url_base=str(server.make_url("/pid")))
+    watcher = EstateWatcher(
+        client=SrealityEstatesClient({}, base_url=str(server.make_url("/"))),
+        storage=EstatesStorage("estate/house/", fs_storage),
+        output_queue=EstatesHitQueue("filtered/", fs_storage),
+        feature_calculators={
+            "pid_commute_time": PIDCommuteFeatureEnhancer(
+                stops_data=stops, pid_client=PIDClient(pid_settings)
+            ),
+        },
+        filter_fn=lambda e: e.features["pid_commute_time"].time_minutes is not None,
+        progress=False,
+        calculator_delays={},
+    )
+    with Timer() as timer:
+        changes = await watcher.update()
+    assert changes["default"] == size
+    return timer.seconds, size
+
+
+@benchmark
+async def storage_save_many(server, size, tmp_path):
+    storage = EstatesStorage("estate/house/", FileSystemStorage(tmp_path))
+    estates = SrealityEstatesClient({})._map_to_model(make_estate_records(size))
+    with Timer() as timer:
+        await storage.save_many(estates)
+    return timer.seconds, size
+
+
+@benchmark
+async def storage_get_all(server, size, tmp_path):
+    storage = EstatesStorage("estate/house/", FileSystemStorage(tmp_path))
+    estates = SrealityEstatesClient({})._map_to_model(make_estate_records(size))
+    await storage.save_many(estates)
+    with Timer() as timer:
+        loaded = await storage.get_all()
+    assert len(loaded) == size
+    return timer.seconds, size
+
+
+async def _decode(codec, size):
+    estates = SrealityEstatesClient({})._map_to_model(make_estate_records(size))
+    for estate in estates:
+        estate.features["pid_commute_time"] = make_commute()
+    payloads = [codec.encode(estate) for estate in estates]
+    with Timer() as timer:
+        decoded = [decode(payload, EstateOverview) for payload in payloads]
+    assert decoded == estates
+    return timer.seconds, size
+
+
+@benchmark
+async def decode_json(server, size, tmp_path):
+    return await _decode(JsonCodec(), size)
+
+
+@benchmark
+async def decode_msgpack(server, size, tmp_path):
+    return await _decode(MsgpackCodec(), size)
+
+
+@benchmark
+async def hit_queue_put(server, size, tmp_path):
+    queue = EstatesHitQueue("filtered/", FileSystemStorage(tmp_path))
+    messages = _queue_messages(size)
+    with Timer() as timer:
+        for message in messages:
+            queue.put(message)
+    return timer.seconds, size
+
+
+@benchmark
+async def hit_queue_drain(server, size, tmp_path):
+    # every peek lists the whole queue, drain only a part of big queues
+    queue = EstatesHitQueue("filtered/", FileSystemStorage(tmp_path))
+    for message in _queue_messages(size):
+        queue.put(message)
+    drained = min(size, 100)
+    with Timer() as timer:
+        for _ in range(drained):
+            estate_id, _ = queue.peek()
+            queue.delete(estate_id)
+    return timer.seconds, drained
+
+
+def _queue_messages(size):
+    return [
+        EstateQueueMessage(
+            link=f"https://www.example.com/{i}",
+            price=i,
+            id=str(i),
+            pid_commute_time_min=30,
+            transfers_count=1,
+            station_nearby="",
+        )
+        for i in range(size)
+    ]
+
+
+async def run(names, sizes):
+    server = await create_dummy_server(start_server)
+    results = []
+    try:
+        for size in sizes:
+            server.app["data"]["estates"] = make_estate_records(size)
+            for name in names:
+                with tempfile.TemporaryDirectory() as tmp_dir:
+                    seconds, items = await BENCHMARKS[name](
+                        server, size, Path(tmp_dir)
+                    )
+                results.append(
+                    {
+                        "name": name,
+                        "size": size,
+                        "items": items,
+                        "seconds": round(seconds, 6),
+                        "items_per_sec": round(items / seconds, 2) if seconds else None,
+                    }
+                )
+                # stdout is reserved for the report
+                print(f"{name} size={size}: {seconds:.3f} s", file=sys.stderr)
+    finally:
+        await server.close()
+    return results
+
+
+def git_commit():
+    try:
+        cmd = ["git", "rev-parse", "--short", "HEAD"]
+        return subprocess.check_output(cmd, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Baraky benchmarks")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument(
+        "--only",
+        nargs="+",
+        choices=sorted(BENCHMARKS),
+        default=list(BENCHMARKS),
+    )
+    parser.add_argument("--output", type=str, help="Write the results json here")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args.only, args.sizes))
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "timestamp": time.time(),
+        "results": results,
+    }
+    report_json = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(report_json)
+    else:
+        print(report_json)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,7 @@ import pytest
 from .dummy_server import create_dummy_server
 from baraky.client import SrealityEstatesClient
 from baraky.estate_watcher import EstateWatcher
+from baraky.scheduler import PollingScheduler
 from . import models
 from baraky.storages import FileSystemStorage
 
@@ -16,8 +17,15 @@ def _fix_fs_storage(tmp_path):
 
 @pytest.fixture(name="watcher")
 def _fix_watcher(mock_queue, mock_storage, mock_client):
-    watcher = EstateWatcher(mock_client, mock_storage, mock_queue)
-    watcher.timer = models.DeterministicCycleTimer()
+    watcher = EstateWatcher(
+        mock_client,
+        mock_storage,
+        mock_queue,
+        feature_calculators={"pid_commute_time": models.MockFeatureCalculator()},
+        progress=False,
+    )
+    clock = models.FakeClock()
+    watcher.scheduler = PollingScheduler(clock=clock.time, sleep=clock.sleep)
     return watcher
 
 
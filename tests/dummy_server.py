@@ -1,22 +1,170 @@
+"""
+Local stand-in for the Sreality and PID endpoints. Every route can be
+slowed down, made to fail or rate limited through `RouteBehaviour`, so the
+client and the watcher can be load tested offline.
+
+    python -m tests.dummy_server --estates 10000 --latency-ms 80 --error-rate 0.01
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import time
+from collections import deque
+from typing import Dict
+
 from aiohttp import web
 from aiohttp.web_response import Response, json_response
+from pydantic import BaseModel
 
 
-async def create_dummy_server(create_server):
-    app = web.Application()
+class RouteBehaviour(BaseModel):
+    # latency is log-normally distributed around the median
+    latency_ms: float = 0.0
+    latency_sigma: float = 0.0
+    error_rate: float = 0.0
+    too_many_requests_rate: float = 0.0
+    rate_limit_per_sec: int | None = None
+
+
+def create_app(
+    simulation: Dict[str, RouteBehaviour] | None = None,
+    estates=None,
+    seed=None,
+    result_window=None,
+):
+    app = web.Application(middlewares=[simulate])
     app.add_routes(
         [
             web.route("*", "/200/", return_200),
-            web.get("/estates", estates_overview),
-            web.get("/estates/{estate_id}", estates_detail),
+            web.get("/estates", estates_overview, name="estates"),
+            web.get("/estates/{estate_id}", estates_detail, name="estate_detail"),
+            web.get("/pid", pid_search, name="pid"),
         ]
     )
-    server = await create_server(app)
     app.update(
-        server_name=f"http://localhost:{server.port}",
-        data={"estates": []},
+        data={"estates": estates or []},
+        simulation=simulation or {},
+        stats={},
+        rng=random.Random(seed),
+        rate_windows={},
+        # like Sreality, estates past this many are never returned
+        result_window=result_window,
     )
-    return server
+    return app
+
+
+async def create_dummy_server(create_server, **kwargs):
+    app = create_app(**kwargs)
+    return await create_server(app)
+
+
+@web.middleware
+async def simulate(request, handler):
+    app = request.app
+    route_name = request.match_info.route.name
+    behaviour = app["simulation"].get(route_name)
+    stats = app["stats"].setdefault(route_name, {})
+    if behaviour is None:
+        return await _counted(stats, await handler(request))
+
+    rng = app["rng"]
+    if behaviour.latency_ms > 0:
+        latency_ms = behaviour.latency_ms * rng.lognormvariate(0, behaviour.latency_sigma)
+        await asyncio.sleep(latency_ms / 1000)
+
+    if _is_rate_limited(app["rate_windows"], route_name, behaviour):
+        return await _counted(stats, _too_many_requests())
+    if rng.random() < behaviour.too_many_requests_rate:
+        return await _counted(stats, _too_many_requests())
+    if rng.random() < behaviour.error_rate:
+        return await _counted(stats, Response(status=503, text="Simulated failure"))
+    return await _counted(stats, await handler(request))
+
+
+async def _counted(stats, response):
+    stats[response.status] = stats.get(response.status, 0) + 1
+    return response
+
+
+def _too_many_requests():
+    return Response(status=429, headers={"Retry-After": "1"})
+
+
+def _is_rate_limited(windows, route_name, behaviour: RouteBehaviour) -> bool:
+    if behaviour.rate_limit_per_sec is None:
+        return False
+    window = windows.setdefault(route_name, deque())
+    now = time.monotonic()
+    while window and now - window[0] >= 1:
+        window.popleft()
+    if len(window) >= behaviour.rate_limit_per_sec:
+        return True
+    window.append(now)
+    return False
+
+
+def make_estate_records(count, price_step=1000000):
+    return [
+        {
+            "_links": {
+                "self": {"href": f"/estate/{i}"},
+            },
+            "seo": {"locality": f"locality_{i}"},
+            "price_czk": {"value_raw": i * price_step},
+            # spread over central Bohemia
+            "gps": {
+                "lat": 49.5 + (i * 37 % 1000) / 1000,
+                "lon": 13.5 + (i * 91 % 3000) / 1000,
+            },
+        }
+        for i in range(count)
+    ]
+
+
+def make_pid_routes(stop_from, stop_to, count=3):
+    # the same pair of stops always gets the same answer
+    rng = random.Random(f"{stop_from}|{stop_to}")
+    routes = []
+    for _ in range(count):
+        transfers = rng.randint(0, 3)
+        minutes = rng.randint(10, 150)
+        stations = [stop_from]
+        stations += [f"Přestup {rng.randint(1, 500)}" for _ in range(transfers)]
+        stations += [stop_to]
+        legs = [
+            {
+                "displayStation": station_from,
+                "destinationStation": station_to,
+                "class": rng.choice(["bus", "vlak", "metro", "tram"]),
+            }
+            for station_from, station_to in zip(stations, stations[1:])
+        ]
+        routes.append(
+            {
+                "timeLength": _format_time_length(minutes),
+                "transfers": _format_transfers(transfers),
+                "route": legs,
+            }
+        )
+    return routes
+
+
+def _format_time_length(minutes):
+    hours, minutes = divmod(minutes, 60)
+    if hours == 0:
+        return f"{minutes} min"
+    return f"{hours} hod {minutes} min"
+
+
+def _format_transfers(transfers):
+    if transfers == 0:
+        return "bez přestupu"
+    if transfers == 1:
+        return "1 přestup"
+    return f"{transfers} přestupy"
 
 
 async def return_200(request):
@@ -29,22 +177,113 @@ async def estates_overview(request):
 
     idx_start = (page - 1) * per_page
     idx_end = page * per_page
+    result_window = request.app["result_window"]
+    if result_window is not None:
+        idx_end = min(idx_end, result_window)
 
-    total_estates = len(request.app["data"]["estates"])
-    estates = request.app["data"]["estates"][idx_start:idx_end]
-    return json_response(
+    estates = _filter_by_price(
+        request.app["data"]["estates"],
+        request.query.get("czk_price_summary_order2"),
+    )
+    return _conditional_json(
+        request,
         {
-            "result_size": total_estates,
-            "_embedded": {"estates": estates},
-        }
+            "result_size": len(estates),
+            "_embedded": {"estates": estates[idx_start:idx_end]},
+        },
     )
 
 
+def _conditional_json(request, data):
+    # ETag of the body, a matching If-None-Match gets an empty 304
+    body = json.dumps(data)
+    etag = f'"{hashlib.sha1(body.encode()).hexdigest()[:16]}"'
+    if request.headers.get("If-None-Match") == etag:
+        return Response(status=304, headers={"ETag": etag})
+    return json_response(text=body, headers={"ETag": etag})
+
+
+def _filter_by_price(estates, price_range):
+    if price_range is None:
+        return estates
+    low, _, high = price_range.partition("|")
+    low, high = int(low or 0), int(high) if high else None
+    return [
+        e
+        for e in estates
+        if low <= e["price_czk"]["value_raw"]
+        and (high is None or e["price_czk"]["value_raw"] <= high)
+    ]
+
+
 async def estates_detail(request):
     assert "estate_id" in request.match_info, "Expected estate_id in the request"
     estate_id = request.match_info["estate_id"]
     data = request.app["data"]["estates"]
     for estate in data:
         if estate["_links"]["self"]["href"] == f"/estate/{estate_id}":
-            return json_response(estate)
+            user_agent = request.headers.get("User-Agent", "")
+            detail = make_estate_detail(estate_id, user_agent)
+            return _conditional_json(request, estate | detail)
     return json_response({}, status=404)
+
+
+def make_estate_detail(estate_id, user_agent="Mozilla/5.0"):
+    # like Sreality, areas are random without a browser user agent
+    rng = random.Random(estate_id if user_agent.startswith("Mozilla") else None)
+    return {
+        "name": {"value": f"Prodej rodinného domu {estate_id}"},
+        "text": {"value": f"Popis domu {estate_id}"},
+        "items": [
+            {"name": "Užitná plocha", "value": str(rng.randint(60, 250))},
+            {"name": "Plocha pozemku", "value": f"{rng.randint(2, 30)} 000"},
+        ],
+    }
+
+
+async def pid_search(request):
+    stop_from = request.query.get("stop_from", "")
+    stop_to = request.query.get("stop_to", "")
+    return _conditional_json(request, {"data": make_pid_routes(stop_from, stop_to)})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sreality and PID simulator")
+    parser.add_argument("--host", type=str, default="localhost")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--estates", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--result-window", type=int, default=None)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--too-many-requests-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-per-sec", type=int, default=None)
+    parser.add_argument(
+        "--routes",
+        nargs="+",
+        default=["estates", "estate_detail", "pid"],
+        help="Routes the behaviour applies to",
+    )
+    args = parser.parse_args()
+
+    behaviour = RouteBehaviour(
+        latency_ms=args.latency_ms,
+        latency_sigma=args.latency_sigma,
+        error_rate=args.error_rate,
+        too_many_requests_rate=args.too_many_requests_rate,
+        rate_limit_per_sec=args.rate_limit_per_sec,
+    )
+    app = create_app(
+        simulation={route: behaviour for route in args.routes},
+        estates=make_estate_records(args.estates),
+        seed=args.seed,
+        result_window=args.result_window,
+    )
+    print(f"Sreality base url: http://{args.host}:{args.port}/")
+    print(f"PID url: http://{args.host}:{args.port}/pid")
+    web.run_app(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,39 +1,71 @@
-class MaxElapsedError(Exception):
-    pass
+from baraky.client import fingerprint_page
+from baraky.models import EstateOverview, PIDCommuteFeature
 
 
-class DeterministicCycleTimer:
-    elapsed_count = 0
+def make_estate(i, price=None, gps=None):
+    return EstateOverview(
+        id=str(i),
+        price=price or i * 1000,
+        link=f"https://www.example.com/{i}",
+        gps=gps or (i, i),
+    )
 
-    def __init__(self, max_elapsed=1):
-        self.elapsed_count = 0
-        self.max_elapsed = max_elapsed
 
-    def reset(self):
-        self.elapsed_count += 1
+def make_commute(time_minutes=30, **fields):
+    return PIDCommuteFeature(
+        **{
+            "time_minutes": time_minutes,
+            "transfers_count": 1,
+            "from_station": "From",
+            "to_station": "To",
+            "gps_stop_distance": 0.0,
+            "path_info": None,
+            **fields,
+        }
+    )
 
-    def allow_elapse(self):
-        self._allow_elapsed = True
 
-    def elapsed(self):
-        if self.max_elapsed <= 0:
-            raise MaxElapsedError()
-        self.max_elapsed -= 1
-        return True
+def make_commuting_estate(i, time_minutes=30):
+    estate = make_estate(i)
+    estate.features["pid_commute_time"] = make_commute(time_minutes)
+    return estate
 
-    async def wait(self):
-        pass
+
+class MaxElapsedError(Exception):
+    pass
+
+
+class FakeClock:
+    def __init__(self, max_sleeps=None):
+        self.now = 0.0
+        self.sleeps = []
+        self.max_sleeps = max_sleeps
+
+    def time(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        if self.max_sleeps is not None and len(self.sleeps) >= self.max_sleeps:
+            raise MaxElapsedError()
+        self.sleeps.append(seconds)
+        self.now += seconds
 
 
 class MockClient:
     data = []
+    read_all_count = 0
 
-    async def read_all(self):
+    async def read_all(self, session=None):
+        self.read_all_count += 1
         return self.data
 
+    async def probe(self, session=None):
+        return fingerprint_page(len(self.data), self.data[:20])
+
 
 class MockStorage:
-    data = []
+    def __init__(self):
+        self.data = []
 
     async def get_ids(self):
         return [record.id for record in self.data]
@@ -41,9 +73,36 @@ class MockStorage:
     async def save(self, estates):
         self.data.extend(estates)
 
+    async def get_all(self):
+        return list(self.data)
+
+    async def get_many(self, estate_ids):
+        # the last saved version of each estate
+        latest = {record.id: record for record in self.data}
+        return [latest[estate_id] for estate_id in estate_ids if estate_id in latest]
+
+    async def save_many(self, estates):
+        self.data.extend(estates)
+
 
 class MockQueue:
-    data = []
+    def __init__(self):
+        self.data = []
 
     def put(self, estate):
         self.data.append(estate)
+
+
+class MockFeatureCalculator:
+    def __init__(self, time_minutes=30, transfers_count=1):
+        self.time_minutes = time_minutes
+        self.transfers_count = transfers_count
+        self.calculated = []
+
+    async def calculate(self, estate_overview):
+        self.calculated.append(estate_overview.id)
+        return make_commute(
+            self.time_minutes,
+            transfers_count=self.transfers_count,
+            path_info="From->To (bus)",
+        )
@@ -0,0 +1,91 @@
+import pytest
+
+from baraky.api import ApiServer, EstateIndex
+from baraky.models import EstateReaction
+from baraky.storages import EstatesStorage, ReactionsStorage
+from . import models as test_models
+
+
+@pytest.fixture(name="estates_storage")
+async def _fix_estates_storage(fs_storage):
+    storage = EstatesStorage("estate/house/", fs_storage)
+    await storage.save_many(
+        [
+            test_models.make_commuting_estate(1, 30),
+            test_models.make_commuting_estate(2, 90),
+            test_models.make_commuting_estate(3, 45),
+            test_models.make_estate(4),
+        ]
+    )
+    return storage
+
+
+async def test_estate_index_query(estates_storage):
+    index = EstateIndex(estates_storage)
+    assert await index.refresh() == 4
+    assert await index.refresh() == 0
+
+    total, page = index.query(max_commute=60, sort="-commute")
+    assert total == 2
+    assert [e.id for e in page] == ["3", "1"]
+
+    total, page = index.query(min_price=2000, sort="-price", offset=1, limit=2)
+    assert total == 3
+    assert [e.id for e in page] == ["3", "2"]
+
+    total, page = index.query(bbox=(1.5, 1.5, 3.5, 3.5))
+    assert [e.id for e in page] == ["2", "3"]
+    # estates without the value sort last
+    _, page = index.query(sort="commute")
+    assert [e.id for e in page] == ["1", "3", "2", "4"]
+
+    version = index.version
+    await estates_storage.remove_many(["2"])
+    assert await index.refresh() == 1
+    assert index.get("2") is None
+    assert index.version != version
+
+
+@pytest.mark.filterwarnings("ignore:DeprecationWarning")
+async def test_api_server(aiohttp_client, estates_storage, fs_storage):
+    reactions = ReactionsStorage("estate/", fs_storage)
+    reactions.write(EstateReaction(estate_id="1", username="a", reaction="like"))
+    reactions.write(EstateReaction(estate_id="1", username="b", reaction="like"))
+    server = ApiServer(EstateIndex(estates_storage), reactions)
+    await server.refresh()
+    client = await aiohttp_client(server.create_app())
+
+    resp = await client.get("/estates", params={"max_commute": 60, "limit": 1})
+    assert resp.status == 200
+    body = await resp.json()
+    assert body["total"] == 2
+    assert [e["id"] for e in body["items"]] == ["1"]
+
+    etag = resp.headers["ETag"]
+    resp = await client.get(
+        "/estates",
+        params={"max_commute": 60, "limit": 1},
+        headers={"If-None-Match": etag},
+    )
+    assert resp.status == 304
+
+    resp = await client.get("/estates/1")
+    assert (await resp.json())["reactions"]["counts"] == {"like": 2}
+    assert (await client.get("/estates/999")).status == 404
+    assert (await client.get("/estates", params={"sort": "size"})).status == 400
+    for params in ({"limit": "inf"}, {"offset": "inf"}, {"limit": "nan"}):
+        assert (await client.get("/estates", params=params)).status == 400
+
+    resp = await client.get("/reactions")
+    assert (await resp.json())["1"]["users"] == {"a": "like", "b": "like"}
+
+    # new data changes the ETag of the same query
+    await estates_storage.save_many([test_models.make_commuting_estate(5, 10)])
+    await server.refresh()
+    resp = await client.get(
+        "/estates",
+        params={"max_commute": 60, "limit": 1},
+        headers={"If-None-Match": etag},
+    )
+    assert resp.status == 200
+    assert (await resp.json())["total"] == 3
@@ -0,0 +1,16 @@
+import json
+
+from . import benchmark
+
+
+async def test_benchmarks_run():
+    results = await benchmark.run(list(benchmark.BENCHMARKS), [10])
+    assert {r["name"] for r in results} == set(benchmark.BENCHMARKS)
+    assert all(r["seconds"] >= 0 for r in results)
+
+
+def test_benchmark_report_is_parseable(monkeypatch, capsys):
+    argv = ["benchmark", "--sizes", "5", "--only", "client_read_all"]
+    monkeypatch.setattr("sys.argv", argv)
+    benchmark.main()
+    assert json.loads(capsys.readouterr().out)["results"][0]["size"] == 5
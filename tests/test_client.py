@@ -1,21 +1,24 @@
 import pytest
+from baraky.client import SrealityEstatesClient
+from .dummy_server import (
+    create_dummy_server,
+    make_estate_detail,
+    make_estate_records,
+)
 
 
-# async def test_estate_detail(estates_client, dummy_server):
-#     dummy_server.app["data"]["estates"] = [
-#         {
-#             "_links": {
-#                 "self": {"href": "/estate/1"},
-#             },
-#         }
-#     ]
-#
-#     estate = await estates_client.detail(1)
-#     assert estate
-#     assert estate.get("_links", {}).get("self", {}).get("href") == "/estate/1"
-#
-#     not_estate = await estates_client.detail(999)
-#     assert not_estate is None
+async def test_estate_details(estates_client, dummy_server):
+    dummy_server.app["data"]["estates"] = make_estate_records(5)
+
+    details = await estates_client.details(["1", "3", "999"], retries=1, backoff_sec=0)
+
+    assert details["1"]["_links"]["self"]["href"] == "/estate/1"
+    assert details["3"]["text"]["value"] == "Popis domu 3"
+    # the areas are valid only with the browser user agent of the client
+    assert details["3"]["items"] == make_estate_detail("3")["items"]
+    assert details["999"] is None
+    # the missing estate was retried once
+    assert dummy_server.app["stats"]["estate_detail"] == {200: 2, 404: 2}
 
 
 @pytest.mark.filterwarnings("ignore:DeprecationWarning")
@@ -39,3 +42,50 @@ async def test_estate_overview(estates_client, dummy_server):
     for i, estate in enumerate(estates):
         assert estate.id == str(i)
         assert estate.price == i * 1000000
+
+
+@pytest.mark.filterwarnings("ignore:DeprecationWarning")
+async def test_estate_probe_fingerprint(estates_client, dummy_server):
+    dummy_server.app["data"]["estates"] = make_estate_records(30)
+    first = await estates_client.probe()
+    assert first is not None
+    assert first.result_size == 30
+    assert await estates_client.probe() == first
+
+    dummy_server.app["data"]["estates"][0]["price_czk"]["value_raw"] = 1
+    assert (await estates_client.probe()).digest != first.digest
+
+    dummy_server.app["data"]["estates"] = make_estate_records(31)
+    assert (await estates_client.probe()).result_size == 31
+
+
+async def test_estate_read_all_shards_large_results(aiohttp_server):
+    server = await create_dummy_server(
+        aiohttp_server,
+        estates=make_estate_records(250, price_step=1000),
+        result_window=60,
+    )
+    client = SrealityEstatesClient({}, base_url=str(server.make_url("/")))
+    client.per_page = 20
+    client.max_result_size = 60
+    client.max_price = 1_000_000
+
+    estates = await client.read_all()
+
+    assert sorted(int(e.id) for e in estates) == list(range(250))
+
+
+async def test_estate_read_all_shards_within_query_price_range(aiohttp_server):
+    server = await create_dummy_server(
+        aiohttp_server,
+        estates=make_estate_records(250, price_step=1000),
+        result_window=60,
+    )
+    query = {"czk_price_summary_order2": "100000|199999"}
+    client = SrealityEstatesClient(query, base_url=str(server.make_url("/")))
+    client.per_page = 20
+    client.max_result_size = 30
+
+    estates = await client.read_all()
+
+    assert sorted(int(e.id) for e in estates) == list(range(100, 200))
@@ -0,0 +1,90 @@
+from baraky.dedup import cluster_duplicates
+from baraky.models import EstateOverview
+from baraky.settings import DedupSettings
+from baraky.spatial import EstateSpatialIndex
+
+
+def _listing(estate_id, lat, lon, price):
+    return EstateOverview(
+        id=estate_id,
+        price=price,
+        link=f"https://www.example.com/{estate_id}",
+        gps=(lat, lon),
+    )
+
+
+def test_cluster_duplicates():
+    estates = [
+        _listing("a", 50.0, 14.0, 5_000_000),
+        _listing("other", 50.1, 14.0, 5_000_000),
+        # 11 m and 1 % away from "a"
+        _listing("b", 50.0001, 14.0, 5_050_000),
+        # 22 m from "a", but only 11 m from "b"
+        _listing("c", 50.0002, 14.0, 5_000_000),
+        _listing("pricier", 50.0, 14.0, 6_000_000),
+    ]
+
+    clusters = cluster_duplicates(estates, distance_m=15, price_tolerance=0.02)
+
+    assert [[e.id for e in c] for c in clusters] == [
+        ["a", "b", "c"],
+        ["other"],
+        ["pricier"],
+    ]
+
+
+def test_cluster_duplicates_without_duplicates():
+    assert cluster_duplicates([]) == []
+    single = [_listing("a", 50.0, 14.0, 1)]
+    assert cluster_duplicates(single) == [single]
+
+
+async def test_watcher_notifies_cluster_once(watcher, mock_client):
+    mock_client.data = [
+        _listing("1", 50.0, 14.0, 3_000_000),
+        _listing("2", 50.0001, 14.0, 3_000_000),
+        _listing("3", 51.0, 15.0, 3_000_000),
+    ]
+    calculator = watcher.feature_calculators["pid_commute_time"]
+
+    changes = await watcher.update()
+
+    assert changes == {"default": 3}
+    assert sorted(calculator.calculated) == ["1", "3"]
+    hits = {m.id: m for m in watcher.output_queue.data}
+    assert sorted(hits) == ["1", "3"]
+    assert hits["1"].other_links == ["https://www.example.com/2"]
+    saved = {e.id: e for e in watcher.storage.data}
+    assert sorted(saved) == ["1", "2", "3"]
+    assert saved["2"].features["pid_commute_time"] is not None
+
+
+async def test_watcher_skips_duplicates_of_stored(watcher, mock_client):
+    watcher.spatial_index = EstateSpatialIndex()
+    calculator = watcher.feature_calculators["pid_commute_time"]
+    mock_client.data = [_listing("1", 50.0, 14.0, 3_000_000)]
+    await watcher.update()
+
+    # another agency lists the same house a cycle later
+    mock_client.data = [
+        _listing("1", 50.0, 14.0, 3_000_000),
+        _listing("2", 50.0001, 14.0, 3_010_000),
+        _listing("3", 51.0, 15.0, 3_000_000),
+    ]
+    await watcher.update()
+
+    assert sorted(calculator.calculated) == ["1", "3"]
+    assert sorted(m.id for m in watcher.output_queue.data) == ["1", "3"]
+    saved = {e.id: e for e in watcher.storage.data}
+    assert saved["2"].features == saved["1"].features
+    assert saved["2"].feature_keys == {}
+
+
+async def test_watcher_dedup_can_be_disabled(watcher, mock_client):
+    watcher.dedup_settings = DedupSettings(distance_m=0)
+    mock_client.data = [
+        _listing("1", 50.0, 14.0, 3_000_000),
+        _listing("2", 50.0001, 14.0, 3_000_000),
+    ]
+    await watcher.update()
+    assert len(watcher.output_queue.data) == 2
@@ -0,0 +1,87 @@
+import asyncio
+
+from baraky.client import SrealityEstatesClient
+from baraky.details import DetailCache, EstateDetailEnhancer, parse_detail
+from baraky.estate_watcher import EstateWatcher
+from baraky.filters import FilterChain, Predicate
+from baraky.settings import EstateDetailSettings
+from . import models as test_models
+from .dummy_server import RouteBehaviour, create_dummy_server, make_estate_records
+
+
+def test_parse_detail():
+    detail = parse_detail(
+        {
+            "name": {"value": "Prodej domu"},
+            "items": [
+                {"name": "Užitná plocha", "value": "120"},
+                {"name": "Plocha pozemku", "value": "1 250,5"},
+                {"name": "Stavba", "value": "Cihlová"},
+            ],
+        }
+    )
+    assert detail.title == "Prodej domu"
+    assert detail.description is None
+    assert detail.usable_area == 120
+    assert detail.plot_area == 1250.5
+    assert detail.built_up_area is None
+
+
+async def test_detail_enhancer_caches_by_price(aiohttp_server, tmp_path):
+    server = await create_dummy_server(
+        aiohttp_server,
+        estates=make_estate_records(4),
+        simulation={"estate_detail": RouteBehaviour(error_rate=0.3)},
+        seed=7,
+    )
+    enhancer = EstateDetailEnhancer(
+        client=SrealityEstatesClient({}, base_url=str(server.make_url("/"))),
+        cache=DetailCache(tmp_path / "details"),
+        settings=EstateDetailSettings(retries=10, backoff_sec=0),
+    )
+    estates = SrealityEstatesClient({})._map_to_model(make_estate_records(4))
+    stats = server.app["stats"]["estate_detail"] = {}
+
+    features = await asyncio.gather(*[enhancer.calculate(e) for e in estates])
+    assert [f.description for f in features] == [f"Popis domu {i}" for i in range(4)]
+    assert stats[200] == 4 and stats.get(503, 0) > 0
+
+    await asyncio.gather(*[enhancer.calculate(e) for e in estates])
+    assert stats[200] == 4
+
+    estates[2].price += 1
+    feature = await enhancer.calculate(estates[2])
+    assert feature.usable_area is not None
+    assert stats[200] == 5
+
+
+async def test_watcher_fetches_details_of_hits(dummy_server, mock_storage, tmp_path):
+    dummy_server.app["data"]["estates"] = make_estate_records(4)
+    client = SrealityEstatesClient({}, base_url=str(dummy_server.make_url("/")))
+    commute = test_models.MockFeatureCalculator()
+    commute.cost = 10
+    watcher = EstateWatcher(
+        client=client,
+        storage=mock_storage,
+        output_queue=test_models.MockQueue(),
+        feature_calculators={
+            "pid_commute_time": commute,
+            "detail": EstateDetailEnhancer(client, DetailCache(tmp_path)),
+        },
+        filter_fn=FilterChain(
+            [
+                Predicate(lambda e: e.id != "1", requires=["pid_commute_time"]),
+            ]
+        ),
+        progress=False,
+        calculator_delays={},
+    )
+
+    await watcher.update()
+
+    # the commute is calculated first, the rejected estate gets no detail
+    assert sorted(commute.calculated) == ["0", "1", "2", "3"]
+    assert dummy_server.app["stats"]["estate_detail"] == {200: 3}
+    saved = {e.id: e.features for e in mock_storage.data}
+    assert "detail" not in saved["1"]
+    assert saved["2"]["detail"].description == "Popis domu 2"
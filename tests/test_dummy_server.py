@@ -0,0 +1,61 @@
+import time
+
+import aiohttp
+import pytest
+
+from baraky.estate_features import PIDClient
+from baraky.settings import PIDClientSettings
+from .dummy_server import RouteBehaviour, create_dummy_server, make_estate_records
+
+pytestmark = pytest.mark.filterwarnings("ignore:DeprecationWarning")
+
+
+async def _statuses(server, path, count):
+    statuses = []
+    async with aiohttp.ClientSession() as session:
+        for _ in range(count):
+            async with session.get(server.make_url(path)) as resp:
+                statuses.append(resp.status)
+    return statuses
+
+
+async def test_simulated_errors(aiohttp_server):
+    server = await create_dummy_server(
+        aiohttp_server,
+        simulation={"estates": RouteBehaviour(error_rate=1.0)},
+    )
+    assert await _statuses(server, "/estates", 3) == [503] * 3
+    assert await _statuses(server, "/200/", 1) == [200]
+    assert server.app["stats"]["estates"] == {503: 3}
+
+
+async def test_simulated_rate_limit(aiohttp_server):
+    server = await create_dummy_server(
+        aiohttp_server,
+        simulation={"estates": RouteBehaviour(rate_limit_per_sec=2)},
+    )
+    assert await _statuses(server, "/estates", 4) == [200, 200, 429, 429]
+
+
+async def test_simulated_latency(aiohttp_server):
+    server = await create_dummy_server(
+        aiohttp_server,
+        simulation={"estates": RouteBehaviour(latency_ms=50)},
+    )
+    start = time.perf_counter()
+    await _statuses(server, "/estates", 2)
+    assert time.perf_counter() - start >= 0.1
+
+
+async def test_simulated_pid_routes(aiohttp_server):
+    server = await create_dummy_server(
+        aiohttp_server, estates=make_estate_records(10)
+    )
+    settings = PIDClientSettings(url_base=str(server.make_url("/pid")))
+    client = PIDClient(settings)
+
+    route = await client.get_route("Beroun", "Smíchovské nádraží")
+    assert route is not None
+    assert 10 <= route.time_minutes <= 150
+    assert route.path_info.startswith("Beroun->")
+    assert await client.get_route("Beroun", "Smíchovské nádraží") == route
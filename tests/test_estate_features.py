@@ -0,0 +1,101 @@
+import datetime
+
+import pytest
+
+from baraky import feature_cache
+from baraky.estate_features import (
+    NearestStopEnhancer,
+    PIDCommuteFeatureEnhancer,
+    next_business_day_str,
+)
+from baraky.estate_watcher import EstateWatcher
+from baraky.filters import FilterChain, Predicate
+from baraky.models import EstateOverview, PIDResponse
+from . import models as test_models
+
+
+def test_next_business_day_skips_weekend():
+    friday = datetime.date(2024, 5, 3)
+    assert next_business_day_str(friday) == "06.05.2024"
+    assert next_business_day_str(friday + datetime.timedelta(days=1)) == "06.05.2024"
+    assert next_business_day_str(friday + datetime.timedelta(days=2)) == "06.05.2024"
+    assert next_business_day_str(datetime.date(2024, 5, 6)) == "07.05.2024"
+
+
+class RouteClient:
+    def __init__(self):
+        self.routes = []
+
+    async def get_route(self, stop_from, stop_to):
+        self.routes.append(stop_from)
+        return PIDResponse(time_minutes=20, transfers_count=0, path_info="")
+
+
+STOPS = {"Near": (50.0, 14.0), "Far": (50.5, 14.5)}
+
+
+async def test_nearest_stop_before_route(mock_storage):
+    route_client = RouteClient()
+    calculators = {
+        "pid_commute_time": PIDCommuteFeatureEnhancer(STOPS, pid_client=route_client),
+        "nearest_stop": NearestStopEnhancer(STOPS),
+    }
+    client = test_models.MockClient()
+    client.data = [
+        EstateOverview(id="1", price=1, link="", gps=(50.009, 14.0)),
+        EstateOverview(id="2", price=1, link="", gps=(50.25, 14.0)),
+    ]
+    watcher = EstateWatcher(
+        client=client,
+        storage=mock_storage,
+        output_queue=test_models.MockQueue(),
+        feature_calculators=calculators,
+        filter_fn=FilterChain(
+            [
+                Predicate(
+                    lambda e: e.features["nearest_stop"].distance_km <= 5,
+                    requires=["nearest_stop"],
+                    cost=0.01,
+                ),
+                Predicate(lambda e: True, requires=["pid_commute_time"], cost=10),
+            ]
+        ),
+        progress=False,
+        calculator_delays={},
+    )
+
+    await watcher.update()
+
+    assert route_client.routes == ["Near"]
+    saved = {e.id: e.features for e in mock_storage.data}
+    assert saved["1"]["nearest_stop"].distance_km == pytest.approx(1.0, abs=0.01)
+    assert saved["1"]["pid_commute_time"].from_station == "Near"
+    assert saved["2"]["nearest_stop"].distance_km > 25
+    assert "pid_commute_time" not in saved["2"]
+
+
+async def test_commute_keys(watcher, mock_client):
+    route_client = RouteClient()
+    failing = RouteClient()
+
+    async def fail(stop_from, stop_to):
+        failing.routes.append(stop_from)
+
+    failing.get_route = fail
+    enhancer = PIDCommuteFeatureEnhancer(STOPS, pid_client=failing)
+    watcher.feature_calculators = {"pid_commute_time": enhancer}
+    watcher.calculator_delays = {}
+    watcher.searches[0].filter_fn = lambda e: False
+    mock_client.data = [EstateOverview(id="1", price=1, link="", gps=(50.0, 14.0))]
+    await watcher.update()
+    assert watcher.storage.data[-1].feature_keys == {}
+
+    # a failed lookup is retried with the next price change
+    enhancer.pid_client = route_client
+    mock_client.data = [EstateOverview(id="1", price=2, link="", gps=(50.0, 14.0))]
+    await watcher.update()
+    assert route_client.routes == ["Near"]
+    key = watcher.storage.data[-1].feature_keys["pid_commute_time"]
+
+    enhancer.desired_stop = "Elsewhere"
+    assert feature_cache.feature_key(enhancer, watcher.storage.data[-1]) != key
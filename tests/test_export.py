@@ -0,0 +1,98 @@
+import json
+import os
+import time
+
+import numpy as np
+import pytest
+
+from baraky.export import EstatesExporter
+from baraky.storages import EstatesStorage
+from . import models as test_models
+
+
+def _stored_estates(count, start=0):
+    estates = []
+    for i in range(start, start + count):
+        estate = test_models.make_estate(i, gps=(50.0, 14.0 + i / 100))
+        estate.features["pid_commute_time"] = test_models.make_commute(
+            None if i % 2 else i, from_station=f"stop_{i}", to_station="Praha"
+        )
+        estates.append(estate)
+    return estates
+
+
+@pytest.fixture(name="estates_storage")
+async def _fix_estates_storage(fs_storage):
+    storage = EstatesStorage("estate/house/", fs_storage)
+    await storage.save_many(_stored_estates(7))
+    return storage
+
+
+async def test_export_npz(estates_storage, tmp_path):
+    exporter = EstatesExporter(
+        estates_storage, tmp_path / "state.json", batch_size=3, progress=False
+    )
+    output = tmp_path / "estates.npz"
+    assert await exporter.export(output, format="npz") == 7
+
+    data = np.load(output)
+    order = np.argsort(data["id"].astype(int))
+    assert list(data["price"][order]) == [i * 1000 for i in range(7)]
+    times = data["pid_commute_time.time_minutes"][order]
+    assert times[0] == 0 and np.isnan(times[1])
+    assert list(data["pid_commute_time.from_station"][order][:2]) == [
+        "stop_0",
+        "stop_1",
+    ]
+
+
+async def test_export_incremental(estates_storage, fs_storage, tmp_path):
+    exporter = EstatesExporter(
+        estates_storage, tmp_path / "state.json", progress=False
+    )
+    assert await exporter.export(tmp_path / "full.npz", format="npz") == 7
+
+    await estates_storage.save_many(_stored_estates(2, start=10))
+    # filesystem mtimes may be coarse, make the change clearly newer
+    future = time.time() + 5
+    for estate_id in ("10", "11"):
+        path = fs_storage.root / "estate/house" / f"{estate_id}.json"
+        os.utime(path, (future, future))
+
+    exported = await exporter.export(
+        tmp_path / "delta.npz", format="npz", incremental=True
+    )
+    assert exported == 2
+    data = np.load(tmp_path / "delta.npz")
+    assert sorted(data["id"]) == ["10", "11"]
+
+
+async def test_export_parquet(estates_storage, tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    exporter = EstatesExporter(
+        estates_storage, tmp_path / "state.json", batch_size=3, progress=False
+    )
+    output = tmp_path / "estates.parquet"
+    assert await exporter.export(output, format="parquet") == 7
+
+    assert pq.ParquetFile(output).num_row_groups == 3
+    table = pq.read_table(output)
+    assert table.num_rows == 7
+    assert str(table.schema.field("pid_commute_time.time_minutes").type) == "int64"
+    assert table.column("pid_commute_time.time_minutes").null_count == 3
+
+
+async def test_export_keeps_features_of_any_batch(estates_storage, tmp_path):
+    estate = _stored_estates(1, start=6)[0]
+    estate.features["garden"] = {"size_m2": 300}
+    await estates_storage.save_many([estate])
+    exporter = EstatesExporter(
+        estates_storage, tmp_path / "state.json", batch_size=1, progress=False
+    )
+    output = tmp_path / "estates.npz"
+    assert await exporter.export(output, format="npz") == 7
+
+    data = np.load(output)
+    extra = dict(zip(data["id"], data["extra_features"]))
+    assert json.loads(extra["6"]) == {"garden": {"size_m2": 300}}
+    assert extra["0"] == ""
@@ -0,0 +1,113 @@
+import pytest
+
+from baraky.estate_watcher import EstateWatcher
+from baraky.filters import FilterChain, Predicate, order_calculators
+from . import models as test_models
+
+
+class Calculator:
+    def __init__(self, cost=None, requires=()):
+        if cost is not None:
+            self.cost = cost
+        self.requires = requires
+
+
+def test_order_calculators_by_cost_and_requirements():
+    calculators = {
+        "route": Calculator(cost=10),
+        "stop": Calculator(cost=0.1),
+        "ratio": Calculator(cost=0.5, requires=["route"]),
+        "default": Calculator(),
+    }
+    assert order_calculators(calculators) == ["stop", "default", "route", "ratio"]
+    assert order_calculators(calculators, {"route"}) == [
+        "route",
+        "stop",
+        "ratio",
+        "default",
+    ]
+
+    calculators["route"].requires = ["ratio"]
+    with pytest.raises(ValueError):
+        order_calculators(calculators)
+
+
+def test_filter_chain_prefilter():
+    chain = FilterChain(
+        [
+            Predicate(
+                lambda e: e.features["pid_commute_time"].time_minutes < 60,
+                requires=["pid_commute_time"],
+                cost=10,
+            ),
+            Predicate(lambda e: e.price < 5000),
+        ]
+    )
+    cheap, expensive = test_models.make_estate(1), test_models.make_estate(9)
+
+    assert chain.prefilter(cheap)
+    assert not chain.prefilter(expensive)
+    # a missing feature never passes the whole chain
+    assert not chain(cheap)
+    assert chain.requires == {"pid_commute_time"}
+
+
+async def test_watcher_skips_expensive_features_of_rejected(mock_storage):
+    client = test_models.MockClient()
+    client.data = [test_models.make_estate(1), test_models.make_estate(9)]
+    calculator = test_models.MockFeatureCalculator()
+    calculator.cost = 10
+    queue = test_models.MockQueue()
+    watcher = EstateWatcher(
+        client=client,
+        storage=mock_storage,
+        output_queue=queue,
+        feature_calculators={"pid_commute_time": calculator},
+        filter_fn=FilterChain(
+            [
+                Predicate(lambda e: e.price < 5000),
+                Predicate(lambda e: True, requires=["pid_commute_time"]),
+            ]
+        ),
+        progress=False,
+        calculator_delays={},
+    )
+
+    await watcher.update()
+
+    assert calculator.calculated == ["1"]
+    assert [m.id for m in queue.data] == ["1"]
+    saved = {e.id: e for e in mock_storage.data}
+    assert "pid_commute_time" not in saved["9"].features
+
+
+class BatchCalculator:
+    def __init__(self):
+        self.calculated = []
+
+    async def calculate_many(self, estates):
+        self.calculated.extend(e.id for e in estates)
+        return [None for _ in estates]
+
+
+async def test_watcher_batch_calculators_skip_rejected(mock_storage):
+    client = test_models.MockClient()
+    client.data = [test_models.make_estate(1), test_models.make_estate(9)]
+    batch = BatchCalculator()
+    watcher = EstateWatcher(
+        client=client,
+        storage=mock_storage,
+        output_queue=test_models.MockQueue(),
+        feature_calculators={
+            "pid_commute_time": test_models.MockFeatureCalculator(),
+            "detail": batch,
+        },
+        filter_fn=FilterChain([Predicate(lambda e: e.price < 5000)]),
+        progress=False,
+    )
+
+    await watcher.update()
+
+    assert batch.calculated == ["1"]
+    # a failed calculation leaves the feature out
+    assert "detail" not in mock_storage.data[0].features
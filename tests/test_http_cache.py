@@ -0,0 +1,63 @@
+import time
+
+import pytest
+
+from baraky.client import SrealityEstatesClient
+from baraky.estate_features import PIDClient
+from baraky.http_cache import HttpCache
+from baraky.settings import PIDClientSettings
+from .dummy_server import make_estate_records
+
+
+@pytest.mark.filterwarnings("ignore:DeprecationWarning")
+async def test_pages_are_revalidated(dummy_server, tmp_path):
+    dummy_server.app["data"]["estates"] = make_estate_records(5)
+    url = str(dummy_server.make_url("/"))
+    cache = HttpCache(tmp_path, freshness={})
+    client = SrealityEstatesClient(query_params={}, base_url=url, http_cache=cache)
+
+    first = await client.read_all()
+    # a new cache over the same directory still has the validators
+    client.http_cache = HttpCache(tmp_path, freshness={})
+    assert await client.read_all() == first
+    assert dummy_server.app["stats"]["estates"] == {200: 1, 304: 1}
+    assert client.http_cache.stats == {"revalidated": 1}
+
+    dummy_server.app["data"]["estates"] = make_estate_records(6)
+    assert len(await client.read_all()) == 6
+    assert dummy_server.app["stats"]["estates"] == {200: 2, 304: 1}
+
+
+async def test_fresh_routes_skip_the_request(dummy_server, tmp_path):
+    url = str(dummy_server.make_url("/pid"))
+    address = url.partition("://")[2]
+    cache = HttpCache(tmp_path, freshness={address: 3600, address + "x": 0})
+    pid_client = PIDClient(PIDClientSettings(url_base=url), http_cache=cache)
+
+    route = await pid_client.get_route("A", "B")
+    assert await pid_client.get_route("A", "B") == route
+    assert dummy_server.app["stats"]["pid"] == {200: 1}
+    assert cache.stats == {"miss": 1, "hit": 1}
+    assert cache.fresh_sec(url + "x?a=b") == 0
+
+
+def test_details_are_only_revalidated(tmp_path):
+    cache = HttpCache(tmp_path)
+    # the detail cache keyed by the price serves unchanged listings
+    assert cache.fresh_sec("https://www.sreality.cz/api/cs/v2/estates/123") == 0
+
+
+async def test_old_entries_are_pruned(dummy_server, tmp_path):
+    url = str(dummy_server.make_url("/pid"))
+    address = url.partition("://")[2]
+    cache = HttpCache(tmp_path, freshness={address: 3600}, max_age_sec=60)
+    pid_client = PIDClient(PIDClientSettings(url_base=url), http_cache=cache)
+    await pid_client.get_route("A", "B")
+    await pid_client.get_route("C", "B")
+    (tmp_path / "orphan.body").write_bytes(b"{}")
+
+    assert cache.prune_sync() == ["orphan"]
+    assert len(cache.prune_sync(now=time.time() + 61)) == 2
+    assert list(tmp_path.iterdir()) == []
+    await pid_client.get_route("A", "B")
+    assert dummy_server.app["stats"]["pid"] == {200: 3}
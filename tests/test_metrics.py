@@ -0,0 +1,62 @@
+import time
+
+import pytest
+
+from baraky import metrics
+from baraky.metrics import LAST_SUCCESS, MetricsRegistry, MetricsServer
+
+
+def test_registry_renders_prometheus_text():
+    registry = MetricsRegistry()
+    requests = registry.counter("requests_total", "Requests")
+    requests.inc(host="sreality.cz", status=200)
+    requests.inc(host="sreality.cz", status=200)
+    depth = registry.gauge("queue_depth", "Depth")
+    depth.set(3, stage="save")
+    latency = registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1))
+    latency.observe(0.05)
+    latency.observe(0.5)
+
+    text = registry.render()
+    assert "# TYPE requests_total counter" in text
+    assert 'requests_total{host="sreality.cz",status="200"} 2' in text
+    assert 'queue_depth{stage="save"} 3' in text
+    assert 'latency_seconds_bucket{le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{le="1"} 2' in text
+    assert 'latency_seconds_bucket{le="+Inf"} 2' in text
+    assert "latency_seconds_count 2" in text
+    assert "latency_seconds_sum 0.55" in text
+
+
+async def test_watcher_cycle_is_instrumented(watcher, mock_client):
+    mock_client.data = []
+    cycles = metrics.CYCLE_SECONDS.count()
+    await watcher.update()
+    assert metrics.CYCLE_SECONDS.count() == cycles + 1
+    assert time.time() - metrics.LAST_SUCCESS.value() < 5
+
+
+@pytest.mark.filterwarnings("ignore:DeprecationWarning")
+async def test_metrics_server(aiohttp_client):
+    registry = MetricsRegistry()
+    registry.counter("requests_total", "Requests").inc()
+    server = MetricsServer(registry, max_cycle_age_sec=60)
+    client = await aiohttp_client(server.create_app())
+
+    resp = await client.get("/metrics")
+    assert resp.status == 200
+    assert resp.headers["Content-Type"].startswith("text/plain")
+    assert "requests_total 1" in await resp.text()
+
+    resp = await client.get("/healthz")
+    assert (await resp.json())["status"] == "starting"
+
+    last_success = registry.gauge(LAST_SUCCESS.name, LAST_SUCCESS.help_text)
+    last_success.set(time.time())
+    resp = await client.get("/healthz")
+    assert resp.status == 200
+    assert (await resp.json())["status"] == "ok"
+
+    last_success.set(time.time() - 120)
+    resp = await client.get("/healthz")
+    assert resp.status == 503
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from baraky.client import SrealityEstatesClient
+from baraky.offload import CpuPool
+from baraky.spatial import NeighbourhoodPriceEnhancer
+from .dummy_server import make_estate_records
+from .test_spatial import _grid_index, _located
+
+
+@pytest.fixture(name="cpu_pool")
+def _fix_cpu_pool():
+    pool = CpuPool(workers=2, chunk_size=2)
+    yield pool
+    pool.close()
+
+
+async def test_cpu_pool_map_chunks(cpu_pool):
+    inline = CpuPool(workers=0, chunk_size=2)
+    items = list(range(5))
+
+    assert await cpu_pool.map_chunks(sum, items) == [1, 5, 4]
+    assert await inline.map_chunks(sum, items) == [1, 5, 4]
+
+
+async def test_read_all_offloaded(dummy_server, cpu_pool):
+    records = make_estate_records(25)
+    # an invalid record is dropped in the worker as well
+    del records[7]["price_czk"]
+    dummy_server.app["data"]["estates"] = records
+    url = str(dummy_server.make_url("/"))
+    client = SrealityEstatesClient(query_params={}, base_url=url)
+    client.per_page = 4
+    offloaded = SrealityEstatesClient(
+        query_params={}, base_url=url, cpu_pool=cpu_pool
+    )
+    offloaded.per_page = 4
+
+    estates = await client.read_all()
+    assert len(estates) == 24
+    assert await offloaded.read_all() == estates
+
+
+async def test_neighbourhood_price_offloaded(cpu_pool):
+    index = _grid_index()
+    estates = [_located(f"new-{j}", 50.018, 14 + j * 0.014, 4000) for j in range(5)]
+
+    local = await NeighbourhoodPriceEnhancer(index, k=4).calculate_many(estates)
+    offloaded = NeighbourhoodPriceEnhancer(index, k=4, cpu_pool=cpu_pool)
+    medians, counts = await index.median_nearest_prices_offloaded(
+        cpu_pool, [e.gps for e in estates], 4, chunk_size=2
+    )
+
+    assert await offloaded.calculate_many(estates) == local
+    assert np.array_equal(counts, [f.comparables for f in local])
+    assert medians.tolist() == [f.median_price for f in local]
+
+
+async def test_single_chunk_is_queried_inline():
+    class RecordingPool(CpuPool):
+        def __init__(self):
+            super().__init__(workers=2)
+            self.calls = 0
+
+        async def run(self, fn, *args):
+            self.calls += 1
+            return fn(*args)
+
+    index = _grid_index()
+    gps_list = [(50.018, 14 + j * 0.014) for j in range(5)]
+    pool = RecordingPool()
+
+    inline = await index.median_nearest_prices_offloaded(pool, gps_list, 4)
+    assert pool.calls == 0
+    # at most one chunk per worker, however small the chunks are
+    chunked = await index.median_nearest_prices_offloaded(
+        pool, gps_list, 4, chunk_size=1
+    )
+    assert pool.calls == 2
+    assert np.array_equal(inline[0], chunked[0])
@@ -0,0 +1,59 @@
+import asyncio
+import json
+import pstats
+import time
+
+import pytest
+
+from baraky.profiling import CycleProfiler, SpanTracer, TRACER, traced, watch_loop_stalls
+
+
+async def test_cycle_profiler_cprofile(watcher, mock_client, tmp_path):
+    profile_path = tmp_path / "cycle.prof"
+    watcher.profiler = CycleProfiler(profile_path, sampling=False)
+    mock_client.data = []
+
+    await watcher.update()
+
+    stats = pstats.Stats(str(profile_path))
+    assert any("_update" in func[2] for func in stats.stats)
+
+
+async def test_cycle_profiler_sampling(watcher, mock_client, tmp_path):
+    pytest.importorskip("pyinstrument")
+    profile_path = tmp_path / "cycle.speedscope.json"
+    watcher.profiler = CycleProfiler(profile_path, sampling=True)
+    mock_client.data = []
+
+    await watcher.update()
+    await watcher.update()
+
+    assert "speedscope" in json.loads(profile_path.read_text())["$schema"]
+
+
+async def test_trace_spans(watcher, mock_client, tmp_path):
+    trace_path = tmp_path / "trace.jsonl"
+    mock_client.data = []
+
+    await traced(watcher.update(), trace_path)
+
+    spans = [json.loads(line) for line in trace_path.read_text().splitlines()]
+    assert "cycle" in [span["name"] for span in spans]
+    assert all(span["end"] >= span["start"] for span in spans)
+    assert not TRACER.enabled
+
+
+async def test_loop_stall_is_traced(tmp_path):
+    tracer = SpanTracer()
+    tracer.open(tmp_path / "trace.jsonl")
+    monitor = asyncio.create_task(
+        watch_loop_stalls(interval_sec=0.01, threshold_sec=0.05, tracer=tracer)
+    )
+    await asyncio.sleep(0.02)
+    time.sleep(0.2)  # blocks the loop
+    await asyncio.sleep(0.02)
+    monitor.cancel()
+    tracer.close()
+
+    spans = (tmp_path / "trace.jsonl").read_text().splitlines()
+    assert any(json.loads(span)["name"] == "loop.stall" for span in spans)
@@ -0,0 +1,154 @@
+import asyncio
+
+import pytest
+
+from baraky.estate_features import RouteCache
+from baraky.models import EstateOverview, PIDResponse, Tombstone
+from baraky.reenhance import Reenhancer
+from baraky.storages import EstatesStorage, TombstoneStorage
+from . import models as test_models
+
+
+def _stored_estates(count):
+    return [
+        EstateOverview(
+            id=str(i),
+            price=i * 1000,
+            link=f"https://www.example.com/{i}",
+            gps=(50.0, 14.0),
+        )
+        for i in range(count)
+    ]
+
+
+@pytest.fixture(name="estates_storage")
+async def _fix_estates_storage(fs_storage):
+    storage = EstatesStorage("estate/house/", fs_storage)
+    await storage.save_many(_stored_estates(25))
+    return storage
+
+
+async def test_reenhance_all(estates_storage, tmp_path):
+    calculator = test_models.MockFeatureCalculator(time_minutes=42)
+    reenhancer = Reenhancer(
+        estates_storage,
+        {"pid_commute_time": calculator},
+        checkpoint_path=tmp_path / "checkpoint.txt",
+        batch_size=10,
+        progress=False,
+    )
+    assert await reenhancer.run() == 25
+
+    stored = await estates_storage.get_all()
+    assert len(stored) == 25
+    assert all(e.features["pid_commute_time"].time_minutes == 42 for e in stored)
+    assert not (tmp_path / "checkpoint.txt").exists()
+
+
+async def test_reenhance_resumes(estates_storage, tmp_path):
+    checkpoint = tmp_path / "checkpoint.txt"
+    done = "\n".join(str(i) for i in range(20))
+    checkpoint.write_text(f"features pid_commute_time\n{done}\n")
+    calculator = test_models.MockFeatureCalculator()
+    reenhancer = Reenhancer(
+        estates_storage,
+        {"pid_commute_time": calculator},
+        checkpoint_path=checkpoint,
+        progress=False,
+    )
+    assert await reenhancer.run() == 5
+    assert sorted(calculator.calculated) == [str(i) for i in range(20, 25)]
+
+
+async def test_route_cache_shares_lookups():
+    lookups = []
+
+    async def fetch(stop_from, stop_to):
+        lookups.append((stop_from, stop_to))
+        await asyncio.sleep(0.01)
+        return PIDResponse(time_minutes=10, transfers_count=0, path_info="")
+
+    cache = RouteCache()
+    routes = await asyncio.gather(
+        *[cache.get_or_fetch("A", "B", fetch) for _ in range(5)],
+        cache.get_or_fetch("C", "B", fetch),
+    )
+    assert len(routes) == 6
+    assert lookups == [("A", "B"), ("C", "B")]
+
+
+async def test_reenhance_waits_before_calculations(
+    estates_storage, tmp_path, monkeypatch
+):
+    sleeps = []
+
+    async def sleep(seconds):
+        sleeps.append(seconds)
+
+    monkeypatch.setattr("baraky.reenhance.asyncio.sleep", sleep)
+    reenhancer = Reenhancer(
+        estates_storage,
+        {"pid_commute_time": test_models.MockFeatureCalculator()},
+        checkpoint_path=tmp_path / "checkpoint.txt",
+        progress=False,
+    )
+    await reenhancer.run()
+    assert sleeps == [0.1] * 25
+
+
+async def test_reenhance_checkpoint_of_other_features(estates_storage, tmp_path):
+    checkpoint = tmp_path / "checkpoint.txt"
+    checkpoint.write_text("features nearest_stop\n1\n2\n")
+    calculator = test_models.MockFeatureCalculator()
+    reenhancer = Reenhancer(
+        estates_storage,
+        {"pid_commute_time": calculator},
+        checkpoint_path=checkpoint,
+        progress=False,
+        calculator_delays={},
+    )
+    assert await reenhancer.run() == 25
+
+
+class StopCalculator:
+    cost = 0.01
+
+    async def calculate(self, estate):
+        return "Stop"
+
+
+class DependentCalculator:
+    async def calculate(self, estate):
+        if estate.id == "0":
+            return None
+        return test_models.make_commute(from_station=estate.features["stop"])
+
+
+async def test_reenhance_orders_and_merges(estates_storage, fs_storage, tmp_path):
+    tombstones = TombstoneStorage("estate/tombstone/", fs_storage)
+    reenhancer = Reenhancer(
+        estates_storage,
+        {"pid_commute_time": DependentCalculator(), "stop": StopCalculator()},
+        checkpoint_path=tmp_path / "checkpoint.txt",
+        progress=False,
+        calculator_delays={},
+        tombstone_storage=tombstones,
+    )
+    real_enhance = reenhancer._enhance_batch
+
+    async def enhance_while_watching(estates):
+        await real_enhance(estates)
+        # the watcher saves a new price and delists an estate meanwhile
+        changed = (await estates_storage.get_many(["1"]))[0]
+        changed.price = 1
+        await estates_storage.save_many([changed])
+        tombstones.save_many([Tombstone(id="2", delisted_at="2024-01-01T00:00")])
+
+    reenhancer._enhance_batch = enhance_while_watching
+    await reenhancer.run()
+
+    stored = {e.id: e for e in await estates_storage.get_all()}
+    assert "pid_commute_time" not in stored["0"].features
+    assert stored["1"].price == 1
+    assert stored["1"].features["pid_commute_time"].from_station == "Stop"
+    assert "stop" not in stored["2"].features
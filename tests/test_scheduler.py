@@ -0,0 +1,63 @@
+import random
+
+from baraky.scheduler import PollingScheduler, ScheduledJob
+from baraky.settings import PollingSchedulerSettings
+from . import models as test_models
+
+SETTINGS = PollingSchedulerSettings(
+    min_interval_sec=100,
+    max_interval_sec=1000,
+    jitter_sec=0,
+    speedup=0.5,
+    slowdown=2,
+)
+
+
+def _scheduler(clock):
+    return PollingScheduler(clock=clock.time, sleep=clock.sleep, rng=random.Random(0))
+
+
+async def test_scheduler_sleeps_until_next_deadline():
+    clock = test_models.FakeClock()
+    scheduler = _scheduler(clock)
+    fast = ScheduledJob("fast", 200, SETTINGS)
+    slow = ScheduledJob("slow", 500, SETTINGS)
+    scheduler.add(fast)
+    scheduler.add(slow)
+
+    due = await scheduler.next_due()
+    assert {job.name for job in due} == {"fast", "slow"}
+    assert clock.sleeps == []
+    for job in due:
+        scheduler.reschedule(job, changes=1)
+
+    due = await scheduler.next_due()
+    assert [job.name for job in due] == ["fast"]
+    assert clock.sleeps == [100]
+
+    scheduler.reschedule(due[0], changes=1)
+    due = await scheduler.next_due()
+    assert clock.now == 200
+    assert {job.name for job in due} == {"fast"}
+
+
+async def test_scheduler_applies_jitter():
+    clock = test_models.FakeClock()
+    scheduler = _scheduler(clock)
+    job = ScheduledJob("jittered", 100, SETTINGS.model_copy(update={"jitter_sec": 10}))
+    scheduler.reschedule(job, changes=0)
+    await scheduler.next_due()
+    assert 200 <= clock.now <= 210
+
+
+def test_job_interval_adapts_within_bounds():
+    job = ScheduledJob("job", 400, SETTINGS)
+    job.adapt(changes=3)
+    assert job.interval_sec == 200
+    job.adapt(changes=3)
+    job.adapt(changes=3)
+    assert job.interval_sec == SETTINGS.min_interval_sec
+
+    for _ in range(10):
+        job.adapt(changes=0)
+    assert job.interval_sec == SETTINGS.max_interval_sec
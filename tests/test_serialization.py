@@ -0,0 +1,50 @@
+import pytest
+
+from baraky.models import EstateOverview
+from baraky.serialization import (
+    MAGIC,
+    JsonCodec,
+    MsgpackCodec,
+    convert_objects,
+    decode,
+    get_codec,
+)
+from baraky.storages import EstatesStorage
+from . import models as test_models
+
+
+def test_decode_json_and_version_tags():
+    estate = test_models.make_commuting_estate(1)
+    body = JsonCodec().encode(estate)
+
+    assert decode(body, EstateOverview) == estate
+    assert decode(body.decode(), EstateOverview) == estate
+    with pytest.raises(ValueError, match="newer"):
+        decode(MAGIC + bytes((MsgpackCodec.tag, 99)) + b"", EstateOverview)
+    with pytest.raises(ValueError, match="Unknown codec"):
+        get_codec("pickle")
+
+
+def test_msgpack_storage_and_conversion(fs_storage):
+    pytest.importorskip("msgpack")
+    json_storage = EstatesStorage("estate/house/", fs_storage, JsonCodec())
+    json_storage.save_many_sync(
+        [test_models.make_commuting_estate(1), test_models.make_commuting_estate(2)]
+    )
+    msgpack_storage = EstatesStorage("estate/house/", fs_storage, MsgpackCodec())
+    msgpack_storage.save_many_sync([test_models.make_commuting_estate(3)])
+
+    # both formats are read from a mixed archive
+    assert msgpack_storage.get_many_sync(["1", "2", "3"]) == [
+        test_models.make_commuting_estate(1),
+        test_models.make_commuting_estate(2),
+        test_models.make_commuting_estate(3),
+    ]
+    json_size = len(fs_storage.get_bytes_sync("estate/house/1.json"))
+    assert len(fs_storage.get_bytes_sync("estate/house/3.json")) < json_size
+
+    codec = MsgpackCodec()
+    assert convert_objects(fs_storage, "estate/house/", EstateOverview, codec) == 2
+    assert convert_objects(fs_storage, "estate/house/", EstateOverview, codec) == 0
+    assert fs_storage.get_bytes_sync("estate/house/1.json").startswith(MAGIC)
+    assert json_storage.get_many_sync(["1"]) == [test_models.make_commuting_estate(1)]
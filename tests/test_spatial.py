@@ -0,0 +1,107 @@
+from datetime import datetime
+
+import numpy as np
+
+from baraky.models import EstateOverview
+from baraky.spatial import EstateSpatialIndex, NeighbourhoodPriceEnhancer
+from baraky.storages import PriceHistoryStorage
+from . import models as test_models
+
+
+def _located(estate_id, lat, lon, price):
+    return EstateOverview(
+        id=estate_id,
+        price=price,
+        link=f"https://www.example.com/{estate_id}",
+        gps=(lat, lon),
+    )
+
+
+def _grid_index():
+    # 5 x 5 estates about 1 km apart, the price grows to the east
+    index = EstateSpatialIndex()
+    index.add_many(
+        [
+            _located(f"{i}-{j}", 50 + i * 0.009, 14 + j * 0.014, 1000 * (j + 1))
+            for i in range(5)
+            for j in range(5)
+        ]
+    )
+    return index
+
+
+def test_spatial_index_within():
+    index = _grid_index()
+    assert index.within((50.018, 14.028), 0.1) == ["2-2"]
+    assert sorted(index.within((50.018, 14.028), 1.1)) == [
+        "1-2",
+        "2-1",
+        "2-2",
+        "2-3",
+        "3-2",
+    ]
+
+    index.remove_many(["2-2"])
+    assert index.within((50.018, 14.028), 0.1) == []
+
+
+def test_spatial_index_median_nearest_prices():
+    index = _grid_index()
+    medians, counts = index.median_nearest_prices(
+        [(50.018, 14.028), (50.018, 14.0)], k=5, exclude_ids=["2-2", "x"]
+    )
+    # the estate itself is excluded, its 4 neighbours remain plus a diagonal one
+    assert list(counts) == [5, 5]
+    assert medians[0] == 3000
+    assert medians[1] == 1000
+
+    medians, counts = index.median_nearest_prices([(48.0, 14.0)], k=5, max_km=10)
+    assert np.isnan(medians[0]) and counts[0] == 0
+
+
+def test_spatial_index_sync():
+    index = _grid_index()
+    stored = [_located("0-0", 50, 14, 1000), _located("new", 50.0, 14.0, 500)]
+    index.sync(stored)
+
+    assert len(index) == 2
+    assert index.within((50.0, 14.0), 0.1) == ["0-0", "new"]
+    medians, _ = index.median_nearest_prices([(50.0, 14.0)], k=1, exclude_ids=["new"])
+    assert medians[0] == 1000
+
+
+def test_spatial_index_count_added(fs_storage):
+    index = _grid_index()
+    history = PriceHistoryStorage("price_history/", fs_storage)
+    history.append_many_sync(
+        [_located("0-0", 0, 0, 1), _located("4-4", 0, 0, 1)], datetime(2024, 1, 1)
+    )
+    history.append_many_sync([_located("0-1", 0, 0, 1)], datetime(2024, 2, 1))
+    # a restarted process reads the same times
+    first_seen = PriceHistoryStorage("price_history/", fs_storage).first_seen()
+
+    added = index.count_added_per_cell(first_seen, datetime(2024, 1, 15))
+    assert list(added.values()) == [1]
+    added = index.count_added_per_cell(first_seen, datetime(2023, 1, 1))
+    assert sum(added.values()) == 3
+    assert index.count_added_per_cell(first_seen, datetime(2024, 3, 1)) == {}
+
+
+async def test_neighbourhood_price_enhancer(watcher, mock_client):
+    index = _grid_index()
+    watcher.feature_calculators["neighbourhood_price"] = NeighbourhoodPriceEnhancer(
+        index, k=4
+    )
+    mock_client.data = [
+        _located("cheap", 50.018, 14.028, 1500),
+        test_models.make_estate(1),
+    ]
+
+    await watcher.update()
+
+    cheap = watcher.output_queue.data[0]
+    assert cheap.id == "cheap"
+    assert cheap.price_ratio == 0.5
+    features = {e.id: e.features for e in watcher.storage.data}
+    assert features["1"]["neighbourhood_price"].price_ratio is None
+    assert features["1"]["pid_commute_time"] is not None
@@ -0,0 +1,69 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).parent.parent
+HEAVY = {"telegram", "minio", "scipy", "pandas", "numpy", "tqdm"}
+
+
+def _import_times(code, cwd=ROOT):
+    env = os.environ | {
+        "PYTHONPATH": str(ROOT),
+        "MINIO_ACCESS_KEY": "key",
+        "MINIO_SECRET_KEY": "secret",
+    }
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        cwd=cwd,
+        env=env,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, module = line.split("|")
+        times[module.strip()] = int(cumulative_us)
+    return times
+
+
+def test_import_main_is_light():
+    times = _import_times("import main")
+    assert not HEAVY & times.keys()
+    # generous bound, the heavy imports alone used to take over a second
+    assert times["main"] < 1_000_000
+
+
+@pytest.fixture(name="sync_cwd")
+def _fix_sync_cwd(tmp_path):
+    stops = {"stopGroups": [{"idosName": "Beroun", "avgLat": 49.9, "avgLon": 14.0}]}
+    (tmp_path / "all_stops.json").write_text(json.dumps(stops))
+    (tmp_path / "query.json").write_text("{}")
+    return tmp_path
+
+
+def test_sync_does_not_import_telegram(sync_cwd):
+    code = (
+        "import argparse, main;"
+        "main.setup_watcher(argparse.Namespace("
+        "query_path=['query.json'], force_refresh_sec=1,"
+        "journal_path='journal.jsonl', profile=None, trace_out=None,"
+        "redis_url=None, cpu_workers=0), cpu_pool=None)"
+    )
+    times = _import_times(code, cwd=sync_cwd)
+    assert "scipy" in times
+    assert "telegram" not in times
+    assert "pandas" not in times
+
+
+def test_notifier_does_not_import_scipy():
+    code = "import main; from baraky import notifications, storages"
+    times = _import_times(code)
+    assert "telegram" in times
+    assert not {"scipy", "pandas", "numpy", "tqdm"} & times.keys()
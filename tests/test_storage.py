@@ -1,5 +1,6 @@
 import baraky.storages as storages
-from baraky.models import EstateOverview
+from datetime import datetime, timedelta
+from baraky.models import EstateOverview, QueryFingerprint, SearchState
 
 
 async def test_fs_storage_get_ids(fs_storage, monkeypatch):
@@ -40,3 +41,58 @@ async def test_fs_storage_save(fs_storage, monkeypatch):
 
     assert len(written_models) == 1
     assert written_models[0] == models[0]
+
+
+def test_search_state_storage_roundtrip(fs_storage):
+    state_storage = storages.SearchStateStorage("search_state/", fs_storage)
+    assert state_storage.get_all() == {}
+
+    state = SearchState(
+        fingerprint=QueryFingerprint(result_size=3, digest="abc"),
+        last_full_fetch=datetime(2024, 1, 1, 12, 0),
+    )
+    state_storage.save("houses", state)
+
+    assert state_storage.get_all() == {"houses": state}
+
+
+def test_price_history_queries(fs_storage):
+    history = storages.PriceHistoryStorage("price_history/", fs_storage)
+    day = datetime(2024, 1, 1)
+    estate = EstateOverview(id="1", price=100, link="", gps=(0, 0))
+    other = EstateOverview(id="2", price=50, link="", gps=(0, 0))
+
+    history.append_many_sync([estate, other], timestamp=day)
+    estate.price = 90
+    history.append_many_sync([estate], timestamp=day + timedelta(days=5))
+    estate.price = 95
+    history.append_many_sync([estate], timestamp=day + timedelta(days=10))
+
+    assert [p.price for p in history.history("1")] == [100, 90, 95]
+    assert history.history("3") == []
+
+    drops = history.drops(days=7, now=day + timedelta(days=10))
+    assert [(d.id, d.previous_price, d.price) for d in drops] == [("1", 100, 90)]
+    assert history.drops(days=3, now=day + timedelta(days=10)) == []
+
+    state = history.as_of(day + timedelta(days=7))
+    assert {k: p.price for k, p in state.items()} == {"1": 90, "2": 50}
+    assert history.as_of(day - timedelta(days=1)) == {}
+
+
+def test_price_history_compaction(fs_storage):
+    history = storages.PriceHistoryStorage("price_history/", fs_storage)
+    day = datetime(2024, 1, 1, 8)
+    estate = EstateOverview(id="1", price=100, link="", gps=(0, 0))
+    for hour in range(3):
+        estate.price -= 10
+        history.append_many_sync([estate], timestamp=day + timedelta(hours=hour))
+    history.append_many_sync([estate], timestamp=day + timedelta(days=1))
+    assert len(history.history("1")) == 4
+
+    assert history.compact_sync(now=day + timedelta(days=1)) == 3
+    assert history.compact_sync(now=day + timedelta(days=1)) == 0
+    assert len(fs_storage.list_ids_sync("price_history/")) == 2
+    assert [p.price for p in history.history("1")] == [90, 80, 70, 70]
+    reader = storages.PriceHistoryStorage("price_history/", fs_storage)
+    assert reader.history("1") == history.history("1")
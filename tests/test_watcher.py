@@ -1,6 +1,18 @@
+import asyncio
 import pytest
+from datetime import timedelta
 from . import models as test_models
-from baraky.models import EstateOverview
+from baraky.estate_watcher import EstateWatcher, WatchedSearch
+from baraky.journal import CycleJournal
+from baraky.scheduler import PollingScheduler
+from baraky.models import EstateOverview, QueryFingerprint
+from baraky.storages import (
+    EstatesHitQueue,
+    EstatesStorage,
+    PriceHistoryStorage,
+    SearchStateStorage,
+    TombstoneStorage,
+)
 
 
 async def test_watcher_update_cycle(watcher):
@@ -32,30 +44,355 @@ async def test_watcher_update_cycle(watcher):
     assert len(storage.data) == 2
     assert len(queue.data) == 1
     assert len(queue.data) == len(new_estates)
-    assert queue.data[0] == new_estates[0]
+    assert queue.data[0].id == new_estates[0].id
     assert storage.data[1] == new_estates[0]
 
 
+async def test_watcher_multiple_searches_dedup(mock_storage):
+    shared, only_a, only_b = [test_models.make_estate(i) for i in (1, 2, 3)]
+    client_a, client_b = test_models.MockClient(), test_models.MockClient()
+    client_a.data = [shared, only_a]
+    client_b.data = [test_models.make_estate(1), only_b]
+    queue_a, queue_b = test_models.MockQueue(), test_models.MockQueue()
+    calculator = test_models.MockFeatureCalculator()
+
+    watcher = EstateWatcher(
+        client=None,
+        storage=mock_storage,
+        output_queue=None,
+        feature_calculators={"pid_commute_time": calculator},
+        searches=[
+            WatchedSearch("a", client_a, queue_a),
+            WatchedSearch("b", client_b, queue_b, filter_fn=lambda e: e.id != "3"),
+        ],
+        progress=False,
+    )
+    mock_storage.data = []
+
+    await watcher.update()
+
+    assert sorted(calculator.calculated) == ["1", "2", "3"]
+    assert sorted(e.id for e in mock_storage.data) == ["1", "2", "3"]
+    assert sorted(m.id for m in queue_a.data) == ["1", "2"]
+    assert [m.id for m in queue_b.data] == ["1"]
+
+
 async def test_watcher_cycles(watcher, monkeypatch):
-    timer = test_models.DeterministicCycleTimer(max_elapsed=2)
+    clock = test_models.FakeClock(max_sleeps=1)
+    watcher.scheduler = PollingScheduler(clock=clock.time, sleep=clock.sleep)
 
     update_invoked_times = 0
 
-    async def update_patch():
+    async def update_patch(searches=None):
         nonlocal update_invoked_times
         update_invoked_times += 1
+        return {}
 
     monkeypatch.setattr(watcher, "update", update_patch)
 
-    watcher.timer = timer
-    assert timer.elapsed_count == 0
-
     with pytest.raises(test_models.MaxElapsedError) as _:
         await watcher.watch()
 
-    assert timer.elapsed_count == 2
+    assert len(clock.sleeps) == 1
+    assert clock.sleeps[0] >= watcher.interval_sec
     assert update_invoked_times == 2
 
 
+async def test_watcher_update_counts_changes_per_search(watcher, mock_client):
+    mock_client.data = [test_models.make_estate(1), test_models.make_estate(2)]
+    changes = await watcher.update()
+    assert changes == {"default": 2}
+
+    changes = await watcher.update()
+    assert changes == {"default": 0}
+
+
+async def test_watcher_records_price_history(watcher, mock_client, fs_storage):
+    watcher.price_history = PriceHistoryStorage("price_history/", fs_storage)
+    mock_client.data = [test_models.make_estate(1), test_models.make_estate(2)]
+    await watcher.update()
+    mock_client.data = [
+        test_models.make_estate(1, price=500),
+        test_models.make_estate(2),
+    ]
+    await watcher.update()
+
+    history = watcher.price_history.history("1")
+    assert [p.price for p in history] == [1000, 500]
+    assert history[0].commute_minutes is not None
+    assert len(watcher.price_history.history("2")) == 1
+
+
+def _tombstoning_watcher(fs_storage, client_a, client_b):
+    queue = EstatesHitQueue("filtered/", fs_storage)
+    return EstateWatcher(
+        client=None,
+        storage=EstatesStorage("estate/house/", fs_storage),
+        output_queue=None,
+        feature_calculators={"pid_commute_time": test_models.MockFeatureCalculator()},
+        searches=[
+            WatchedSearch("a", client_a, queue),
+            WatchedSearch("b", client_b, queue),
+        ],
+        progress=False,
+        tombstone_storage=TombstoneStorage("estate/tombstone/", fs_storage),
+        state_storage=SearchStateStorage("search_state/", fs_storage),
+    )
+
+
+async def test_watcher_tombstones_delisted(fs_storage):
+    client_a, client_b = test_models.MockClient(), test_models.MockClient()
+    client_a.data = [test_models.make_estate(1), test_models.make_estate(2)]
+    client_b.data = [test_models.make_estate(3)]
+    watcher = _tombstoning_watcher(fs_storage, client_a, client_b)
+    await watcher.update()
+    assert watcher.searches[0].output_queue.total() == 3
+
+    client_a.data = [test_models.make_estate(1)]
+    await watcher.update()
+
+    assert sorted(await watcher.storage.list_ids()) == ["1", "3"]
+    assert list(watcher.tombstone_storage.get_all()) == ["2"]
+    queue = watcher.searches[0].output_queue
+    assert queue.total() == 2
+    assert queue.purge(["1", "3"]) == 2
+
+
+async def test_watcher_tombstones_across_restarts(fs_storage):
+    client_a, client_b = test_models.MockClient(), test_models.MockClient()
+    client_a.data = [test_models.make_estate(1), test_models.make_estate(2)]
+    client_b.data = [test_models.make_estate(3)]
+    await _tombstoning_watcher(fs_storage, client_a, client_b).update()
+
+    # e.g. the next run of the sync command, search b did not change
+    client_a.data = [test_models.make_estate(1)]
+    watcher = _tombstoning_watcher(fs_storage, client_a, client_b)
+    await watcher.update()
+    assert client_b.read_all_count == 1
+    assert sorted(await watcher.storage.list_ids()) == ["1", "3"]
+    assert list(watcher.tombstone_storage.get_all()) == ["2"]
+
+    # a relisted estate is stored again and loses its tombstone
+    client_a.data = [test_models.make_estate(1), test_models.make_estate(2)]
+    watcher = _tombstoning_watcher(fs_storage, client_a, client_b)
+    await watcher.update()
+    assert sorted(await watcher.storage.list_ids()) == ["1", "2", "3"]
+    assert watcher.tombstone_storage.get_all() == {}
+
+
+async def test_watcher_keeps_estates_after_incomplete_read(fs_storage):
+    client_a, client_b = test_models.MockClient(), test_models.MockClient()
+    client_a.data = [test_models.make_estate(1), test_models.make_estate(2)]
+    client_b.data = [test_models.make_estate(3)]
+    watcher = _tombstoning_watcher(fs_storage, client_a, client_b)
+    await watcher.update()
+
+    # the probe still reports two estates, so a page is missing
+    fingerprint = QueryFingerprint(result_size=2, digest="changed")
+    client_a.data = [test_models.make_estate(1)]
+    client_a.probe = lambda session=None: _returning(fingerprint)
+    await watcher.update()
+
+    assert sorted(await watcher.storage.list_ids()) == ["1", "2", "3"]
+    assert watcher.tombstone_storage.get_all() == {}
+    # the incomplete read is not remembered, so the same probe reads again
+    read_count = client_a.read_all_count
+    await watcher.update()
+    assert client_a.read_all_count == read_count + 1
+
+
+async def _returning(value):
+    return value
+
+
+async def test_watcher_reuses_features_with_unchanged_inputs(watcher, mock_client):
+    calculator = watcher.feature_calculators["pid_commute_time"]
+    calculator.inputs = ("gps",)
+    calculator.version = 1
+    mock_client.data = [test_models.make_estate(1), test_models.make_estate(2)]
+    await watcher.update()
+    assert sorted(calculator.calculated) == ["1", "2"]
+
+    moved = test_models.make_estate(2, price=300)
+    moved.gps = (10.0, 10.0)
+    mock_client.data = [test_models.make_estate(1, price=500), moved]
+    await watcher.update()
+    assert sorted(calculator.calculated) == ["1", "2", "2"]
+    saved = {e.id: e for e in watcher.storage.data}
+    assert saved["1"].price == 500
+    assert saved["1"].features["pid_commute_time"].time_minutes == 30
+
+    calculator.version = 2
+    mock_client.data = [test_models.make_estate(1, price=400), moved]
+    await watcher.update()
+    assert sorted(calculator.calculated) == ["1", "1", "2", "2"]
+
+
 async def test_watcher_enhance_estates():
     pass
+
+
+async def test_watcher_pipeline_saves_before_cycle_ends(watcher, mock_client):
+    release_last = asyncio.Event()
+    calculator = test_models.MockFeatureCalculator()
+
+    class BlockingCalculator:
+        async def calculate(self, estate_overview):
+            if estate_overview.id == "3":
+                await release_last.wait()
+            return await calculator.calculate(estate_overview)
+
+    watcher.feature_calculators = {"pid_commute_time": BlockingCalculator()}
+    mock_client.data = [test_models.make_estate(i) for i in (1, 2, 3)]
+    update = asyncio.create_task(watcher.update())
+
+    async def _wait_for_first_two():
+        while len(watcher.storage.data) < 2:
+            await asyncio.sleep(0.01)
+
+    await asyncio.wait_for(_wait_for_first_two(), timeout=5)
+    assert [m.id for m in watcher.output_queue.data] == ["1", "2"]
+    assert not update.done()
+
+    release_last.set()
+    changes = await asyncio.wait_for(update, timeout=5)
+    assert changes == {"default": 3}
+    assert [e.id for e in watcher.storage.data] == ["1", "2", "3"]
+
+
+async def test_watcher_pipeline_propagates_errors(watcher, mock_client):
+    class FailingCalculator:
+        async def calculate(self, estate_overview):
+            raise RuntimeError("PID is down")
+
+    watcher.feature_calculators = {"pid_commute_time": FailingCalculator()}
+    mock_client.data = [test_models.make_estate(i) for i in range(50)]
+
+    with pytest.raises(ExceptionGroup):
+        await asyncio.wait_for(watcher.update(), timeout=5)
+    assert watcher.storage.data == []
+
+
+async def test_watcher_skips_unchanged_search(watcher, mock_client, mock_storage):
+    mock_storage.data = []
+    mock_client.data = [test_models.make_estate(1), test_models.make_estate(2)]
+
+    await watcher.update()
+    await watcher.update()
+    assert mock_client.read_all_count == 1
+
+    mock_client.data = [test_models.make_estate(i) for i in (1, 2, 3)]
+    await watcher.update()
+    assert mock_client.read_all_count == 2
+    assert sorted(e.id for e in mock_storage.data) == ["1", "2", "3"]
+
+
+async def test_watcher_forces_refresh(watcher, mock_client, mock_storage):
+    watcher.force_refresh = timedelta(seconds=0)
+    mock_storage.data = []
+    mock_client.data = [test_models.make_estate(1)]
+
+    await watcher.update()
+    await watcher.update()
+    assert mock_client.read_all_count == 2
+
+
+async def test_watcher_resumes_interrupted_cycle(watcher, mock_client, tmp_path):
+    journal_path = tmp_path / "journal.jsonl"
+    calculator = test_models.MockFeatureCalculator()
+
+    class CrashingCalculator:
+        async def calculate(self, estate_overview):
+            if estate_overview.id == "3":
+                raise RuntimeError("OOM")
+            return await calculator.calculate(estate_overview)
+
+    watcher.journal = CycleJournal(journal_path)
+    watcher.feature_calculators = {"pid_commute_time": CrashingCalculator()}
+    watcher.save_batch_size = 1
+    mock_client.data = [test_models.make_estate(i) for i in range(1, 5)]
+
+    with pytest.raises(ExceptionGroup):
+        await watcher.update()
+    watcher.journal.close()
+    assert journal_path.exists()
+    notified_before = [m.id for m in watcher.output_queue.data]
+    saved_before = [e.id for e in watcher.storage.data]
+    assert "3" not in notified_before
+
+    # a fresh process with the same journal, storage and queue
+    restarted = EstateWatcher(
+        mock_client,
+        watcher.storage,
+        watcher.output_queue,
+        feature_calculators={"pid_commute_time": calculator},
+        progress=False,
+        journal=CycleJournal(journal_path),
+    )
+    calculator.calculated = []
+    await restarted.update()
+
+    assert "1" not in calculator.calculated
+    assert "3" in calculator.calculated
+    notified = [m.id for m in restarted.output_queue.data]
+    assert sorted(notified) == ["1", "2", "3", "4"]
+    assert sorted(e.id for e in restarted.storage.data) == ["1", "2", "3", "4"]
+    assert len(saved_before) < 4
+    assert not journal_path.exists()
+
+
+def test_journal_skips_saved_and_restores_features(tmp_path):
+    journal = CycleJournal(tmp_path / "journal.jsonl")
+    estates = [test_models.make_estate(1), test_models.make_estate(2)]
+    journal.start(estates, {"1": ["a"], "2": ["a", "b"]})
+    estates[0].features["pid_commute_time"] = test_models.make_commute(10)
+    journal.record_enhanced(estates[0])
+    journal.record_notified("a", estates[0])
+    journal.record_enhanced(estates[1])
+    journal.record_saved([estates[1]])
+    journal.close()
+    with open(journal.path, "a") as fp:
+        fp.write('{"type": "notif')
+
+    resumed = CycleJournal(journal.path)
+    unsaved, matches = resumed.load()
+    assert [e.id for e in unsaved] == ["1"]
+    assert matches["2"] == ["a", "b"]
+    assert resumed.restore_features(unsaved[0])
+    assert unsaved[0].features["pid_commute_time"].time_minutes == 10
+    assert resumed.was_notified("a", unsaved[0])
+    assert not resumed.was_notified("b", unsaved[0])
+    resumed.finish()
+    assert resumed.load() is None
+
+
+def test_journal_keeps_notified_without_sync(tmp_path):
+    journal = CycleJournal(tmp_path / "journal.jsonl")
+    estate = test_models.make_estate(1)
+    journal.start([estate], {"1": ["a"]})
+    journal.record_notified("a", estate)
+
+    # the process is killed before the batch is synced or closed
+    resumed = CycleJournal(journal.path)
+    unsaved, _ = resumed.load()
+    assert resumed.was_notified("a", unsaved[0])
+    journal.close()
+    resumed.close()
+
+
+async def test_journal_syncs_once_per_batch(tmp_path, monkeypatch):
+    synced = []
+    monkeypatch.setattr("baraky.journal.os.fsync", synced.append)
+    journal = CycleJournal(tmp_path / "journal.jsonl")
+    estates = [test_models.make_estate(1), test_models.make_estate(2)]
+    journal.start(estates, {})
+    for estate in estates:
+        journal.record_enhanced(estate)
+        journal.record_notified("a", estate)
+    assert len(synced) == 1
+
+    journal.record_saved(estates)
+    await journal.sync()
+    assert len(synced) == 2
+    assert len(journal.path.read_text().splitlines()) == 6
+    journal.finish()
@@ -0,0 +1,189 @@
+import asyncio
+import os
+import uuid
+
+import pytest
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+from baraky.estate_watcher import EstateWatcher
+from baraky.filters import FilterChain, Predicate
+from baraky.models import PIDResponse
+from baraky.settings import RedisSettings
+from baraky.workers import EnhanceWorker, RedisRouteCache, RemoteEnhancer, connect
+from . import models as test_models
+
+
+@pytest.fixture(name="redis_settings")
+def _fix_redis_settings():
+    # every test gets its own keys, so a shared server can be used
+    prefix = f"baraky-test:{uuid.uuid4().hex}:"
+    return RedisSettings(
+        url=os.environ.get("REDIS_URL", "redis://localhost:6379/15"),
+        stream=prefix + "enhance",
+        reply_prefix=prefix + "enhanced:",
+        route_prefix=prefix + "route:",
+        block_ms=100,
+        reply_timeout_sec=5,
+    )
+
+
+@pytest.fixture(name="redis_client")
+async def _fix_redis_client(redis_settings):
+    client = connect(redis_settings)
+    try:
+        await client.ping()
+    except (RedisConnectionError, OSError):
+        await client.aclose()
+        pytest.skip("Redis server is not available")
+    yield client
+    keys = await client.keys(redis_settings.stream.removesuffix("enhance") + "*")
+    if keys:
+        await client.delete(*keys)
+    await client.aclose()
+
+
+async def test_worker_round_trip(redis_client, redis_settings):
+    calculator = test_models.MockFeatureCalculator()
+    worker = EnhanceWorker(
+        redis_client,
+        {"pid_commute_time": calculator},
+        redis_settings,
+        consumer_name="worker-1",
+    )
+    estates = [test_models.make_estate(1), test_models.make_estate(2)]
+
+    worker_task = asyncio.create_task(worker.run(max_entries=2))
+    enhancer = RemoteEnhancer(redis_client, redis_settings)
+    enhanced = [e async for e in enhancer.enhance_many(estates)]
+    await worker_task
+
+    assert sorted(e.id for e in enhanced) == ["1", "2"]
+    assert all("pid_commute_time" in e.features for e in enhanced)
+    assert sorted(calculator.calculated) == ["1", "2"]
+    pending = await redis_client.xpending(redis_settings.stream, redis_settings.group)
+    assert pending["pending"] == 0
+    # acknowledged entries do not pile up in the stream
+    assert await redis_client.xlen(redis_settings.stream) == 0
+
+
+async def test_worker_claims_entries_of_dead_worker(redis_client, redis_settings):
+    redis_settings.claim_idle_ms = 0
+    enhancer = RemoteEnhancer(redis_client, redis_settings)
+    results = enhancer.enhance_many([test_models.make_estate(1)])
+    reply = asyncio.ensure_future(anext(results))
+    # the dead worker reads the entry but never acknowledges it
+    while not await redis_client.exists(redis_settings.stream):
+        await asyncio.sleep(0.01)
+    await redis_client.xreadgroup(
+        redis_settings.group, "dead", {redis_settings.stream: ">"}, count=1
+    )
+
+    calculator = test_models.MockFeatureCalculator()
+    worker = EnhanceWorker(
+        redis_client, {"pid_commute_time": calculator}, redis_settings, "alive"
+    )
+    await worker.run(max_entries=1)
+
+    assert (await reply).id == "1"
+    assert calculator.calculated == ["1"]
+    await results.aclose()
+
+
+async def test_worker_waits_before_calculations(monkeypatch):
+    sleeps = []
+
+    async def sleep(seconds):
+        sleeps.append(seconds)
+
+    monkeypatch.setattr("baraky.workers.asyncio.sleep", sleep)
+    worker = EnhanceWorker(
+        None, {"pid_commute_time": test_models.MockFeatureCalculator()}
+    )
+    await worker.enhance_estate(test_models.make_estate(1))
+    await worker.enhance_estate(test_models.make_estate(2))
+    assert sleeps == [0.1, 0.1]
+
+
+async def test_redis_route_cache(redis_client, redis_settings):
+    fetched = []
+
+    async def fetch(stop_from, stop_to):
+        fetched.append((stop_from, stop_to))
+        return PIDResponse(time_minutes=30, transfers_count=1, path_info="A->B")
+
+    first = RedisRouteCache(redis_client, redis_settings)
+    second = RedisRouteCache(redis_client, redis_settings)
+    await first.get_or_fetch("A", "B", fetch)
+    route = await second.get_or_fetch("A", "B", fetch)
+
+    assert fetched == [("A", "B")]
+    assert route == PIDResponse(time_minutes=30, transfers_count=1, path_info="A->B")
+
+
+class LocalRemoteEnhancer:
+    def __init__(self, calculator):
+        self.feature_calculators = {"pid_commute_time": calculator}
+        self.worker = EnhanceWorker(
+            None, self.feature_calculators, calculator_delays={}
+        )
+        self.published = []
+
+    async def enhance_many(self, estates):
+        self.published.extend(e.id for e in estates)
+        for estate in estates:
+            # a copy, as published estates come back from Redis
+            estate = estate.model_copy(deep=True)
+            await self.worker.enhance_estate(estate)
+            yield estate
+
+
+async def test_watcher_with_remote_enhancer(mock_storage):
+    client = test_models.MockClient()
+    client.data = [test_models.make_estate(1), test_models.make_estate(9)]
+    queue = test_models.MockQueue()
+    remote = LocalRemoteEnhancer(test_models.MockFeatureCalculator())
+    watcher = EstateWatcher(
+        client=client,
+        storage=mock_storage,
+        output_queue=queue,
+        filter_fn=FilterChain(
+            [
+                Predicate(lambda e: e.price < 5000),
+                Predicate(lambda e: True, requires=["pid_commute_time"]),
+            ]
+        ),
+        progress=False,
+        remote_enhancer=remote,
+    )
+
+    await watcher.update()
+
+    # the rejected estate is saved without being published
+    assert remote.published == ["1"]
+    assert [m.id for m in queue.data] == ["1"]
+    assert sorted(e.id for e in mock_storage.data) == ["1", "9"]
+
+
+class KeyedCalculator(test_models.MockFeatureCalculator):
+    inputs = ("gps",)
+
+
+async def test_watcher_carries_remote_features_over(mock_storage):
+    client = test_models.MockClient()
+    client.data = [test_models.make_estate(1)]
+    calculator = KeyedCalculator()
+    watcher = EstateWatcher(
+        client=client,
+        storage=mock_storage,
+        output_queue=test_models.MockQueue(),
+        progress=False,
+        remote_enhancer=LocalRemoteEnhancer(calculator),
+    )
+    await watcher.update()
+    client.data = [test_models.make_estate(1, price=500)]
+    await watcher.update()
+
+    # the commute does not change with the price, the worker skips it
+    assert calculator.calculated == ["1"]
+    assert mock_storage.data[-1].price == 500
+    assert "pid_commute_time" in mock_storage.data[-1].features